@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Venue fleet aggregator: one process, one core, thousands of hats.
+
+Devices push 44-byte UDP telemetry (see RPi/fleet_client.py, the one copy
+this directory imports) every second or so. The aggregator:
+
+- keeps per-device state in flat NumPy arrays indexed by a slot per device
+  (a dict maps device id -> slot), so a datagram is one unpack and a few
+  array stores, and nothing is allocated per packet
+- every TICK_S computes the venue heatmaps (mean brightness, loudness and
+  flicker, device count, share of devices with the visor down per cell)
+  with np.bincount over the live devices: O(devices) in C, no Python loop
+- picks a recommendation per cell from the heatmap (light from brightness
+  and flicker, audio from loudness, same rules as the mock in
+  recommender.py) and sends it to each device in a cell whose
+  recommendation changed, plus to everyone every REFRESH_S (UDP may drop)
+- serves the state for venue staff over HTTP:
+    GET /heatmap   {"grid": [rows, cols], "brightness": [[...]], "loudness": ..., ...}
+    GET /devices   live/stale counts, packets/s, per-cell recommendations
+    GET /health
+
+Devices that haven't reported for STALE_S drop out of the heatmaps; after
+FORGET_S their slot is reused.
+
+    python aggregator.py --port 9900 --http 8090 --grid 16x16
+    python simulate_fleet.py --devices 2000          # in another shell
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# The wire format lives with the device code (RPi/fleet_client.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "RPi"))
+from fleet_client import (MAGIC, VERSION, HEADER, TELEMETRY, KIND_TELEMETRY, FLEET_PORT,
+                          AUDIO_PATTERNS, LIGHT_PATTERNS, LEVELS, pack_recommend)
+
+HTTP_PORT  = 8090
+GRID       = (16, 16)       # venue cells (rows, cols); devices report row,col
+TICK_S     = 1.0            # heatmap + recommendation period
+REFRESH_S  = 10.0           # resend unchanged recommendations this often
+STALE_S    = 5.0            # not in the heatmap after this long without telemetry
+FORGET_S   = 60.0           # slot freed after this long
+CAPACITY   = 1024           # initial slots; doubles as needed
+
+# Cell rules (0-1 scales as the devices report them)
+BRIGHT_T   = 0.6
+FLICKER_T  = 0.35
+LOUD_T     = 0.5
+NOISY_T    = 0.2
+
+_AUDIO = {name: i for i, name in enumerate(AUDIO_PATTERNS)}
+_LIGHT = {name: i for i, name in enumerate(LIGHT_PATTERNS)}
+
+# Per-device columns (float32 telemetry fields, in wire order)
+_VALUES = ("brightness", "flicker", "above_threshold", "loudness", "loudness_p90", "loud_fraction")
+
+
+class Fleet:
+    """Per-device state and the venue heatmaps"""
+
+    def __init__(self, grid=GRID, capacity=CAPACITY):
+        self.rows, self.cols = grid
+        self.slots = {}                 # device id -> slot
+        self.free = []
+        self.size = 0                   # slots ever used
+        self.addr = [None] * capacity   # slot -> (host, port)
+        self._alloc(capacity)
+        self.packets = 0
+        self.bad = 0
+        self.snapshot = {}              # last tick's heatmaps/summary, for HTTP
+
+    def _alloc(self, capacity):
+        old = getattr(self, "values", None)
+        values = np.zeros((len(_VALUES), capacity), np.float32)
+        device = np.zeros(capacity, np.uint32)
+        cell = np.zeros(capacity, np.int32)
+        down = np.zeros(capacity, np.uint8)
+        seen = np.full(capacity, -np.inf)
+        sent_rec = np.full(capacity, -1, np.int32)     # last (audio << 8 | light) sent
+        sent_at = np.full(capacity, -np.inf)
+        if old is not None:
+            n = old.shape[1]
+            values[:, :n] = old
+            device[:n], cell[:n], down[:n], seen[:n] = self.device, self.cell, self.down, self.seen
+            sent_rec[:n], sent_at[:n] = self.sent_rec, self.sent_at
+            self.addr.extend([None] * (capacity - n))
+        self.values, self.device, self.cell, self.down, self.seen = values, device, cell, down, seen
+        self.sent_rec, self.sent_at = sent_rec, sent_at
+        self.capacity = capacity
+
+    def ingest(self, data, addr, now):
+        """One telemetry datagram"""
+        if len(data) < HEADER.size + TELEMETRY.size:
+            self.bad += 1
+            return
+        magic, version, kind, cell, seq, device = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or kind != KIND_TELEMETRY:
+            self.bad += 1
+            return
+        b, f, above, l, p90, lf, down = TELEMETRY.unpack_from(data, HEADER.size)
+        slot = self.slots.get(device)
+        if slot is None:
+            slot = self._new_slot(device)
+        row = min(cell >> 8, self.rows - 1)
+        col = min(cell & 0xFF, self.cols - 1)
+        v = self.values
+        v[0, slot] = b
+        v[1, slot] = f
+        v[2, slot] = above
+        v[3, slot] = l
+        v[4, slot] = p90
+        v[5, slot] = lf
+        self.cell[slot] = row * self.cols + col
+        self.down[slot] = down
+        self.seen[slot] = now
+        self.addr[slot] = addr
+        self.packets += 1
+
+    def _new_slot(self, device):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._alloc(self.capacity * 2)
+            slot = self.size
+            self.size += 1
+        self.slots[device] = slot
+        self.device[slot] = device
+        self.sent_rec[slot] = -1
+        self.sent_at[slot] = -np.inf
+        return slot
+
+    def forget(self, now):
+        """Free the slots of devices silent for FORGET_S"""
+        gone = np.nonzero(self.seen[:self.size] < now - FORGET_S)[0]
+        for slot in gone.tolist():
+            if self.addr[slot] is None:
+                continue
+            del self.slots[int(self.device[slot])]
+            self.addr[slot] = None
+            self.seen[slot] = -np.inf
+            self.free.append(slot)
+
+    def heatmaps(self, now):
+        """Per-cell means over the live devices and each cell's recommendation"""
+        n = self.size
+        live = self.seen[:n] >= now - STALE_S
+        cells = self.cell[:n][live]
+        ncell = self.rows * self.cols
+        count = np.bincount(cells, minlength=ncell).astype(np.float64)
+        safe = np.maximum(count, 1)
+        means = {name: np.bincount(cells, weights=self.values[i, :n][live], minlength=ncell) / safe
+                 for i, name in enumerate(_VALUES)}
+        means["visor_down"] = np.bincount(cells, weights=self.down[:n][live], minlength=ncell) / safe
+
+        # Cell recommendation: sustained glare or strobing -> warm/slow light;
+        # loud (90th percentile) -> deeper noise
+        b, f, l = means["brightness"], means["flicker"], means["loudness_p90"]
+        light = np.where(f > FLICKER_T, _LIGHT["breathing_slow"],
+                         np.where(b > BRIGHT_T, _LIGHT["steady_warm"], _LIGHT["steady_cool"]))
+        audio = np.where(l > LOUD_T, _AUDIO["brown_noise_deep"],
+                         np.where(l > NOISY_T, _AUDIO["white_noise_rain"], _AUDIO["pink_noise_soft"]))
+        level = (b > BRIGHT_T).astype(np.int32) + (f > FLICKER_T) + (l > LOUD_T)
+        level = np.minimum(level, len(LEVELS) - 1)
+        total = max(1, int(live.sum()))
+        venue = {
+            "brightness": float(self.values[0, :n][live].sum() / total),
+            "loudness": float(self.values[3, :n][live].sum() / total),
+        }
+        return live, count, means, audio.astype(np.int32), light.astype(np.int32), level, venue
+
+    def tick(self, now, send):
+        """Heatmaps, then recommendations to the devices that need one;
+        returns how many were sent"""
+        live, count, means, audio, light, level, venue = self.heatmaps(now)
+        n = self.size
+        rec = (audio << 8) | light
+        slots = np.nonzero(live)[0]
+        cell = self.cell[:n][slots]
+        want = rec[cell]
+        due = (want != self.sent_rec[:n][slots]) | (self.sent_at[:n][slots] < now - REFRESH_S)
+        sent = 0
+        # One packed body per cell; per device only the header differs
+        bodies = {}
+        for slot, c in zip(slots[due].tolist(), cell[due].tolist()):
+            body = bodies.get(c)
+            if body is None:
+                body = bodies[c] = (int(audio[c]), int(light[c]), int(level[c]), int(count[c]),
+                                    float(means["brightness"][c]), float(means["loudness"][c]),
+                                    venue["brightness"], venue["loudness"])
+            r, col = divmod(c, self.cols)
+            if send(pack_recommend(int(self.device[slot]), 0, (r << 8) | col, *body), self.addr[slot]):
+                sent += 1
+        self.sent_rec[slots[due]] = want[due]
+        self.sent_at[slots[due]] = now
+
+        shape = (self.rows, self.cols)
+        live_cells = count > 0
+        self.snapshot = {
+            "t": now,
+            "grid": [self.rows, self.cols],
+            "devices": int(live.sum()),
+            "stale": int(n - len(self.free) - live.sum()),
+            "venue": venue,
+            "count": count.reshape(shape).astype(int).tolist(),
+            "brightness": np.round(means["brightness"], 3).reshape(shape).tolist(),
+            "loudness": np.round(means["loudness"], 3).reshape(shape).tolist(),
+            "flicker": np.round(means["flicker"], 3).reshape(shape).tolist(),
+            "visor_down": np.round(means["visor_down"], 3).reshape(shape).tolist(),
+            "recommendations": {
+                f"{c // self.cols},{c % self.cols}": {"audio": AUDIO_PATTERNS[audio[c]],
+                                                      "light": LIGHT_PATTERNS[light[c]],
+                                                      "level": LEVELS[level[c]], "devices": int(count[c])}
+                for c in np.nonzero(live_cells)[0].tolist()
+            },
+        }
+        return sent
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.fleet.ingest(data, addr, time.monotonic())
+
+    def send(self, data, addr):
+        try:
+            self.transport.sendto(data, addr)
+            return True
+        except OSError:
+            return False
+
+
+class Aggregator:
+    def __init__(self, port=FLEET_PORT, http_port=HTTP_PORT, grid=GRID, host="0.0.0.0"):
+        self.fleet = Fleet(grid)
+        self.port = port
+        self.http_port = http_port
+        self.host = host
+        self.stats = {"packets_per_s": 0.0, "sent_per_s": 0.0, "tick_ms": 0.0}
+        self._proto = None
+        self._http = None
+
+    async def run(self, ready=None):
+        loop = asyncio.get_running_loop()
+        transport, self._proto = await loop.create_datagram_endpoint(
+            lambda: _Protocol(self.fleet), local_addr=(self.host, self.port))
+        self.port = transport.get_extra_info("sockname")[1]
+        if self.http_port is not None:
+            self._start_http()
+        print(f"✓ Fleet aggregator on udp/{self.port}"
+              f"{f', http/{self.http_port}' if self.http_port is not None else ''}, "
+              f"{self.fleet.rows}x{self.fleet.cols} cells")
+        if ready is not None:
+            ready.set()
+        packets, forgot = self.fleet.packets, time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(TICK_S)
+                now = time.monotonic()
+                t0 = time.perf_counter()
+                sent = self.fleet.tick(now, self._proto.send)
+                if now - forgot >= FORGET_S / 4:
+                    self.fleet.forget(now)
+                    forgot = now
+                self.stats = {
+                    "packets_per_s": (self.fleet.packets - packets) / TICK_S,
+                    "sent_per_s": sent / TICK_S,
+                    "tick_ms": (time.perf_counter() - t0) * 1e3,
+                }
+                packets = self.fleet.packets
+        finally:
+            transport.close()
+            if self._http is not None:
+                self._http.shutdown()
+
+    def _start_http(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        agg = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                snap = agg.fleet.snapshot      # replaced whole each tick
+                if self.path.startswith("/heatmap"):
+                    body = {k: snap.get(k) for k in ("t", "grid", "count", "brightness", "loudness",
+                                                     "flicker", "visor_down")}
+                elif self.path.startswith("/devices"):
+                    body = {"devices": snap.get("devices", 0), "stale": snap.get("stale", 0),
+                            "venue": snap.get("venue"), "recommendations": snap.get("recommendations", {}),
+                            "packets": agg.fleet.packets, "bad_packets": agg.fleet.bad, **agg.stats}
+                elif self.path.startswith("/health"):
+                    body = {"status": "ok", "devices": snap.get("devices", 0), **agg.stats}
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer((self.host, self.http_port), Handler)
+        threading.Thread(target=self._http.serve_forever, name="http", daemon=True).start()
+
+
+def parse_grid(spec):
+    rows, _, cols = spec.lower().partition("x")
+    return int(rows), int(cols or rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Venue fleet aggregator')
+    parser.add_argument('--port', type=int, default=int(os.getenv("VYZ_FLEET_PORT", FLEET_PORT)))
+    parser.add_argument('--http', type=int, default=HTTP_PORT, help='Staff HTTP port')
+    parser.add_argument('--grid', type=parse_grid, default=GRID, help='Venue cells, e.g. 16x16')
+    args = parser.parse_args()
+    try:
+        asyncio.run(Aggregator(args.port, args.http, args.grid).run())
+    except KeyboardInterrupt:
+        print("\n✓ Fleet aggregator stopped")
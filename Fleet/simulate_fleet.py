@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Simulated venue: N hats sending fleet telemetry to an aggregator.
+
+Each simulated device behaves like a hat running the camera loop with
+VYZ_FLEET set (what Jetson/server.py and the camera script report, packed
+by RPi/fleet_client.py): it sits in a venue cell, sends one datagram every
+FLEET_EVERY seconds from its own UDP socket, and reads back the zone
+recommendations. The scene is a stage along row 0 (loud) with a spotlight
+sweeping across it (bright, strobing where it points).
+
+Starts aggregator.py in a subprocess (or use --target host:port for one
+that's already running), then checks that:
+- every device shows up in /devices, and the heatmap counts add up to N
+- the heatmap brightness per cell matches what the devices sent
+- every device got a recommendation back
+and reports the aggregator's packets/s, tick time and CPU use.
+
+    python simulate_fleet.py --devices 2000 --seconds 10
+"""
+import json
+import math
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "RPi"))
+from fleet_client import FLEET_EVERY, pack_telemetry, unpack_recommend
+
+
+def scene(row, col, t, rows, cols):
+    """(brightness, flicker, loudness) of a cell at time t"""
+    spot = (math.sin(t / 5.0) * 0.5 + 0.5) * (cols - 1)
+    d = math.hypot(row, col - spot)
+    brightness = 0.2 + 0.7 * math.exp(-d * d / 4.0)
+    flicker = 0.6 if d < 1.0 else 0.05
+    loudness = max(0.05, 0.8 - 0.6 * row / max(1, rows - 1))
+    return brightness, flicker, loudness
+
+
+def _cpu_seconds(pid):
+    """utime + stime of a process (Linux)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            parts = f.read().rsplit(")", 1)[1].split()
+        return (int(parts[11]) + int(parts[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=2) as resp:
+        return json.load(resp)
+
+
+def simulate(devices=1000, seconds=10.0, grid=(16, 16), target=None, http=None, seed=1):
+    rows, cols = grid
+    rng = random.Random(seed)
+    proc = None
+    if target is None:
+        port, http = _free_port(socket.SOCK_DGRAM), http or _free_port(socket.SOCK_STREAM)
+        proc = subprocess.Popen([sys.executable, os.path.join(HERE, "aggregator.py"), "--port", str(port),
+                                 "--http", str(http), "--grid", f"{rows}x{cols}"], cwd=HERE)
+        target = ("127.0.0.1", port)
+        _wait_http(f"http://127.0.0.1:{http}/health")
+    base = f"http://{target[0]}:{http}" if http else None
+
+    sel = selectors.DefaultSelector()
+    fleet = []
+    for i in range(devices):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(("0.0.0.0", 0))
+        row, col = rng.randrange(rows), rng.randrange(cols)
+        dev = {"id": 100000 + i, "cell": (row, col), "sock": sock, "seq": 0,
+               "due": rng.random() * FLEET_EVERY, "rec": None, "sent": {}}
+        sel.register(sock, selectors.EVENT_READ, dev)
+        fleet.append(dev)
+
+    cpu0 = _cpu_seconds(proc.pid) if proc else None
+    t_start = time.monotonic()
+    sent = received = 0
+    try:
+        while True:
+            now = time.monotonic() - t_start
+            if now >= seconds:
+                break
+            for dev in fleet:
+                if dev["due"] > now:
+                    continue
+                row, col = dev["cell"]
+                b, f, l = scene(row, col, now, rows, cols)
+                values = {"brightness": b + rng.gauss(0, 0.02), "flicker": f, "above_threshold": float(b > 0.5),
+                          "loudness": l, "loudness_p90": l * 1.2, "loud_fraction": float(l > 0.5)}
+                try:
+                    dev["sock"].sendto(pack_telemetry(dev["id"], dev["seq"], (row << 8) | col, values,
+                                                      down=b > 0.6), target)
+                    sent += 1
+                except BlockingIOError:
+                    pass
+                dev["sent"] = values
+                dev["seq"] += 1
+                dev["due"] += FLEET_EVERY
+            for key, _ in sel.select(timeout=0.005):
+                dev = key.data
+                try:
+                    while True:
+                        rec = unpack_recommend(key.fileobj.recv(256))
+                        if rec is not None and rec["device"] == dev["id"]:
+                            dev["rec"] = rec
+                            received += 1
+                except BlockingIOError:
+                    pass
+
+        # Let the next tick see the last round
+        time.sleep(1.2)
+        cpu1 = _cpu_seconds(proc.pid) if proc else None
+        result = {"devices": devices, "seconds": seconds, "sent": sent, "received": received}
+        ok = True
+        if base:
+            info = _get(f"{base}/devices")
+            heat = _get(f"{base}/heatmap")
+            counted = sum(map(sum, heat["count"]))
+            # Heatmap brightness vs the mean of what each cell's devices last sent
+            by_cell = {}
+            for dev in fleet:
+                by_cell.setdefault(dev["cell"], []).append(dev["sent"].get("brightness", 0.0))
+            err = max(abs(heat["brightness"][r][c] - sum(v) / len(v)) for (r, c), v in by_cell.items())
+            result.update(live=info["devices"], heatmap_count=counted, max_cell_error=round(err, 4),
+                          aggregator_received=f"{info['packets']}/{sent}", tick_ms=round(info["tick_ms"], 2))
+            ok &= info["devices"] == devices and counted == devices and err < 0.01
+        with_rec = sum(dev["rec"] is not None for dev in fleet)
+        result["devices_with_recommendation"] = with_rec
+        ok &= with_rec == devices
+        if cpu0 is not None and cpu1 is not None:
+            result["aggregator_cpu"] = f"{(cpu1 - cpu0) / (time.monotonic() - t_start) * 100:.1f}% of one core"
+        example = next((d["rec"] for d in fleet if d["rec"] and d["cell"][0] == 0), None)
+        if example:
+            result["stage_row_example"] = (f"cell {example['cell']}: {example['audio']} / {example['light']} "
+                                           f"({example['level']}, {example['devices']} devices)")
+        return ok, result
+    finally:
+        for dev in fleet:
+            dev["sock"].close()
+        if proc:
+            proc.terminate()
+            proc.wait(5)
+
+
+def _free_port(kind):
+    s = socket.socket(socket.AF_INET, kind)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _wait_http(url, timeout=10.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            return _get(url)
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"aggregator did not come up ({url})")
+
+
+if __name__ == "__main__":
+    import argparse
+    from aggregator import parse_grid
+
+    parser = argparse.ArgumentParser(description='Simulated fleet of hats')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--grid', type=parse_grid, default=(16, 16))
+    parser.add_argument('--target', help='host:port of a running aggregator (default: start one)')
+    parser.add_argument('--http', type=int, help="The running aggregator's HTTP port")
+    args = parser.parse_args()
+
+    target = None
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        target = (host, int(port))
+    ok, result = simulate(args.devices, args.seconds, args.grid, target, args.http)
+    for k, v in result.items():
+        print(f"  {k:<28} {v}")
+    print(f"{'✓' if ok else '✗'} fleet simulation")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,111 @@
+"""
+Visor actuator scheduler.
+
+One background thread owns the GPIO/PWM timing, so the vision loop never
+sleeps through a visor move (600 ms servo drive on the Jetson, 10 ms strobe
+pulse on both boards). The loop calls `visor.set(down)`, which only records
+the newest wanted state and returns:
+
+- redundant commands collapse: up/down/up arriving while the thread is busy
+  apply once as "up", and a state equal to the current one is skipped
+- follow-ups (servo duty back to 0, strobe low) run on deadlines after each
+  move; a new move first runs any that are still pending, so the pins are
+  always left in a known state. A skipped (same-state) request leaves them
+  on their deadlines.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+import logs
+
+
+class VisorActuator:
+    def __init__(self, move, followups=(), name="visor", collapsed=None):
+        """move(state_down) drives the hardware; followups are (delay_s, fn)
+        run that long after every move. `collapsed` is an optional Counter."""
+        self._move = move
+        self._followups = tuple(followups)
+        self._collapsed = collapsed
+        self._cv = threading.Condition()
+        self._want = None        # newest requested state, not yet applied
+        self._state = None       # last applied state
+        self._due = []           # heap of (deadline, seq, fn)
+        self._seq = itertools.count()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._log = logs.get(name)
+
+    @property
+    def state(self):
+        return self._state
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def set(self, state_down):
+        """Request a visor state; never blocks"""
+        with self._cv:
+            if self._want is not None:
+                self._count_collapsed()
+            self._want = bool(state_down)
+            self._cv.notify()
+
+    def stop(self, final=None, timeout=2.0):
+        """Optionally move to `final`, let pending follow-ups finish, then stop"""
+        with self._cv:
+            if final is not None:
+                self._want = bool(final)
+            self._stop = True
+            self._cv.notify()
+        self._thread.join(timeout)
+
+    def _count_collapsed(self):
+        if self._collapsed is not None:
+            self._collapsed.inc()
+
+    def _next(self):
+        """Block until there's a move or a due follow-up; None means stop"""
+        with self._cv:
+            while True:
+                now = time.monotonic()
+                if self._want is not None:
+                    want, self._want = self._want, None
+                    if want == self._state:
+                        # Collapsed back to where the visor already is: nothing
+                        # moves, so pending follow-ups keep their deadlines
+                        self._count_collapsed()
+                        continue
+                    pending, self._due = [fn for _, _, fn in sorted(self._due)], []
+                    return want, pending
+                if self._due and self._due[0][0] <= now:
+                    return None, [heapq.heappop(self._due)[2]]
+                if self._stop and not self._due:
+                    return None
+                self._cv.wait(self._due[0][0] - now if self._due else None)
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            want, fns = job
+            for fn in fns:
+                # A failing follow-up mustn't cost the move queued behind it
+                try:
+                    fn()
+                except Exception as e:
+                    self._log.error("✗ Visor follow-up %s failed: %s", getattr(fn, "__name__", fn), e)
+            if want is None:
+                continue
+            try:
+                self._move(want)
+                self._state = want
+                now = time.monotonic()
+                with self._cv:
+                    for delay, fn in self._followups:
+                        heapq.heappush(self._due, (now + delay, next(self._seq), fn))
+            except Exception as e:
+                self._log.error("✗ Visor actuator failed: %s", e)
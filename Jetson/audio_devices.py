@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Audio device manager: keeps the duplex stream running through unplugs.
+
+start_live_processing used to open one sd.Stream on sd.default.device and
+exit on the first error, so a loose USB cable meant SSHing in to restart the
+script. AudioStreamManager owns the stream instead:
+
+- devices are remembered by name, since PortAudio renumbers them when a card
+  comes back; if the wanted one is missing the system default stands in and
+  the manager moves back as soon as it reappears
+- a stream counts as lost when PortAudio stops it or when no callback has
+  arrived for STALL_S (some ALSA drivers just go quiet on unplug)
+- while down it re-enumerates (PortAudio only scans devices at init) each
+  time /proc/asound/cards changes, and at least every RETRY_S regardless
+- `prepare(in_info, out_info)` runs before every open and returns the sample
+  rate and channels to use, so the caller can follow the new device and keep
+  its DSP state when nothing changed
+
+The time from losing the stream to the first callback on the new one is kept
+in `last_recover_s` and handed to `on_recover`.
+
+Simulated unplug / replug / stall against a fake PortAudio (no hardware):
+    python audio_devices.py --selftest
+"""
+import threading
+import time
+
+POLL_S  = 0.25      # watcher period
+STALL_S = 1.0       # no callback for this long = stream lost
+RETRY_S = 2.0       # re-scan this often while down even if no card changed
+CARDS   = "/proc/asound/cards"
+
+INPUT  = "input"
+OUTPUT = "output"
+
+
+def cards_signature(path=CARDS):
+    """The ALSA card list (None where there isn't one); it changes on hot-plug"""
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def find_device(devices, name, kind):
+    """Index of the device called `name` that has `kind` channels, else None"""
+    key = f"max_{kind}_channels"
+    for i, d in enumerate(devices):
+        if d["name"] == name and d[key] > 0:
+            return i
+    return None
+
+
+class AudioStreamManager:
+    def __init__(self, sd, callback, prepare, input_device=None, output_device=None,
+                 blocksize=2048, dtype="float32", on_open=None, on_lost=None, on_recover=None,
+                 poll_s=POLL_S, stall_s=STALL_S, retry_s=RETRY_S, cards=cards_signature):
+        """`sd` is the sounddevice module. Devices are an index, a name or None
+        for the system default. Hooks run on the watcher thread:
+        on_open(in_info, out_info) after every open, on_lost(reason) when the
+        stream drops and on_recover(seconds) once audio flows again."""
+        self.sd = sd
+        self.callback = callback
+        self.prepare = prepare
+        self.blocksize = blocksize
+        self.dtype = dtype
+        self.on_open = on_open
+        self.on_lost = on_lost
+        self.on_recover = on_recover
+        self.poll_s = poll_s
+        self.stall_s = stall_s
+        self.retry_s = retry_s
+        self.cards = cards
+
+        self._want = {INPUT: input_device, OUTPUT: output_device}
+        self._names = None          # wanted device names, resolved on the first scan
+        self.stream = None
+        self.devices = (None, None)  # (input, output) device info of the open stream
+        self.fallback = False        # running on a default because a wanted device is missing
+        self.restarts = 0
+        self.last_recover_s = None
+        self._sig = cards()
+        self._retry_at = 0.0
+        self._opened_at = 0.0
+        self._last_cb = 0.0          # written by the audio thread
+        self._first_cb = None
+        self._down_at = None
+        self._last_error = None
+        self._stop = threading.Event()
+
+    @property
+    def up(self):
+        return self.stream is not None
+
+    # ---- audio thread ----
+    def _callback(self, indata, outdata, frames, time_info, status):
+        now = time.monotonic()
+        self._last_cb = now
+        if self._first_cb is None:
+            self._first_cb = now
+        self.callback(indata, outdata, frames, time_info, status)
+
+    # ---- watcher ----
+    def run(self, idle=None, idle_s=2.0):
+        """Keep the stream up until stop() or Ctrl+C; idle() runs every idle_s"""
+        next_idle = time.monotonic() + idle_s
+        try:
+            while not self._stop.is_set():
+                self.check()
+                if idle is not None and time.monotonic() >= next_idle:
+                    idle()
+                    next_idle = time.monotonic() + idle_s
+                self._stop.wait(self.poll_s)
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        """One watcher step: notice a lost stream, reopen, report recovery"""
+        now = time.monotonic()
+        sig = self.cards()
+        changed = sig != self._sig
+        self._sig = sig
+
+        if self.stream is not None:
+            if not self.stream.active:
+                self._drop(now, "stopped by PortAudio")
+            elif now - max(self._last_cb, self._opened_at) > self.stall_s:
+                self._drop(now, f"no audio for {now - max(self._last_cb, self._opened_at):.1f} s")
+            elif changed and self.fallback:
+                # PortAudio can't re-scan under an open stream, so reopen:
+                # that picks the wanted device if this change brought it back
+                print("🔔 Audio devices changed - reopening")
+                self._close_stream()
+
+        if self.stream is None and (changed or now >= self._retry_at):
+            self._open(rescan=self._names is not None)
+
+        if self._down_at is not None and self.stream is not None and self._first_cb is not None:
+            ttr = self._first_cb - self._down_at
+            self._down_at = None
+            self.last_recover_s = ttr
+            in_info, out_info = self.devices
+            print(f"✓ Audio recovered in {ttr:.2f} s ({in_info['name']} → {out_info['name']})")
+            if self.on_recover is not None:
+                self.on_recover(ttr)
+
+    def _drop(self, now, reason):
+        print(f"⚠ Audio stream lost ({reason}) - reconnecting")
+        self._close_stream()
+        self._down_at = now
+        self._retry_at = now
+        if self.on_lost is not None:
+            self.on_lost(reason)
+
+    def _close_stream(self):
+        stream, self.stream = self.stream, None
+        self._first_cb = None
+        try:
+            stream.abort()
+            stream.close()
+        except Exception:
+            pass    # the device is usually gone already
+
+    def close(self):
+        if self.stream is not None:
+            self._close_stream()
+
+    # ---- device selection ----
+    def _resolve_names(self):
+        """Wanted device names from the constructor's index/name/None"""
+        names = {}
+        for kind, want in self._want.items():
+            if isinstance(want, int):
+                try:
+                    want = self.sd.query_devices(want)["name"]
+                except Exception:
+                    print(f"✗ No {kind} device [{want}]; using the default")
+                    want = None
+            names[kind] = want
+        return names
+
+    def _pick(self, devices, kind):
+        """(index, is_fallback) for `kind`; raises if there's no device at all"""
+        name = self._names[kind]
+        if name is not None:
+            i = find_device(devices, name, kind)
+            if i is not None:
+                return i, False
+        default = self.sd.query_devices(kind=kind)
+        i = find_device(devices, default["name"], kind)
+        if i is None:
+            raise LookupError(f"no {kind} device")
+        return i, name is not None
+
+    def _rescan(self):
+        """PortAudio lists devices once at init; restart it to see hot-plugged ones"""
+        terminate = getattr(self.sd, "_terminate", None)
+        initialize = getattr(self.sd, "_initialize", None)
+        if terminate is not None and initialize is not None:
+            terminate()
+            initialize()
+
+    def _open(self, rescan=True):
+        now = time.monotonic()
+        self._retry_at = now + self.retry_s
+        try:
+            if rescan:
+                self._rescan()
+            if self._names is None:
+                self._names = self._resolve_names()
+            devices = self.sd.query_devices()
+            (i_in, fb_in), (i_out, fb_out) = self._pick(devices, INPUT), self._pick(devices, OUTPUT)
+            in_info, out_info = devices[i_in], devices[i_out]
+            samplerate, channels = self.prepare(in_info, out_info)
+            self._first_cb = None
+            self._opened_at = time.monotonic()
+            stream = self.sd.Stream(device=(i_in, i_out), samplerate=samplerate, blocksize=self.blocksize,
+                                    channels=channels, dtype=self.dtype, callback=self._callback)
+            stream.start()
+        except Exception as e:
+            if str(e) != self._last_error:
+                print(f"✗ Audio devices unavailable: {e} (retrying every {self.retry_s:g} s)")
+                self._last_error = str(e)
+            return False
+        self._last_error = None
+        self.stream = stream
+        self.devices = (in_info, out_info)
+        self.fallback = fb_in or fb_out
+        self.restarts += 1
+        if self.fallback:
+            missing = dict.fromkeys(self._names[k] for k, fb in ((INPUT, fb_in), (OUTPUT, fb_out)) if fb)
+            print(f"⚠ {', '.join(missing)} not found; using the default device until it's back")
+        if self.on_open is not None:
+            self.on_open(in_info, out_info)
+        return True
+
+
+# ---- Fake PortAudio for the self-test ----
+class _FakeStream:
+    def __init__(self, sd, device, samplerate, blocksize, channels, dtype, callback):
+        import numpy as np
+
+        self.sd = sd
+        self.device = device
+        self.callback = callback
+        self.samplerate = samplerate
+        self.active = False
+        self._names = [sd.listed[i]["name"] for i in device]
+        self._shape = (blocksize, channels[0]), (blocksize, channels[1])
+        self._np = np
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.active = True
+        self._thread.start()
+
+    def _run(self):
+        np = self._np
+        indata, outdata = np.zeros(self._shape[0], np.float32), np.zeros(self._shape[1], np.float32)
+        while not self._stop.wait(self.sd.period):
+            names = [d["name"] for d in self.sd.present]
+            if any(name not in names for name in self._names):
+                self.active = False     # PortAudio stops the stream on a device error
+                return
+            if not self.sd.hang:
+                self.callback(indata, outdata, indata.shape[0], None, None)
+
+    def abort(self):
+        self._stop.set()
+        self.active = False
+
+    def close(self):
+        self._thread.join(1.0)
+
+
+class _FakeSoundDevice:
+    """Just enough of sounddevice: devices plug in and out of `present`, and
+    query_devices() only sees them after _terminate()/_initialize()"""
+
+    def __init__(self, devices, period=0.005):
+        self.present = [dict(d) for d in devices]
+        self.listed = list(self.present)
+        self.period = period
+        self.hang = False
+        self.generation = 0
+        self.opened = []
+
+    def plug(self, device, at=None):
+        self.present.insert(len(self.present) if at is None else at, dict(device))
+        self.generation += 1
+
+    def unplug(self, name):
+        self.present = [d for d in self.present if d["name"] != name]
+        self.generation += 1
+
+    def _terminate(self):
+        self.listed = []
+
+    def _initialize(self):
+        self.listed = list(self.present)
+
+    def query_devices(self, device=None, kind=None):
+        if kind is not None:
+            for d in self.listed:
+                if d.get("default") == kind:
+                    return d
+            raise RuntimeError(f"Error querying device -1 ({kind})")
+        if device is None:
+            return self.listed
+        return self.listed[device]
+
+    def Stream(self, device, **kwargs):
+        if any(i >= len(self.listed) or self.listed[i]["name"] not in [d["name"] for d in self.present]
+               for i in device):
+            raise RuntimeError("Error opening Stream: Device unavailable")
+        s = _FakeStream(self, device, **kwargs)
+        self.opened.append((self.listed[device[0]]["name"], self.listed[device[1]]["name"], kwargs["samplerate"]))
+        return s
+
+
+def _dev(name, ins, outs, rate, default=None):
+    return {"name": name, "max_input_channels": ins, "max_output_channels": outs,
+            "default_samplerate": rate, "default": default}
+
+
+def selftest():
+    ok = True
+
+    def check(name, cond, detail=""):
+        nonlocal ok
+        ok &= bool(cond)
+        print(f"  {'✓' if cond else '✗'} {name}{'  ' + detail if detail else ''}")
+
+    def wait_for(cond, timeout=3.0):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            m.check()
+            if cond():
+                return True
+            time.sleep(0.01)
+        return False
+
+    usb = _dev("USB Audio Device", 1, 2, 48000.0)
+    builtin_in = _dev("Built-in Mic", 1, 0, 44100.0, default=INPUT)
+    builtin_out = _dev("Built-in Output", 0, 2, 44100.0, default=OUTPUT)
+    sd = _FakeSoundDevice([builtin_in, builtin_out, usb])
+    prepared, recovered, calls = [], [], [0]
+
+    def prepare(in_info, out_info):
+        prepared.append((in_info["name"], in_info["default_samplerate"]))
+        return int(in_info["default_samplerate"]), (1, 2)
+
+    def callback(indata, outdata, frames, time_info, status):
+        calls[0] += 1
+
+    m = AudioStreamManager(sd, callback, prepare, input_device=2, output_device=2, blocksize=256,
+                           on_recover=recovered.append, poll_s=0.01, stall_s=0.2, retry_s=0.05,
+                           cards=lambda: sd.generation)
+    m.check()
+    check("opens the requested device", m.up and sd.opened[-1][:2] == ("USB Audio Device",) * 2)
+    check("audio flows", wait_for(lambda: calls[0] > 5))
+
+    sd.unplug("USB Audio Device")
+    check("unplug falls back to the default devices",
+          wait_for(lambda: m.up and m.fallback and recovered),
+          f"{sd.opened[-1]}")
+    check("fallback follows the device's sample rate", prepared[-1] == ("Built-in Mic", 44100.0))
+
+    # Comes back at a new index, as real cards do
+    sd.plug(usb, at=0)
+    check("replug moves back to the wanted device by name",
+          wait_for(lambda: m.up and not m.fallback), f"{sd.opened[-1]}")
+    check("replugged device is at a new index", find_device(sd.listed, "USB Audio Device", INPUT) != 2)
+
+    # Driver goes quiet without stopping the stream
+    n, recovered[:] = len(sd.opened), []
+    sd.hang = True
+    check("stalled stream is detected", wait_for(lambda: not m.up or len(sd.opened) > n))
+    sd.hang = False
+    check("stalled stream is reopened", wait_for(lambda: bool(recovered)),
+          f"recovered in {m.last_recover_s * 1e3:.0f} ms" if m.last_recover_s else "")
+
+    # Nothing plugged in: keep retrying quietly, recover when a device appears
+    sd.unplug("USB Audio Device")
+    sd.unplug("Built-in Mic")
+    recovered[:] = []
+    time.sleep(0.05)
+    check("keeps waiting with no input device", not wait_for(lambda: m.up, timeout=0.3))
+    sd.plug(usb)
+    check("recovers when a device appears", wait_for(lambda: bool(recovered)),
+          f"in {m.last_recover_s * 1e3:.0f} ms" if m.last_recover_s else "")
+    check("time-to-recover is reported", m.last_recover_s is not None and m.last_recover_s > 0)
+    m.close()
+
+    print(f"{'✓' if ok else '✗'} audio device manager self-test")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Audio stream hot-plug manager')
+    parser.add_argument('--selftest', action='store_true', help='Unplug/replug against a fake PortAudio')
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+    parser.print_help()
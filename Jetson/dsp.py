@@ -0,0 +1,820 @@
+#!/usr/bin/env python3
+"""
+Streaming DSP stages for the live audio chain (sound_3.py on the Jetson,
+AudioFlaskIntegration.py on the Pi).
+
+Every stage works channel-major, on (channels, frames) float64 chunks, and
+carries its state from one chunk to the next, so a 2048-frame callback and
+four 512-frame callbacks give the same output.
+
+    LookaheadLimiter  brick-wall output ceiling. The audio is delayed by the
+                      lookahead and the gain ramps down across it, so a
+                      transient is caught without ducking the whole chunk
+                      (what the old per-chunk peak normalisation did).
+                      It is not cheaper than that normalisation: about the
+                      same below the ceiling, ~2x on the release after a
+                      peak and ~8x on a chunk with a transient (roughly 14,
+                      30 and 90-130 us vs 10-17 us for 2 ch x 2048 frames),
+                      under 0.2% of the chunk deadline either way.
+    HarshSuppressor   STFT overlap-add stage that turns down bins in the
+                      2-5 kHz band whose short-term level jumps above their
+                      long-term level (whistles, sirens, feedback), with an
+                      optional spectral noise gate.
+    MultibandCompressor
+                      3/4-band compressor on Linkwitz-Riley crossovers, so a
+                      bass drum no longer pulls speech down with it.
+
+Everything that only depends on (sample rate, block size, settings) - the
+bandpass and crossover coefficients, STFT windows, the noise table - is
+built once into a DspPlan. A PlanCache keeps the most recent plans (and
+optionally .npz copies on disk, VYZ_DSP_PLAN_DIR), so changing settings
+from the app or reopening a device at another rate is a lookup.
+
+Cost per chunk, and what each stage does to a test signal:
+    python dsp.py --bench
+"""
+import collections
+import hashlib
+import json
+import os
+
+import numpy as np
+
+LIMITER_LOOKAHEAD_MS = 5.0
+LIMITER_RELEASE_MS   = 80.0     # time constant of the gain recovery
+LIMITER_IDLE_DB      = 1e-4     # below this much gain reduction the limiter is bypassed
+
+STFT_FRAME_MS  = 20.0           # rounded up to a power-of-two FFT size
+STFT_OVERLAP   = 2              # frames per hop (2 = 50%, 4 = 75%)
+HARSH_BAND_HZ  = (2000.0, 5000.0)
+HARSH_THRESHOLD_DB = 6.0        # short-term over long-term level before any cut
+HARSH_RATIO    = 4.0            # cut = (excess - threshold) * (1 - 1/ratio)
+HARSH_MAX_CUT_DB = 18.0
+HARSH_SHORT_MS = 30.0           # short-term spectrum time constant
+HARSH_LONG_S   = 4.0            # long-term spectrum time constant
+HARSH_WARMUP_S = 0.5            # learn the room this long before judging anything
+HARSH_SMOOTH_MS = 20.0          # gain smoothing (keeps "musical noise" down)
+GATE_MARGIN_DB = 6.0            # gate bins less than this above the noise floor
+GATE_DEPTH_DB  = 12.0
+GATE_RISE_DB_S = 3.0            # how fast the noise floor estimate may rise
+
+MB_CROSSOVERS_HZ = (250.0, 2500.0)     # 3 bands; add a third frequency for 4
+MB_RATIOS        = (6.0, 2.0, 4.0)      # per band: bass hardest, speech gentlest
+MB_ATTACK_MS     = 3.0
+MB_RELEASE_MS    = 120.0
+
+BANDPASS_ORDER   = 4
+NOISE_TABLE_S    = 4.0                  # seconds of pre-generated unit white noise
+PLAN_CACHE_SIZE  = 8
+PLAN_DIR         = os.getenv("VYZ_DSP_PLAN_DIR")   # unset: plans live in memory only
+
+# numpy >= 2.0 can write FFT results into a preallocated array
+_FFT_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+
+def sliding_max(a, w):
+    """Max over every window of `w` consecutive values (len(a) - w + 1 of them).
+    Doubling: after pass k each value is the max of the next 2^k, so
+    log2(w) + 1 vector maxima whatever the window length."""
+    n = len(a)
+    out = np.array(a, dtype=np.float64)
+    k = 1
+    while 2 * k <= w:
+        np.maximum(out[:n - k], out[k:], out=out[:n - k])
+        k *= 2
+    if k < w:
+        return np.maximum(out[:n - w + 1], out[w - k:n - k + 1])
+    return out[:n - w + 1]
+
+
+class LookaheadLimiter:
+    """Linked (one gain for all channels) lookahead peak limiter.
+
+    Per sample the gain reduction needed to keep the loudest channel at the
+    ceiling is held for the lookahead, averaged over it (a linear ramp in dB
+    that reaches full reduction exactly when the peak comes out of the delay
+    line) and released exponentially. Output is delayed by `latency` frames.
+
+    The delay line and the output share one preallocated buffer, so the
+    array process() returns is only valid until the next call.
+    """
+
+    def __init__(self, sample_rate, ceiling=0.7, lookahead_ms=LIMITER_LOOKAHEAD_MS,
+                 release_ms=LIMITER_RELEASE_MS, channels=1):
+        self.sample_rate = sample_rate
+        self.ceiling = float(ceiling)
+        self.latency = max(1, int(round(lookahead_ms * 1e-3 * sample_rate)))
+        self._release = 1.0 / max(1e-6, release_ms * 1e-3 * sample_rate)
+        self.reset(channels)
+
+    def reset(self, channels=1):
+        L = self.latency
+        self._buf = np.zeros((channels, 2 * L))    # [delay line | chunk]; output = the first N
+        self._n = L                                # last chunk's length: delay line is _buf[:, _n:]
+        self._req = np.zeros(2 * L)        # required reduction (dB) of the last 2L inputs
+        self._req_live = False             # ...and whether any of it is nonzero
+        self._att = 0.0                    # reduction (dB) applied to the last output frame
+        self._steps = np.zeros(0)          # release * k, k = 0, 1, ...
+        self._decay = np.zeros(0)          # exp(-release * (k + 1))
+        self.reduction_db = 0.0            # max reduction in the last chunk
+
+    def _curves(self, n):
+        """(release * k, exp(-release * (k + 1))) for k < n, cached"""
+        if len(self._steps) < n:
+            self._steps = np.arange(n) * self._release
+            self._decay = np.exp(-(self._steps + self._release))
+        return self._steps[:n], self._decay[:n]
+
+    def process(self, x):
+        """Limit a (channels, frames) chunk; returns a (channels, frames) view
+        of the internal buffer (copy it to keep it past the next call).
+
+        Only the frames within 2 * latency of an over-ceiling input get the
+        hold/ramp treatment; the rest of the chunk is either untouched or on
+        the closed-form release curve, and the gain is applied only while
+        the reduction is above LIMITER_IDLE_DB."""
+        C, N = x.shape
+        L = self.latency
+        buf = self._buf
+        if buf.shape[0] != C:
+            self.reset(C)
+            buf = self._buf
+        # Shift the last chunk's tail down to be the delay line, in place
+        if buf.shape[1] == L + N:
+            buf[:, :L] = buf[:, N:]
+        else:
+            buf = np.concatenate([buf[:, self._n:], np.empty((C, N))], axis=1)
+            self._buf = buf
+        buf[:, L:] = x
+        self._n = N
+        y = buf[:, :N]
+
+        mag = np.abs(x)
+        loud = mag.max() > self.ceiling
+        if not loud and self._att < LIMITER_IDLE_DB and not self._req_live:
+            # Nothing to do: pass the delayed audio through
+            self._att = 0.0
+            self.reduction_db = 0.0
+            return y
+
+        # Output frame j (input frame j - L) sees inputs r[j:j + 2L + 1]
+        lo = hi = N
+        if loud or self._req_live:
+            req = np.zeros(N)
+            if loud:
+                peak = np.maximum.reduce(mag, axis=0) if C > 1 else mag[0]
+                over = peak > self.ceiling
+                req[over] = 20.0 * np.log10(peak[over] / self.ceiling)
+            r = np.concatenate([self._req, req])
+            self._req = r[-2 * L:].copy()
+            nz = np.flatnonzero(r)
+            lo, hi = max(0, nz[0] - 2 * L), min(N, nz[-1] + 1)
+            self._req_live = bool(nz[-1] >= len(r) - 2 * L)
+
+        att = np.empty(N)
+        prev = self._att
+        c = self._release
+        if lo:
+            att[:lo] = prev * self._curves(lo)[1]
+            prev = att[lo - 1]
+        if hi > lo:
+            # Hold over the lookahead, then average over it: the output frame
+            # gets at least the reduction its input frame needs
+            hold = sliding_max(r[lo:hi + 2 * L], L + 1)
+            cs = np.concatenate([[0.0], np.cumsum(hold)])
+            ramp = (cs[L + 1:] - cs[:-L - 1]) * (1.0 / (L + 1))
+
+            # Exponential release: att[t] = max(ramp[t], att[t-1] * exp(-c)),
+            # unrolled as a running max in the log domain
+            t = self._curves(hi - lo)[0]
+            with np.errstate(divide="ignore"):
+                v = np.log(ramp) + t
+                if prev > 0.0:
+                    v[0] = max(v[0], np.log(prev) - c)
+            np.maximum.accumulate(v, out=v)
+            att[lo:hi] = np.exp(v - t)
+            prev = att[hi - 1]
+        end = hi
+        if hi < N:
+            att[hi:] = prev * self._curves(N - hi)[1]
+            if prev > LIMITER_IDLE_DB:
+                end = min(N, hi + int(np.log(prev / LIMITER_IDLE_DB) / c) + 1)
+        self._att = float(att[-1])
+        self.reduction_db = float(att.max())
+
+        if end:
+            y[:, :end] *= np.exp(att[:end] * (-np.log(10.0) / 20.0))
+        return y
+
+
+def _time(fn, runs):
+    """Best of 5 mean per-call times, in seconds"""
+    import time
+
+    fn()
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / runs)
+    return best
+
+
+def stft_nfft(sample_rate, frame_ms=STFT_FRAME_MS):
+    """Power-of-two FFT size covering at least frame_ms"""
+    return 1 << int(np.ceil(np.log2(frame_ms * 1e-3 * sample_rate)))
+
+
+def stft_windows(nfft, overlap):
+    """(analysis, synthesis) windows: sqrt-Hann both ways, scaled so that
+    overlap-add of `overlap` frames per hop reconstructs the input exactly"""
+    a = np.sqrt(np.hanning(nfft + 1)[:-1])         # periodic Hann
+    return a, a * (2.0 / overlap)
+
+
+def _ema(x, alpha, last):
+    """Per-column EMA down the rows of x (K, B), continuing from `last` (B,)"""
+    from scipy.signal import lfilter
+
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, axis=0, zi=((1.0 - alpha) * last)[None])
+    return y
+
+
+class HarshSuppressor:
+    """STFT overlap-add spectral suppressor, linked across channels.
+
+    For each bin it keeps a short-term power spectrum and a slow long-term
+    level in dB; where the short-term level is more than `threshold_db` above
+    the long-term one inside `band`, the bin is turned down by (excess - threshold) * (1 - 1/ratio)
+    dB, at most `max_cut_db`. With `gate` on, bins less than `gate_margin_db`
+    above a min-tracked noise floor are turned down `gate_depth_db` as well.
+    All frames of a chunk go through one batched FFT; the per-frame
+    recursions (spectrum EMAs, noise floor, gain smoothing) are vectorised
+    across frames too. Output is delayed by `latency` frames.
+    """
+
+    def __init__(self, sample_rate, channels=1, frame_ms=STFT_FRAME_MS, overlap=STFT_OVERLAP,
+                 band=HARSH_BAND_HZ, threshold_db=HARSH_THRESHOLD_DB, ratio=HARSH_RATIO,
+                 max_cut_db=HARSH_MAX_CUT_DB, gate=False, windows=None):
+        """`windows` is a precomputed stft_windows() pair (e.g. DspPlan.stft_windows)"""
+        self.sample_rate = sample_rate
+        self.nfft = stft_nfft(sample_rate, frame_ms)
+        self.overlap = overlap
+        self.hop = self.nfft // overlap
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.max_cut_db = max_cut_db
+        self.gate = gate
+        self.gate_margin_db = GATE_MARGIN_DB
+        self.gate_depth_db = GATE_DEPTH_DB
+
+        self._win, self._syn = windows or stft_windows(self.nfft, overlap)
+        freqs = np.fft.rfftfreq(self.nfft, 1.0 / sample_rate)
+        self._band = (freqs >= band[0]) & (freqs <= band[1])
+        frame_s = self.hop / sample_rate
+        self._a_short = 1.0 - np.exp(-frame_s / (HARSH_SHORT_MS * 1e-3))
+        self._a_long = 1.0 - np.exp(-frame_s / HARSH_LONG_S)
+        self._a_gain = 1.0 - np.exp(-frame_s / (HARSH_SMOOTH_MS * 1e-3))
+        self._rise = GATE_RISE_DB_S * frame_s
+        self._warmup = HARSH_WARMUP_S / frame_s
+        self.latency = self.nfft - self.hop
+        self.reset(channels)
+
+    def reset(self, channels=1):
+        C, B = channels, self.nfft // 2 + 1
+        self._hist = np.zeros((C, self.nfft - self.hop))    # input not yet in a full frame
+        self._tail = np.zeros((C, self.overlap - 1, self.hop))  # OLA parts still owed
+        self._backlog = np.zeros((C, 0))                    # output not yet handed out
+        self._short = None                                  # (B,) power, primed by the first frame
+        self._long_db = None
+        self._seen = 0
+        self._floor_db = np.full(B, np.inf)
+        self._cut_db = np.zeros(B)
+        self._frames = np.empty((C, 0, self.nfft))
+        self._spec = np.empty((C, 0, B), dtype=complex)
+        self.cut_db = 0.0                                   # max cut in the last chunk
+
+    def _buffers(self, C, K):
+        if self._frames.shape[:2] != (C, K):
+            self._frames = np.empty((C, K, self.nfft))
+            self._spec = np.empty((C, K, self.nfft // 2 + 1), dtype=complex)
+        return self._frames, self._spec
+
+    def _gains(self, power):
+        """Linear gain per (frame, bin) from the linked power spectra (K, B)"""
+        if self._short is None:
+            self._short = power[0].copy()
+        short = _ema(power, self._a_short, self._short)
+        self._short = short[-1]
+        short_db = 10.0 * np.log10(short + 1e-12)
+        if self._long_db is None:
+            self._long_db = short_db[0].copy()
+
+        # The long-term level (dB) is a running mean until it covers
+        # HARSH_LONG_S. Past the first HARSH_WARMUP_S a whistle must not teach
+        # it that it's normal: what goes in is capped at the threshold above
+        # it, so it creeps up at most threshold_db per time constant.
+        self._seen += len(power)
+        a_long = max(self._a_long, 2.0 / (self._seen + 1))
+        feed = short_db
+        if self._seen > self._warmup:
+            feed = np.minimum(short_db, self._long_db + self.threshold_db)
+        long_db = _ema(feed, a_long, self._long_db)
+        self._long_db = long_db[-1]
+
+        excess = short_db - long_db - self.threshold_db
+        np.maximum(excess, 0.0, out=excess)
+        excess *= 1.0 - 1.0 / self.ratio
+        excess[:, ~self._band] = 0.0
+        np.minimum(excess, self.max_cut_db, out=excess)
+
+        if self.gate:
+            # Noise floor: follows drops at once, rises at most `rise` dB a frame;
+            # floor[k] = min(short[k], floor[k-1] + rise) as a running min
+            ramp = self._rise * np.arange(1, len(power) + 1)[:, None]
+            floor = np.minimum.accumulate(
+                np.vstack([self._floor_db[None], short_db - ramp]), axis=0)[1:] + ramp
+            self._floor_db = floor[-1]
+            excess += np.where(short_db < floor + self.gate_margin_db, self.gate_depth_db, 0.0)
+
+        cut = _ema(excess, self._a_gain, self._cut_db)
+        self._cut_db = cut[-1]
+        self.cut_db = float(cut.max())
+        return np.power(10.0, cut * -0.05)
+
+    def process(self, x):
+        """Process a (channels, frames) chunk; returns a new (channels, frames) array"""
+        C, N = x.shape
+        H, R = self.hop, self.overlap
+        if self._hist.shape[0] != C:
+            self.reset(C)
+        seq = np.concatenate([self._hist, x], axis=1)
+        K = (seq.shape[1] - self.nfft) // H + 1 if seq.shape[1] >= self.nfft else 0
+        self._hist = seq[:, K * H:]
+
+        if K:
+            frames, spec = self._buffers(C, K)
+            view = np.lib.stride_tricks.sliding_window_view(seq, self.nfft, axis=1)[:, ::H][:, :K]
+            np.multiply(view, self._win, out=frames)
+            if _FFT_OUT:
+                np.fft.rfft(frames, axis=-1, out=spec)
+            else:
+                spec[...] = np.fft.rfft(frames, axis=-1)
+            power = (spec.real ** 2 + spec.imag ** 2).mean(axis=0)
+            spec *= self._gains(power)
+            y = np.fft.irfft(spec, self.nfft, axis=-1)
+            y *= self._syn
+
+            out = self._overlap_add(y.reshape(C, K, R, H))
+            self._backlog = np.concatenate([self._backlog, out.reshape(C, K * H)], axis=1)
+
+        if self._backlog.shape[1] < N:
+            # Chunks that aren't a multiple of the hop leave up to hop - 1
+            # frames pending; one pad that size keeps the output flowing
+            pad = N - self._backlog.shape[1]
+            if N % H:
+                pad = max(pad, H - 1)
+            self._backlog = np.concatenate([np.zeros((C, pad)), self._backlog], axis=1)
+            self.latency += pad
+        y, self._backlog = self._backlog[:, :N], self._backlog[:, N:]
+        return y
+
+    def _overlap_add(self, parts):
+        """Frames split in hops, (C, K, R, H) -> output hops (C, K, H). Part r
+        of frame k lands in hop k + r; what spills past this chunk waits in
+        self._tail for the next one."""
+        C, K, R, H = parts.shape
+        acc = np.concatenate([self._tail, np.zeros((C, K, H))], axis=1)   # hops 0 .. K+R-2
+        for r in range(R):
+            acc[:, r:r + K] += parts[:, :, r]
+        self._tail = acc[:, K:].copy()
+        return acc[:, :K]
+
+
+def crossover_sos(sample_rate, freqs):
+    """Per crossover frequency: (LR4 low-pass, LR4 high-pass, matching all-pass)
+    second-order sections. LR4 = two 2nd-order Butterworths in series; the
+    low and high outputs sum to the all-pass, so a split band sums back flat."""
+    from scipy import signal
+
+    out = []
+    for fc in freqs:
+        lp = signal.butter(2, fc, 'low', fs=sample_rate, output='sos')
+        hp = signal.butter(2, fc, 'high', fs=sample_rate, output='sos')
+        a = lp[0, 3:]
+        ap = np.array([[a[2], a[1], a[0], 1.0, a[1], a[2]]])
+        out.append((np.vstack([lp, lp]), np.vstack([hp, hp]), ap))
+    return tuple(out)
+
+
+class MultibandCompressor:
+    """Compressor with an independent gain per frequency band.
+
+    The bands come from a Linkwitz-Riley LR4 tree (low/rest at the first
+    crossover, then the rest again at the next). After compression they are
+    recombined low to high, passing the running sum through each next
+    crossover's all-pass, so with no gain change the output is the input
+    through an all-pass: flat magnitude, no notches at the crossovers.
+
+    Detection is a peak envelope per band (instant attack, exponential
+    release), vectorised over bands, channels and frames as a running max in
+    the log domain; the gain reduction is then smoothed with a one-pole
+    attack filter. With `link` the loudest channel sets each band's gain.
+    """
+
+    def __init__(self, sample_rate, channels=1, crossovers=MB_CROSSOVERS_HZ, ratios=MB_RATIOS,
+                 threshold_db=-20.0, makeup_db=0.0, attack_ms=MB_ATTACK_MS,
+                 release_ms=MB_RELEASE_MS, link=True, sos=None):
+        """`sos` is a precomputed crossover_sos() result (e.g. DspPlan.crossover_sos)"""
+        if len(ratios) != len(crossovers) + 1:
+            raise ValueError(f"{len(crossovers) + 1} bands need {len(crossovers) + 1} ratios")
+        self.sample_rate = sample_rate
+        self.crossovers = tuple(float(f) for f in crossovers)
+        self.sos = sos or crossover_sos(sample_rate, self.crossovers)
+        self.ratios = np.asarray(ratios, dtype=float)
+        self.threshold_db = threshold_db
+        self.makeup_db = makeup_db
+        self.link = link
+        self._release = 1.0 / max(1e-6, release_ms * 1e-3 * sample_rate)
+        a = 1.0 - np.exp(-1.0 / max(1e-6, attack_ms * 1e-3 * sample_rate))
+        self._attack = ([a], [1.0, a - 1.0])
+        self.reset(channels)
+
+    def reset(self, channels=1):
+        nb = len(self.crossovers) + 1
+        C = channels
+        # sosfilt state for every filter: split low/high per crossover, then
+        # the recombination all-passes (crossovers 2..n)
+        self._zi = {key: np.zeros((len(sos), C, 2)) for key, sos in self._filters()}
+        self._env = np.full((nb, 1 if self.link else C), -np.inf)   # log peak envelope
+        self._gr = np.zeros((nb, 1 if self.link else C, 1))         # smoothed reduction, dB
+        self._bands = np.empty((nb, C, 0))
+        self._channels = C
+        self.reduction_db = np.zeros(nb)                             # per band, last chunk
+
+    def _filters(self):
+        for i, (lp, hp, ap) in enumerate(self.sos):
+            yield ("lp", i), lp
+            yield ("hp", i), hp
+            if i:
+                yield ("ap", i), ap
+
+    def _sosfilt(self, key, sos, x):
+        from scipy.signal import sosfilt
+
+        y, self._zi[key] = sosfilt(sos, x, axis=-1, zi=self._zi[key])
+        return y
+
+    def _split(self, x):
+        """(C, N) -> (bands, C, N), into a reused buffer"""
+        C, N = x.shape
+        if self._bands.shape[1:] != (C, N):
+            self._bands = np.empty((len(self.crossovers) + 1, C, N))
+        rest = x
+        for i, (lp, hp, _) in enumerate(self.sos):
+            self._bands[i] = self._sosfilt(("lp", i), lp, rest)
+            rest = self._sosfilt(("hp", i), hp, rest)
+        self._bands[-1] = rest
+        return self._bands
+
+    def _gain_db(self, bands):
+        """Gain (dB) per band, channel (or 1 if linked) and frame"""
+        N = bands.shape[-1]
+        mag = np.abs(bands)
+        if self.link and bands.shape[1] > 1:
+            mag = np.maximum.reduce(mag, axis=1, keepdims=True)
+        elif self.link:
+            mag = mag[:, :1]
+
+        # env[t] = max(|x[t]|, env[t-1] * exp(-c)) in the log domain
+        c = self._release
+        t = np.arange(N) * c
+        with np.errstate(divide="ignore"):
+            v = np.log(mag)
+        v += t
+        np.maximum(v[..., 0], self._env - c, out=v[..., 0])
+        np.maximum.accumulate(v, axis=-1, out=v)
+        v -= t
+        self._env = v[..., -1].copy()
+
+        # Static curve on the envelope (dB), then the attack smoothing
+        v *= 20.0 / np.log(10.0)
+        v -= self.threshold_db
+        np.maximum(v, 0.0, out=v)
+        v *= (1.0 - 1.0 / self.ratios)[:, None, None]
+        from scipy.signal import lfilter
+
+        gr, _ = lfilter(*self._attack, v, axis=-1, zi=self._gr * -self._attack[1][1])
+        self._gr = gr[..., -1:].copy()
+        self.reduction_db = gr.max(axis=(1, 2))
+        gr *= -1.0
+        gr += self.makeup_db
+        return gr
+
+    def process(self, x):
+        """Compress a (channels, frames) chunk; returns a new (channels, frames) array"""
+        if x.shape[0] != self._channels:
+            self.reset(x.shape[0])
+        bands = self._split(x)
+        gain = self._gain_db(bands)
+        gain *= np.log(10.0) / 20.0
+        np.exp(gain, out=gain)
+        bands *= gain
+
+        # Recombine low to high through the all-passes the lower bands missed
+        out = bands[0].copy()
+        for i in range(1, len(bands)):
+            if i < len(self.sos):
+                out = self._sosfilt(("ap", i), self.sos[i][2], out)
+            out += bands[i]
+        return out
+
+
+class DspPlan:
+    """Precomputed, read-only parts of the chain for one (sample_rate,
+    blocksize, settings). Shared between compressors: never modify in place."""
+
+    def __init__(self, sample_rate, blocksize, settings, arrays):
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.settings = dict(settings)
+        self.arrays = arrays
+        n = len(self.settings["crossovers"])
+        self.bandpass = (arrays["bandpass_b"], arrays["bandpass_a"])
+        self.crossover_sos = tuple((arrays[f"xo{i}_lp"], arrays[f"xo{i}_hp"], arrays[f"xo{i}_ap"])
+                                   for i in range(n))
+        self.stft_windows = (arrays["stft_analysis"], arrays["stft_synthesis"])
+        self.noise = arrays["noise"]
+
+    @classmethod
+    def build(cls, sample_rate, blocksize, settings):
+        from scipy import signal
+
+        nyquist = sample_rate / 2
+        b, a = signal.butter(BANDPASS_ORDER, [settings["lowcut"] / nyquist, settings["highcut"] / nyquist],
+                             btype='band')
+        arrays = {"bandpass_b": b, "bandpass_a": a}
+        for i, (lp, hp, ap) in enumerate(crossover_sos(sample_rate, settings["crossovers"])):
+            arrays[f"xo{i}_lp"], arrays[f"xo{i}_hp"], arrays[f"xo{i}_ap"] = lp, hp, ap
+        nfft = stft_nfft(sample_rate, settings["stft_frame_ms"])
+        arrays["stft_analysis"], arrays["stft_synthesis"] = stft_windows(nfft, settings["stft_overlap"])
+        n = max(int(settings["noise_s"] * sample_rate), 2 * blocksize)
+        arrays["noise"] = np.random.default_rng().standard_normal(n)
+        return cls(sample_rate, blocksize, settings, arrays)
+
+    def save(self, path):
+        meta = json.dumps({"sample_rate": self.sample_rate, "blocksize": self.blocksize,
+                           "settings": self.settings})
+        tmp = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp, _meta=np.array(meta), **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            meta = json.loads(str(z["_meta"]))
+            arrays = {k: z[k] for k in z.files if k != "_meta"}
+        s = meta["settings"]
+        s["crossovers"] = tuple(s["crossovers"])
+        return cls(meta["sample_rate"], meta["blocksize"], s, arrays)
+
+
+class PlanCache:
+    """Bounded LRU of DspPlans, optionally backed by .npz files in `directory`"""
+
+    def __init__(self, maxsize=PLAN_CACHE_SIZE, directory=PLAN_DIR):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._plans = collections.OrderedDict()
+        self.hits = self.loads = self.builds = 0
+
+    @staticmethod
+    def settings(lowcut, highcut, crossovers=MB_CROSSOVERS_HZ, stft_frame_ms=STFT_FRAME_MS,
+                 stft_overlap=STFT_OVERLAP, noise_s=NOISE_TABLE_S):
+        """Normalised settings dict; everything a plan depends on besides rate and block size"""
+        return {"lowcut": float(lowcut), "highcut": float(highcut),
+                "crossovers": tuple(float(f) for f in crossovers),
+                "stft_frame_ms": float(stft_frame_ms), "stft_overlap": int(stft_overlap),
+                "noise_s": float(noise_s)}
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"dsp-plan-{key[0]}-{key[1]}-{digest}.npz")
+
+    def get(self, sample_rate, blocksize, **settings):
+        settings = self.settings(**settings)
+        key = (int(sample_rate), int(blocksize), tuple(sorted(settings.items())))
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+        path = self._path(key) if self.directory else None
+        if path and os.path.exists(path):
+            try:
+                plan = DspPlan.load(path)
+                self.loads += 1
+            except Exception as e:
+                print(f"✗ Ignoring unreadable DSP plan {path}: {e}")
+        if plan is None:
+            plan = DspPlan.build(int(sample_rate), int(blocksize), settings)
+            self.builds += 1
+            if path:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    plan.save(path)
+                except OSError as e:
+                    print(f"✗ Could not save DSP plan: {e}")
+
+        self._plans[key] = plan
+        if len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+        return plan
+
+
+def bench_limiter(runs=200, sample_rate=22050, chunk=2048, channels=2):
+    """Limiter vs the old normalize_chunk + add_white_noise_chunk peak passes"""
+    rng = np.random.default_rng(0)
+    quiet = 0.1 * rng.standard_normal((channels, chunk))
+    loud = quiet.copy()
+    loud[:, chunk // 2:chunk // 2 + 20] *= 20.0        # a 1 ms transient
+    noise = 0.08 * rng.standard_normal((channels, chunk))
+    target = 0.7
+
+    def old(x, bed=noise):
+        p = np.abs(x).max()
+        if p > target:
+            x = x * (target / p)
+        mixed = x + bed
+        m = np.abs(mixed).max()
+        if m > 1.0:
+            mixed = mixed / m
+        return mixed
+
+    print(f"{channels} ch x {chunk} frames @ {sample_rate} Hz "
+          f"(lookahead {LIMITER_LOOKAHEAD_MS} ms, release {LIMITER_RELEASE_MS} ms)")
+    for name, x, att in (("below ceiling", quiet, 0.0), ("with transient", loud, None),
+                         ("release tail", quiet, 10.0)):
+        lim = LookaheadLimiter(sample_rate, target, channels=channels)
+
+        def limit():
+            if att is not None:
+                lim._att = att        # e.g. 10 dB of reduction still recovering
+            return lim.process(x + noise)
+        for label, fn in (("old normalize", lambda: old(x)), ("limiter", limit)):
+            print(f"  {name:<15} {label:<14} {_time(fn, runs) * 1e6:8.1f} us/chunk")
+
+    # What each does to the audio around the transient (noise bed mixed in first)
+    chunks = [c + noise for c in (quiet, loud, quiet, quiet)]
+    xs = np.concatenate(chunks, axis=1)
+    lim = LookaheadLimiter(sample_rate, target, channels=channels)
+    ys = np.concatenate([lim.process(c).copy() for c in chunks], axis=1)[:, lim.latency:]
+    olds = np.concatenate([old(c, 0.0) for c in chunks], axis=1)
+    for label, y in (("old normalize", olds), ("limiter", ys)):
+        x = xs[0, :y.shape[1]]
+        live = np.abs(x) > 0.05
+        gain_db = 20 * np.log10(y[0][live] / x[live])
+        print(f"  {label:<14} max out {np.abs(y).max():.3f} (ceiling {target}), "
+              f"max reduction {-gain_db.min():4.1f} dB, "
+              f"largest gain step {np.abs(np.diff(gain_db)).max():4.1f} dB")
+
+
+def _tone_db(x, freq, sample_rate):
+    """Level (dB) of the `freq` component of a mono signal"""
+    w = np.hanning(len(x))
+    spec = np.abs(np.fft.rfft(x * w))
+    k = int(round(freq * len(x) / sample_rate))
+    return 20 * np.log10(spec[k - 2:k + 3].max() + 1e-12)
+
+
+def _band_db(x, band, sample_rate):
+    """Energy (dB) of a mono signal between band[0] and band[1] Hz"""
+    f = np.fft.rfftfreq(len(x), 1.0 / sample_rate)
+    p = np.abs(np.fft.rfft(x)) ** 2
+    return 10 * np.log10(p[(f >= band[0]) & (f <= band[1])].sum() + 1e-12)
+
+
+def bench_harsh(runs=100, sample_rate=22050, chunk=2048, channels=2):
+    """HarshSuppressor cost per chunk, and its effect on a 3 kHz whistle that
+    starts over steady noise with a 1 kHz tone underneath"""
+    rng = np.random.default_rng(0)
+    deadline = chunk / sample_rate
+    x = 0.1 * rng.standard_normal((channels, chunk))
+    print(f"{channels} ch x {chunk} frames @ {sample_rate} Hz, deadline {deadline * 1e3:.1f} ms")
+    for gate in (False, True):
+        hs = HarshSuppressor(sample_rate, channels, gate=gate)
+        dt = _time(lambda: hs.process(x), runs)
+        print(f"  harsh suppressor{' + gate' if gate else '':<7} nfft {hs.nfft} hop {hs.hop}: "
+              f"{dt * 1e6:7.1f} us/chunk ({dt / deadline:.2%} of deadline), "
+              f"+{hs.latency / sample_rate * 1e3:.1f} ms latency")
+
+    n = int(6 * sample_rate)
+    t = np.arange(n) / sample_rate
+    bed = 0.05 * rng.standard_normal(n) + 0.1 * np.sin(2 * np.pi * 1000 * t)
+    whistle = np.where(t >= 3.0, 0.3 * np.sin(2 * np.pi * 3000 * t), 0.0)
+    sig = np.tile(bed + whistle, (channels, 1))
+    hs = HarshSuppressor(sample_rate, channels)
+    y = np.concatenate([hs.process(sig[:, i:i + chunk]) for i in range(0, n - chunk + 1, chunk)], axis=1)
+    y = y[0, hs.latency:]
+    x0 = sig[0, :len(y)]
+    i, j = int(1.0 * sample_rate), int(2.9 * sample_rate)
+    print(f"  {'before the whistle':<22} noise in band {_band_db(y[i:j], HARSH_BAND_HZ, sample_rate) - _band_db(x0[i:j], HARSH_BAND_HZ, sample_rate):+6.1f} dB"
+          f"   1 kHz {_tone_db(y[i:j], 1000, sample_rate) - _tone_db(x0[i:j], 1000, sample_rate):+6.1f} dB")
+    for label, a, b in (("whistle, first 0.5 s", 3.0, 3.5), ("whistle, 2.5 s in", 5.5, 5.9)):
+        i, j = int(a * sample_rate), int(b * sample_rate)
+        change = [_tone_db(y[i:j], f, sample_rate) - _tone_db(x0[i:j], f, sample_rate) for f in (3000, 1000)]
+        print(f"  {label:<22} 3 kHz {change[0]:+6.1f} dB   1 kHz {change[1]:+6.1f} dB")
+
+def bench_multiband(runs=200, sample_rate=48000, chunk=512, channels=2, threshold_db=-20.0):
+    """MultibandCompressor cost per callback, and how far a bass drum pulls a
+    1 kHz "voice" down with it: full-band (LiveMicCompressor.compress_chunk)
+    vs 3 bands"""
+    rng = np.random.default_rng(0)
+    deadline = chunk / sample_rate
+    x = 0.2 * rng.standard_normal((channels, chunk))
+    print(f"{channels} ch x {chunk} frames @ {sample_rate} Hz, deadline {deadline * 1e3:.1f} ms")
+    for xo in (MB_CROSSOVERS_HZ, (200.0, 1000.0, 4000.0)):
+        mb = MultibandCompressor(sample_rate, channels, xo, (4.0,) * (len(xo) + 1), threshold_db)
+        dt = _time(lambda: mb.process(x), runs)
+        print(f"  {len(xo) + 1} bands {str(tuple(int(f) for f in xo)):<18} "
+              f"{dt * 1e6:7.1f} us/chunk ({dt / deadline:.2%} of deadline)")
+
+    threshold = 10 ** (threshold_db / 20)
+
+    def full_band(data, ratio=4.0):
+        gain = np.maximum(np.abs(data), threshold) / threshold
+        return data * gain ** (1.0 / ratio - 1.0)
+
+    n = 4 * sample_rate
+    t = np.arange(n) / sample_rate
+    hits = (t % 0.5) < 0.1
+    drum = np.where(hits, 0.8 * np.sin(2 * np.pi * 60 * t) * np.exp(-(t % 0.5) / 0.05), 0.0)
+    voice = 0.05 * np.sin(2 * np.pi * 1000 * t)
+    sig = np.tile(drum + voice, (channels, 1))
+    mb = MultibandCompressor(sample_rate, channels, threshold_db=threshold_db)
+    ys = {"full-band": np.concatenate([full_band(sig[:, i:i + chunk]) for i in range(0, n, chunk)], axis=1),
+          "3-band": np.concatenate([mb.process(sig[:, i:i + chunk]) for i in range(0, n, chunk)], axis=1)}
+    during = hits & (t % 0.5 < 0.05) & (t > 1.0)
+    between = (t % 0.5 > 0.25) & (t > 1.0)
+
+    def voice_db(y, mask):
+        # 1 kHz level from a quadrature demodulation, so the drum doesn't count
+        i = y[mask] * np.sin(2 * np.pi * 1000 * t[mask])
+        q = y[mask] * np.cos(2 * np.pi * 1000 * t[mask])
+        return 10 * np.log10(4 * (i.mean() ** 2 + q.mean() ** 2))
+
+    for name, y in ys.items():
+        print(f"  {name:<9} voice during drum hits {voice_db(y[0], during) - voice_db(y[0], between):+6.1f} dB "
+              f"relative to between hits")
+
+
+def bench_plan(sample_rate=22050, chunk=2048):
+    """What a settings change or device reopen costs: build vs cache hit vs .npz load"""
+    import tempfile
+    import time
+
+    settings = {"lowcut": 200, "highcut": 6000}
+    PlanCache().get(sample_rate, chunk, **settings)      # scipy imported once
+    with tempfile.TemporaryDirectory() as d:
+        cache = PlanCache(directory=d)
+        t0 = time.perf_counter()
+        cache.get(sample_rate, chunk, **settings)
+        t_build = time.perf_counter() - t0
+        t_hit = _time(lambda: cache.get(sample_rate, chunk, **settings), 200)
+        t0 = time.perf_counter()
+        PlanCache(directory=d).get(sample_rate, chunk, **settings)
+        t_load = time.perf_counter() - t0
+        t_stages = _time(lambda: (HarshSuppressor(sample_rate, 2),
+                                  MultibandCompressor(sample_rate, 2)), 50)
+        plan = cache.get(sample_rate, chunk, **settings)
+        t_stages_plan = _time(lambda: (HarshSuppressor(sample_rate, 2, windows=plan.stft_windows),
+                                       MultibandCompressor(sample_rate, 2, sos=plan.crossover_sos)), 50)
+    print(f"DSP plan @ {sample_rate} Hz / {chunk}: build {t_build * 1e3:.2f} ms, "
+          f"disk load {t_load * 1e3:.2f} ms, cache hit {t_hit * 1e6:.1f} us")
+    print(f"  stage setup: designing filters {t_stages * 1e3:.2f} ms, from the plan {t_stages_plan * 1e3:.2f} ms")
+
+
+def bench(sample_rate=22050, chunk=2048):
+    bench_limiter(sample_rate=sample_rate, chunk=chunk)
+    print()
+    bench_harsh(sample_rate=sample_rate, chunk=chunk)
+    print()
+    bench_multiband()
+    print()
+    bench_plan(sample_rate, chunk)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Streaming DSP stages')
+    parser.add_argument('--bench', action='store_true', help='Per-chunk cost of each stage')
+    parser.add_argument('--rate', type=int, default=22050)
+    parser.add_argument('--chunk', type=int, default=2048)
+    args = parser.parse_args()
+    if args.bench:
+        bench(sample_rate=args.rate, chunk=args.chunk)
+    else:
+        parser.print_help()
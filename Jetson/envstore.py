@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+settings.env / store.env access: reads from memory, one batched writer.
+
+`dotenv.set_key` rewrites the whole file in place on every call. A reader
+could catch it half-written, two writers could each drop the other's key,
+and /update_settings rewrote settings.env once per key. EnvStore instead:
+
+- keeps the file's values in a dict, so get()/values() never touch the disk;
+  refresh() re-reads only when the file was replaced (one stat otherwise)
+- set()/update() record the values and return; a writer thread folds
+  everything pending into one write, at most every `min_interval` seconds
+- each write goes to a temp file next to the original and is os.replace()d
+  over it, so readers (this module, dotenv_values, the audio script) see the
+  old file or the new one, never a mix
+- the read-merge-write runs under an flock on `<file>.lock`, and keys that
+  another process wrote since our last read are kept, so two processes
+  sharing a file don't lose each other's updates
+
+Use `open_env(path)` to get the one store per file in this process.
+
+Concurrency stress test (torn reads / lost updates / writes, vs set_key):
+    python envstore.py --stress
+"""
+import atexit
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:     # not on Windows; the rename is still atomic
+    fcntl = None
+
+MIN_WRITE_INTERVAL = 0.1    # seconds between writes of one file
+
+_SPECIAL = set(" \t#'\"\\$=\n")
+
+
+def _format(value):
+    """KEY=value text for a value, single-quoted when dotenv would misread it"""
+    if value and not (_SPECIAL & set(value)):
+        return value
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def read_env(path):
+    """{key: value} of a dotenv file (empty if it doesn't exist)"""
+    from dotenv import dotenv_values
+
+    if not os.path.exists(path):
+        return {}
+    return {k: v for k, v in dotenv_values(path).items() if v is not None}
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._f = open(self.path, "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+
+
+class EnvStore:
+    def __init__(self, path, min_interval=MIN_WRITE_INTERVAL, durable=False):
+        """`durable` fsyncs each write before the rename (for settings that
+        must survive a power cut; store.env values are rewritten anyway)"""
+        self.path = path
+        self.min_interval = min_interval
+        self.durable = durable
+        self._cv = threading.Condition()
+        self._values = {}
+        self._pending = {}
+        self._inflight = {}         # being written right now
+        self._stamp = None
+        self._queued = 0            # update() calls so far
+        self._written = 0           # ... of which are on disk
+        self._last_write = 0.0
+        self._closed = False
+        self.writes = 0
+        self.updates = 0
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name=f"env:{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    # ---- reads ----
+    def refresh(self):
+        """Re-read the file if another process replaced it; True if it did"""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return False
+        values = read_env(self.path) if stamp else {}
+        with self._cv:
+            values.update(self._inflight)   # ours, not on disk yet, are newer
+            values.update(self._pending)
+            self._values = values
+            self._stamp = stamp
+        return True
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self._values[key])
+        except (KeyError, ValueError):
+            return default
+
+    def values(self):
+        return dict(self._values)
+
+    # ---- writes ----
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, mapping):
+        """Record new values; they reach the file within `min_interval`"""
+        if not mapping:
+            return
+        with self._cv:
+            values = dict(self._values)
+            for key, value in mapping.items():
+                values[key] = self._pending[key] = str(value)
+            self._values = values
+            self.updates += len(mapping)
+            self._queued += 1
+            self._cv.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until everything set so far is on disk; False on timeout"""
+        with self._cv:
+            target = self._queued
+            return self._cv.wait_for(lambda: self._written >= target or self._closed, timeout)
+
+    def close(self, timeout=2.0):
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                wait = self._last_write + self.min_interval - time.monotonic()
+                if wait > 0 and not self._closed:
+                    # Let more updates pile up behind the rate limit
+                    self._cv.wait(wait)
+                    continue
+                self._inflight, self._pending = self._pending, {}
+                queued = self._queued
+            try:
+                self._write()
+                ok = True
+            except OSError as e:
+                print(f"✗ Could not write {self.path}: {e}")
+                ok = False
+            with self._cv:
+                if ok:
+                    self._written = queued
+                else:
+                    self._inflight.update(self._pending)
+                    self._pending = self._inflight
+                self._inflight = {}
+                self._last_write = time.monotonic()
+                self._cv.notify_all()
+                if self._closed and not ok:
+                    return
+
+    def _write(self):
+        with _FileLock(self.path + ".lock"):
+            stamp = self._stat()
+            disk = read_env(self.path) if stamp is not None and stamp != self._stamp else None
+            with self._cv:
+                if disk is not None:
+                    # Another process wrote; keep its keys, ours win where both changed
+                    disk.update(self._inflight)
+                    disk.update(self._pending)
+                    self._values = disk
+                values = self._values
+            text = "".join(f"{k}={_format(v)}\n" for k, v in values.items())
+            folder, name = os.path.split(os.path.abspath(self.path))
+            tmp = os.path.join(folder, f".{name}.{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                f.write(text)
+                if self.durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            with self._cv:
+                self._stamp = self._stat()
+            self.writes += 1
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_env(path, **kwargs):
+    """The EnvStore for `path` in this process (created on first use)"""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = EnvStore(path, **kwargs)
+        return store
+
+
+# ---- Stress test ----
+def _stress_process(path, keys, seconds, prefix):
+    """Child process: hammer `keys` of `path`, print the last value of each"""
+    store = EnvStore(path)
+    n, end = 0, time.monotonic() + seconds
+    while time.monotonic() < end:
+        store.update({k: f"{prefix}{n}" for k in keys})
+        n += 1
+    store.flush(5.0)
+    print(n - 1)
+
+
+def stress(seconds=3.0, writers=4, readers=2, directory=None):
+    import subprocess
+    import sys
+    import tempfile
+    from dotenv import set_key
+
+    directory = directory or tempfile.mkdtemp(prefix="envstore-")
+    results = {}
+
+    def run(name, write_key):
+        path = os.path.join(directory, f"{name}.env")
+        with open(path, "w") as f:
+            f.write("".join(f"W{i}_{j}=init\n" for i in range(writers) for j in range(3)))
+        expected = {f"W{i}_{j}" for i in range(writers) for j in range(3)}
+        last = {}
+        torn = reads = 0
+        stop = threading.Event()
+
+        def writer(i):
+            n = 0
+            while not stop.is_set():
+                write_key(path, {f"W{i}_{j}": f"{i}.{n}" for j in range(3)})
+                last[i] = n
+                n += 1
+
+        def reader():
+            nonlocal torn, reads
+            while not stop.is_set():
+                try:
+                    got = read_env(path)
+                except Exception:
+                    got = {}
+                reads += 1
+                if set(got) != expected:
+                    torn += 1
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        return path, last, torn, reads
+
+    # Baseline: dotenv.set_key, once per key, as the old code did
+    def with_set_key(path, values):
+        for k, v in values.items():
+            set_key(path, k, v)
+
+    path, last, torn, reads = run("set_key", with_set_key)
+    final = read_env(path)
+    lost = sum(final.get(f"W{i}_{j}") != f"{i}.{n}" for i, n in last.items() for j in range(3))
+    results["set_key"] = (sum(last.values()) + len(last), torn, reads, lost, None)
+
+    store_box = {}
+
+    def with_store(path, values):
+        store = store_box.get(path)
+        if store is None:
+            store = store_box[path] = EnvStore(path)
+        store.update(values)
+
+    path, last, torn, reads = run("envstore", with_store)
+    store = store_box[path]
+    store.flush(5.0)
+    final = read_env(path)
+    lost = sum(final.get(f"W{i}_{j}") != f"{i}.{n}" for i, n in last.items() for j in range(3))
+    results["EnvStore"] = (store.updates // 3, torn, reads, lost, store.writes)
+
+    # Two processes writing different keys of one file
+    path = os.path.join(directory, "shared.env")
+    open(path, "w").close()
+    procs = [subprocess.Popen([sys.executable, __file__, "--stress-child", path, f"P{i}", str(seconds)],
+                              stdout=subprocess.PIPE, text=True) for i in range(2)]
+    counts = [int(p.communicate()[0].split()[-1]) for p in procs]
+    final = read_env(path)
+    xlost = sum(final.get(f"P{i}_{j}") != f"P{i}.{n}" for i, n in enumerate(counts) for j in range(3))
+
+    print(f"{writers} writer threads x 3 keys, {readers} reader threads, {seconds:g} s  ({directory})")
+    print(f"  {'':<10} {'updates':>9} {'torn reads':>14} {'lost keys':>10} {'file writes':>12}")
+    for name, (updates, torn, reads, lost, writes) in results.items():
+        print(f"  {name:<10} {updates:>9} {torn:>6}/{reads:<7} {lost:>10} {writes if writes is not None else updates * 3:>12}")
+    print(f"  2 processes sharing one file: {xlost} of 6 final values lost")
+    ok = results["EnvStore"][1] == 0 and results["EnvStore"][3] == 0 and xlost == 0
+    print(f"{'✓' if ok else '✗'} EnvStore: no torn reads, no lost updates")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Batched atomic .env writer')
+    parser.add_argument('--stress', action='store_true', help='Concurrent writers/readers vs dotenv.set_key')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--stress-child', nargs=3, metavar=('PATH', 'PREFIX', 'SECONDS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stress_child:
+        path, prefix, seconds = args.stress_child
+        _stress_process(path, [f"{prefix}_{j}" for j in range(3)], float(seconds), prefix + ".")
+    elif args.stress:
+        sys.exit(0 if stress(args.seconds) else 1)
+    else:
+        parser.print_help()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Windowed sensor features for /recommend, updated in O(1) per sample.
+
+/recommend used to get one instantaneous (brightness, amplitude) pair, fired
+on every threshold crossing, so light flickering around the threshold meant
+an expensive call every API_COOLDOWN seconds with a noisy reading each time.
+Here each sensor feeds a RollingWindow instead:
+
+- EMA with a time constant (dt-aware, so frame drops don't change it)
+- mean / variance over the last `window_s` seconds from running sums
+  (re-summed once per window's worth of samples so rounding can't drift)
+- fraction of the window above a threshold, with a band around it that
+  counts half (a running count; a threshold change recounts once, on the
+  producer's thread)
+- window max from a monotonic deque
+- percentiles from a fixed-bin histogram: add/evict is one increment, a
+  query walks FEATURE_BINS bins whatever the window length
+
+Each sample enters and leaves the window once, so everything is amortised
+O(1) per sample. The camera keeps brightness and flicker windows, the audio
+script keeps loudness and publishes it to store.env (AMPLITUDE,
+AMPLITUDE_P90, LOUD_FRACTION).
+
+ChangeTrigger fires when the feature vector has moved far enough from the
+one last sent (distance in units of FEATURE_SCALES) and has settled there,
+at most once per cooldown. Noise or flicker around the threshold barely
+moves a 10 s window, so it no longer causes calls; a real change in the
+scene or the room does, once, with the new readings.
+
+Calls made by the old crossing trigger vs this one on synthetic scenes:
+    python features.py --bench
+"""
+import math
+import time
+from collections import deque
+
+FEATURE_WINDOW_S = 10.0     # rolling window for mean/std/fractions/percentiles
+FEATURE_EMA_S    = 3.0      # EMA time constant
+THRESHOLD_BAND   = 0.05     # time-above-threshold: +-band around the threshold counts half
+FEATURE_BINS     = 128      # percentile histogram resolution
+LOUDNESS_MAX     = 0.5      # chunk RMS range of the loudness histogram
+LOUDNESS_BAND    = 0.02     # THRESHOLD_BAND for chunk RMS
+FEATURE_WARMUP_S = 3.0      # first recommendation once the windows have this much
+FEATURE_SETTLE_S = 2.0      # ...and only once the vector has stopped moving for this long
+SETTLE_DISTANCE  = 0.5
+
+# How far each feature has to move to count as one unit of change; the
+# trigger fires at a combined (Euclidean) distance of 1 from the last call
+FEATURE_SCALES = {
+    "brightness": 0.10,
+    "brightness_std": 0.08,
+    "above_threshold": 0.50,
+    "flicker": 0.15,
+    "flicker_peak": 0.30,
+    "loudness": 0.08,
+    "loudness_p90": 0.10,
+    "loud_fraction": 0.50,
+}
+
+# store.env keys the audio script publishes its loudness features under
+LOUDNESS_KEYS = {"loudness": "AMPLITUDE", "loudness_p90": "AMPLITUDE_P90", "loud_fraction": "LOUD_FRACTION"}
+
+
+class RollingWindow:
+    """EMA plus mean/std/max/fraction-above/percentiles over the last
+    `window_s` seconds of one signal. Single producer; readers on other
+    threads may see a value one sample stale."""
+
+    def __init__(self, window_s=FEATURE_WINDOW_S, ema_s=FEATURE_EMA_S, threshold=None,
+                 band=THRESHOLD_BAND, bins=None, lo=0.0, hi=1.0):
+        self.window_s = window_s
+        self.ema_s = ema_s
+        self.threshold = threshold
+        self.band = band
+        self.ema = None
+        self._items = deque()       # (t, x)
+        self._max = deque()         # (t, x), x decreasing
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._resum = 0             # samples since the sums were recomputed
+        self._above = 0             # in halves: 2 above the band, 1 inside it
+        self._counted_for = threshold
+        self._last_t = None
+        self._lo, self._hi = lo, hi
+        self._hist = [0] * bins if bins else None
+
+    def _bin(self, x):
+        n = len(self._hist)
+        i = int((x - self._lo) / (self._hi - self._lo) * n)
+        return 0 if i < 0 else n - 1 if i >= n else i
+
+    def _level(self, x):
+        if self.threshold is None or x <= self.threshold - self.band:
+            return 0
+        return 2 if x > self.threshold + self.band else 1
+
+    def add(self, t, x):
+        # EMA with the real time step
+        if self.ema is None:
+            self.ema = x
+        else:
+            a = 1.0 - math.exp(-max(0.0, t - self._last_t) / self.ema_s)
+            self.ema += a * (x - self.ema)
+        self._last_t = t
+
+        if self.threshold != self._counted_for:
+            self._counted_for = self.threshold
+            self._above = sum(self._level(v) for _, v in self._items)
+
+        items = self._items
+        items.append((t, x))
+        self._sum += x
+        self._sumsq += x * x
+        self._above += self._level(x)
+        if self._hist is not None:
+            self._hist[self._bin(x)] += 1
+        m = self._max
+        while m and m[-1][1] <= x:
+            m.pop()
+        m.append((t, x))
+
+        cutoff = t - self.window_s
+        while items[0][0] < cutoff:
+            _, old = items.popleft()
+            self._sum -= old
+            self._sumsq -= old * old
+            self._above -= self._level(old)
+            if self._hist is not None:
+                self._hist[self._bin(old)] -= 1
+        while m[0][0] < cutoff:
+            m.popleft()
+
+        self._resum += 1
+        if self._resum >= max(len(items), 256):
+            self._sum = sum(v for _, v in items)
+            self._sumsq = sum(v * v for _, v in items)
+            self._resum = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def span(self):
+        """Seconds of data in the window"""
+        return self._items[-1][0] - self._items[0][0] if self._items else 0.0
+
+    def mean(self):
+        n = len(self._items)
+        return self._sum / n if n else 0.0
+
+    def std(self):
+        n = len(self._items)
+        if n < 2:
+            return 0.0
+        mean = self._sum / n
+        return math.sqrt(max(0.0, self._sumsq / n - mean * mean))
+
+    def max(self):
+        return self._max[0][1] if self._max else 0.0
+
+    def fraction_above(self):
+        """Share of the window above the threshold; samples within `band`
+        of it count half, so hovering at the threshold reads a steady 0.5"""
+        n = len(self._items)
+        return self._above / (2 * n) if n and self.threshold is not None else 0.0
+
+    def percentile(self, q):
+        """q-th percentile (0-100), to the histogram's bin width"""
+        n = len(self._items)
+        if not n or self._hist is None:
+            return 0.0
+        rank = q / 100.0 * n
+        seen = 0
+        width = (self._hi - self._lo) / len(self._hist)
+        for i, count in enumerate(self._hist):
+            if count and seen + count >= rank:
+                # Interpolate inside the bin
+                return self._lo + width * (i + (rank - seen) / count)
+            seen += count
+        return self._hi
+
+
+class CameraFeatures:
+    """Brightness and flicker windows for the camera loop"""
+
+    def __init__(self, threshold=0.5, window_s=FEATURE_WINDOW_S, ema_s=FEATURE_EMA_S):
+        self.brightness = RollingWindow(window_s, ema_s, threshold=threshold)
+        self.flicker = RollingWindow(window_s, ema_s)
+
+    def set_threshold(self, threshold):
+        self.brightness.threshold = threshold
+
+    def add(self, t, brightness, flicker):
+        self.brightness.add(t, brightness)
+        self.flicker.add(t, flicker)
+
+    def span(self):
+        return self.brightness.span()
+
+    def vector(self):
+        b = self.brightness
+        return {
+            "brightness": b.ema,
+            "brightness_std": b.std(),
+            "above_threshold": b.fraction_above(),
+            "flicker": self.flicker.mean(),
+            "flicker_peak": self.flicker.max(),
+        }
+
+
+class LoudnessFeatures:
+    """Input loudness (chunk RMS) window for the audio callback"""
+
+    def __init__(self, threshold=0.5, window_s=FEATURE_WINDOW_S, ema_s=FEATURE_EMA_S):
+        self.window = RollingWindow(window_s, ema_s, threshold=threshold, band=LOUDNESS_BAND,
+                                    bins=FEATURE_BINS, hi=LOUDNESS_MAX)
+
+    def set_threshold(self, threshold):
+        self.window.threshold = threshold
+
+    def add(self, t, rms):
+        self.window.add(t, rms)
+
+    def vector(self):
+        w = self.window
+        if w.ema is None:
+            return {}
+        return {"loudness": w.ema, "loudness_p90": w.percentile(90), "loud_fraction": w.fraction_above()}
+
+    def store_values(self):
+        """store.env keys/values for the recommender"""
+        return {LOUDNESS_KEYS[k]: f"{v:.6f}" for k, v in self.vector().items()}
+
+
+def loudness_from_store(store):
+    """The audio script's loudness features from store.env ({} if it isn't running)"""
+    out = {}
+    for name, key in LOUDNESS_KEYS.items():
+        value = store.get(key)
+        if value is not None:
+            try:
+                out[name] = float(value)
+            except ValueError:
+                pass
+    return out
+
+
+def features_from_request(body):
+    """The known features from a /recommend JSON body ({"features": {...}}),
+    as floats. Unknown names are dropped; ValueError if the body or the
+    features aren't objects or a value isn't a finite number."""
+    if body is None:
+        return {}
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    raw = body.get("features")
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError('"features" must be a JSON object')
+    out = {}
+    for name, value in raw.items():
+        if name not in FEATURE_SCALES:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"feature {name!r} is not a number") from None
+        if not math.isfinite(value):
+            raise ValueError(f"feature {name!r} is not finite")
+        out[name] = value
+    return out
+
+
+class ChangeTrigger:
+    """Fires when the feature vector is at least distance 1 (in FEATURE_SCALES
+    units) from the vector of the last call and has settled (moved less than
+    SETTLE_DISTANCE over the last `settle_s`), at most once per `cooldown_s`.
+    The first call goes out once `warmup_s` of data is in."""
+
+    def __init__(self, cooldown_s=5.0, scales=None, warmup_s=FEATURE_WARMUP_S, settle_s=FEATURE_SETTLE_S):
+        self.cooldown_s = cooldown_s
+        self.scales = scales or FEATURE_SCALES
+        self.warmup_s = warmup_s
+        self.settle_s = settle_s
+        self.last_call = None
+        self.last_vector = None
+        self.distance = 0.0
+        self._anchors = deque()     # (t, vector) every settle_s / 2, for the settle check
+
+    def distance_between(self, a, b):
+        """Scaled distance; features missing on either side are skipped"""
+        d2 = 0.0
+        for key, value in a.items():
+            scale = self.scales.get(key)
+            ref = b.get(key)
+            if scale and ref is not None and value is not None:
+                d2 += ((value - ref) / scale) ** 2
+        return math.sqrt(d2)
+
+    def _settled(self, now, vector):
+        anchors = self._anchors
+        if not anchors or now - anchors[-1][0] >= self.settle_s / 2:
+            anchors.append((now, dict(vector)))
+        while len(anchors) > 1 and now - anchors[1][0] >= self.settle_s:
+            anchors.popleft()
+        t, ref = anchors[0]
+        return now - t >= self.settle_s and self.distance_between(vector, ref) < SETTLE_DISTANCE
+
+    def step(self, now, vector, span=None):
+        settled = self._settled(now, vector)
+        if self.last_call is None and span is not None and span < self.warmup_s:
+            return False
+        if self.last_call is not None and now - self.last_call < self.cooldown_s:
+            return False
+        self.distance = math.inf if self.last_vector is None else self.distance_between(vector, self.last_vector)
+        if self.distance < 1.0 or not settled:
+            return False
+        self.last_call = now
+        self.last_vector = dict(vector)
+        return True
+
+
+# ---- Benchmark ----
+def _scenes(fps=30.0, seconds=600.0, seed=1):
+    """Synthetic (t, brightness, flicker) streams for the bench"""
+    import random
+
+    rng = random.Random(seed)
+    n = int(fps * seconds)
+    ts = [i / fps for i in range(n)]
+    return {
+        # Hovering at the threshold with sensor noise and a slow wobble
+        "near threshold": [(t, 0.5 + 0.03 * math.sin(t / 4.0) + rng.gauss(0, 0.02), 0.05) for t in ts],
+        # A 2 Hz strobe straddling the threshold
+        "flicker at threshold": [(t, 0.5 + (0.08 if int(t * 4) % 2 else -0.08) + rng.gauss(0, 0.01),
+                                  0.6 + rng.gauss(0, 0.05)) for t in ts],
+        # Real changes: dark room, bright window, dark again, every 2 minutes
+        "scene changes": [(t, (0.25 if int(t // 120) % 2 == 0 else 0.8) + rng.gauss(0, 0.02), 0.05) for t in ts],
+    }
+
+
+def bench(threshold=0.5, cooldown_s=5.0):
+    from glare import RecommendTrigger
+
+    print(f"threshold {threshold}, cooldown {cooldown_s:g} s, window {FEATURE_WINDOW_S:g} s, 30 fps x 10 min")
+    print(f"  {'scene':<22} {'crossing trigger':>17} {'feature trigger':>16}")
+    for name, samples in _scenes().items():
+        old = RecommendTrigger(cooldown_s)
+        feats = CameraFeatures(threshold)
+        new = ChangeTrigger(cooldown_s)
+        # The old trigger watched the glare EMA (~1 s); feed it the same
+        ema = None
+        old_calls = new_calls = 0
+        for t, b, f in samples:
+            ema = b if ema is None else ema + 0.1 * (b - ema)
+            old_calls += old.step(t, ema, threshold)
+            feats.add(t, b, f)
+            new_calls += new.step(t, feats.vector(), feats.span())
+        print(f"  {name:<22} {old_calls:>17} {new_calls:>16}")
+
+    # Per-sample cost
+    feats = CameraFeatures(threshold)
+    loud = LoudnessFeatures(0.3)
+    trig = ChangeTrigger(cooldown_s)
+    samples = _scenes()["near threshold"]
+    t0 = time.perf_counter()
+    for t, b, f in samples:
+        feats.add(t, b, f)
+        trig.step(t, feats.vector(), feats.span())
+    per_frame = (time.perf_counter() - t0) / len(samples)
+    t0 = time.perf_counter()
+    for t, b, _ in samples:
+        loud.add(t, b * 0.5)
+    per_chunk = (time.perf_counter() - t0) / len(samples)
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        loud.vector()
+    print(f"  camera add+vector+trigger {per_frame * 1e6:.1f} us/frame, loudness add {per_chunk * 1e6:.1f} us/chunk, "
+          f"loudness vector {(time.perf_counter() - t0) * 1e3:.1f} us")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Windowed sensor features')
+    parser.add_argument('--bench', action='store_true', help='Recommend calls: crossing trigger vs feature trigger')
+    args = parser.parse_args()
+    if args.bench:
+        bench()
+    else:
+        parser.print_help()
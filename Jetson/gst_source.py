@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Zero-copy GStreamer frame source for the Jetson camera loop.
+
+`cv2.VideoCapture(... ! videoconvert ! video/x-raw,format=BGR ! appsink)`
+converts every pixel on the CPU and then copies the result into a fresh
+NumPy array on each read(). AppsinkCamera instead pulls GRAY8 or NV12
+buffers (nvvidconv writes them, no videoconvert) straight from appsink,
+maps them read-only and returns a NumPy view of the luma plane, honouring
+the buffer's stride/offset. No pixel is copied in Python. (gst-python 1.18+
+maps to a memoryview; older bindings hand back bytes, which still works but
+costs one copy.)
+
+The appsink is configured `max-buffers=1 drop=true sync=false`, so a slow
+loop always gets the newest frame rather than a backlog.
+
+A returned frame is only valid while its buffer is mapped: the source keeps
+the last `keep` buffers mapped and unmaps older ones on read(). Set `keep`
+to the number of reads a frame must survive (the monitor grabs the next
+frame while the current one is analysed, so at least 2).
+
+Test against videotestsrc (needs PyGObject + GStreamer, no camera):
+    python gst_source.py --selftest
+"""
+from collections import deque
+
+import numpy as np
+
+APPSINK = "appsink name=sink max-buffers=1 drop=true sync=false"
+
+_Gst = None
+_GstVideo = None
+
+
+def _gst():
+    global _Gst, _GstVideo
+    if _Gst is None:
+        import gi
+        gi.require_version("Gst", "1.0")
+        gi.require_version("GstVideo", "1.0")
+        from gi.repository import Gst, GstVideo
+        Gst.init(None)
+        _Gst, _GstVideo = Gst, GstVideo
+    return _Gst
+
+
+class AppsinkCamera:
+    """Same read()/set()/release() surface as cv2.VideoCapture; `pipeline`
+    must end in APPSINK and produce GRAY8 or NV12 system-memory buffers."""
+
+    def __init__(self, pipeline, keep=2, timeout_s=1.0):
+        Gst = _gst()
+        self.keep = max(1, keep)
+        self._timeout_ns = int(timeout_s * Gst.SECOND)
+        self._held = deque()
+        self._layouts = {}
+        self.pipeline = Gst.parse_launch(pipeline)
+        self.sink = self.pipeline.get_by_name("sink")
+        if self.sink is None:
+            raise ValueError("pipeline has no element named 'sink' (end it with APPSINK)")
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.pipeline.set_state(Gst.State.NULL)
+            raise RuntimeError(f"could not start pipeline: {pipeline}")
+        ret, _, _ = self.pipeline.get_state(2 * Gst.SECOND)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            self.pipeline.set_state(Gst.State.NULL)
+            raise RuntimeError(f"pipeline failed to preroll: {pipeline}")
+        self.last_pts = None
+
+    def isOpened(self):
+        return self.pipeline is not None
+
+    def _plane0(self, caps, buf):
+        """(height, width, offset, stride) of the luma plane"""
+        key = caps.to_string()
+        layout = self._layouts.get(key)
+        if layout is None:
+            info = _GstVideo.VideoInfo.new_from_caps(caps)
+            fmt = info.finfo.name if info.finfo else "?"
+            if fmt not in ("GRAY8", "NV12"):
+                raise ValueError(f"appsink delivered {fmt}; expected GRAY8 or NV12")
+            layout = self._layouts[key] = (info.height, info.width, info.offset[0], info.stride[0])
+        meta = _GstVideo.buffer_get_video_meta(buf)
+        if meta is not None:
+            # Hardware converters may pad rows differently per buffer
+            h, w, _, _ = layout
+            return h, w, meta.offset[0], meta.stride[0]
+        return layout
+
+    def read(self):
+        sample = self.sink.emit("try-pull-sample", self._timeout_ns)
+        if sample is None:
+            return False, None
+        Gst = _Gst
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return False, None
+        h, w, offset, stride = self._plane0(sample.get_caps(), buf)
+        frame = np.ndarray((h, w), dtype=np.uint8, buffer=info.data, offset=offset, strides=(stride, 1))
+        self.last_pts = buf.pts
+        self._held.append((buf, info))
+        while len(self._held) > self.keep:
+            old_buf, old_info = self._held.popleft()
+            old_buf.unmap(old_info)
+        return True, frame
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        if self.pipeline is None:
+            return
+        while self._held:
+            buf, info = self._held.popleft()
+            buf.unmap(info)
+        self.pipeline.set_state(_Gst.State.NULL)
+        self.pipeline = None
+
+
+def selftest():
+    import time
+
+    ok = True
+
+    def check(name, cond, detail=""):
+        nonlocal ok
+        ok &= bool(cond)
+        print(f"  {'✓' if cond else '✗'} {name}{'  ' + detail if detail else ''}")
+
+    # Solid frames: shape, values, and that we got a view rather than a copy
+    # (white is 255 in GRAY8, 235 in limited-range NV12)
+    for fmt, width in (("GRAY8", 640), ("GRAY8", 642), ("NV12", 640)):
+        cam = AppsinkCamera(
+            f"videotestsrc pattern=white num-buffers=5 ! "
+            f"video/x-raw, format={fmt}, width={width}, height=480, framerate=30/1 ! {APPSINK}")
+        got, frame = cam.read()
+        check(f"{fmt} {width}x480 read", got and frame.shape == (480, width))
+        if got:
+            check(f"{fmt} {width}x480 luma plane", int(frame.min()) == int(frame.max()) >= 230,
+                  f"min {frame.min()} max {frame.max()}")
+            check(f"{fmt} {width}x480 zero-copy view", not frame.flags.owndata and frame.base is not None)
+        cam.release()
+
+    # Moving pattern: consecutive reads are different frames
+    cam = AppsinkCamera("videotestsrc pattern=ball num-buffers=10 ! "
+                        f"video/x-raw, format=GRAY8, width=320, height=240, framerate=30/1 ! {APPSINK}",
+                        keep=2)
+    _, a = cam.read()
+    _, b = cam.read()
+    check("consecutive frames stay valid (keep=2)", a is not None and b is not None and not np.array_equal(a, b))
+    cam.release()
+
+    # Live source + slow consumer: max-buffers=1 drop=true hands out the newest frame
+    Gst = _gst()
+    cam = AppsinkCamera("videotestsrc is-live=true ! "
+                        f"video/x-raw, format=GRAY8, width=320, height=240, framerate=60/1 ! {APPSINK}")
+    cam.read()
+    time.sleep(0.5)
+    cam.read()
+    running = cam.pipeline.get_clock().get_time() - cam.pipeline.get_base_time()
+    lag_ms = (running - cam.last_pts) / Gst.MSECOND
+    check("stale frames dropped", lag_ms < 3 * 1000 / 60, f"newest frame is {lag_ms:.1f} ms old after a 500 ms stall")
+    cam.release()
+
+    # Throughput of map + view vs. nothing else
+    cam = AppsinkCamera("videotestsrc pattern=snow num-buffers=600 ! "
+                        f"video/x-raw, format=GRAY8, width=640, height=480, framerate=600/1 ! {APPSINK}")
+    n, t0 = 0, time.perf_counter()
+    while cam.read()[0]:
+        n += 1
+    dt = time.perf_counter() - t0
+    cam.release()
+    print(f"  {n} frames of 640x480 GRAY8 in {dt:.2f} s ({n / dt:.0f} fps incl. videotestsrc)")
+
+    print(f"{'✓' if ok else '✗'} appsink source self-test")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Zero-copy GStreamer appsink source')
+    parser.add_argument('--selftest', action='store_true', help='Run against videotestsrc pipelines')
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+    parser.print_help()
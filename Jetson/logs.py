@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Logging for the hot loops: producers only enqueue, one thread writes.
+
+The camera loops printed a status line every PRINT_EVERY frames and the
+audio callback printed on every xrun and exception; a slow tty or journald
+pipe then blocked the frame loop or the callback itself. Here every logger
+under "vyz." feeds one QueueHandler, and a QueueListener thread does the
+formatting and the writing:
+
+- the producer side is a level check, the repeat filter and a put on a
+  SimpleQueue: no formatting, no locks held across I/O, no terminal I/O, so
+  it's safe from the audio callback (pass immutable args; the message is
+  formatted later on the listener thread)
+- a warning or error repeated faster than REPEAT_WINDOW_S (same logger,
+  level and format string) goes out once per window with "(+N similar)"
+  appended, so an overflow storm is one line every few seconds; info lines
+  (the periodic camera status) are left alone
+- levels per component: VYZ_LOG_LEVEL=INFO, VYZ_LOG_LEVELS=audio=WARNING,camera=DEBUG
+- VYZ_LOG_FORMAT=json writes one JSON object per line (ts, level, component,
+  msg, repeated and any `extra={"fields": {...}}`) for journald/log shippers;
+  the default text format is the message alone, as print() showed it.
+  VYZ_LOG_FILE also appends JSON lines to a file.
+
+    log = logs.get("audio")
+    log.warning("Status: %s", status)
+
+Producer cost compared with print() to a pipe:
+    python logs.py --bench
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT = "vyz"
+REPEAT_WINDOW_S = 5.0
+
+LOG_LEVEL  = os.getenv("VYZ_LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("VYZ_LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("VYZ_LOG_FORMAT", "text")
+LOG_FILE   = os.getenv("VYZ_LOG_FILE")
+
+
+class RepeatFilter(logging.Filter):
+    """Let a message at `level` or above through once per `window` s; the
+    next one that passes carries how many were dropped (record.repeated)"""
+
+    def __init__(self, window=REPEAT_WINDOW_S, level=logging.WARNING):
+        super().__init__()
+        self.window = window
+        self.level = level
+        self._seen = {}     # (logger, level, format string) -> [last passed, dropped]
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        seen = self._seen.get(key)
+        if seen is None:
+            self._seen[key] = [now, 0]
+            record.repeated = 0
+            return True
+        if now - seen[0] < self.window:
+            seen[1] += 1
+            return False
+        record.repeated = seen[1]
+        seen[0], seen[1] = now, 0
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the listener thread
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        msg = super().format(record)
+        n = getattr(record, "repeated", 0)
+        return f"{msg} (+{n} similar)" if n else msg
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "component": record.name[len(ROOT) + 1:] or ROOT,
+            "msg": record.getMessage(),
+        }
+        n = getattr(record, "repeated", 0)
+        if n:
+            out["repeated"] = n
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str, ensure_ascii=False)
+
+
+def parse_levels(spec):
+    """"audio=WARNING,camera=DEBUG" -> {"audio": 30, "camera": 10}"""
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def setup(level=LOG_LEVEL, levels=LOG_LEVELS, fmt=LOG_FORMAT, path=LOG_FILE,
+          stream=None, window=REPEAT_WINDOW_S):
+    """Start the listener (once per process); get() calls this with the
+    environment's settings if nobody did"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+        console = logging.StreamHandler(stream or sys.stdout)
+        console.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter("%(message)s"))
+        handlers = [console]
+        if path:
+            f = logging.FileHandler(path, encoding="utf-8")
+            f.setFormatter(JsonFormatter())
+            handlers.append(f)
+
+        # The logging docs' "Optimization" switches: no caller lookup
+        # (sys._getframe) or process info on every record
+        logging._srcfile = None
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        q = queue.SimpleQueue()
+        qh = _QueueHandler(q)
+        qh.addFilter(RepeatFilter(window))
+        root = logging.getLogger(ROOT)
+        root.handlers[:] = [qh]
+        root.propagate = False
+        root.setLevel(level)
+        for name, lvl in (parse_levels(levels) if isinstance(levels, str) else levels).items():
+            logging.getLogger(f"{ROOT}.{name}").setLevel(lvl)
+
+        _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+        return _listener
+
+
+def shutdown():
+    """Write out what's queued and stop the listener"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get(component):
+    """Logger for a component ("audio", "camera.glare", ...)"""
+    if _listener is None:
+        setup()
+    return logging.getLogger(f"{ROOT}.{component}")
+
+
+def _pipe(slow_s=0.0):
+    """Write end of a pipe drained by a thread (4 kB every `slow_s` s if set)"""
+    r, w = os.pipe()
+
+    def drain():
+        while os.read(r, 4096 if slow_s else 65536):
+            time.sleep(slow_s)
+
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(w, "w", buffering=1)
+
+
+def bench(runs=5000):
+    """Producer-side cost of print() vs the queued logger, with a fast and
+    with a stalling reader (a busy journald, an SSH tty over bad Wi-Fi)"""
+    import io
+
+    line = "Bright=%.3f (%.1f)  Peak=%.3f@(1, 2)  Flicker=%.2f/%.2f  State=up  Threshold=%.3f  exp=10000us gain=1.50"
+    args = (0.512, 130.6, 0.71, 0.05, 0.12, 0.5)
+    for reader, slow_s in (("fast reader", 0.0), ("stalling reader", 0.01)):
+        pipe = _pipe(slow_s)
+        setup(stream=pipe)
+        log = get("bench")
+        for name, fn in (("print()", lambda: print(line % args, file=pipe)),
+                         ("log.info", lambda: log.info(line, *args)),
+                         ("log.warning repeat", lambda: log.warning("Status: %s", "input overflow"))):
+            worst, t_all = 0.0, time.perf_counter()
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                fn()
+                worst = max(worst, time.perf_counter() - t0)
+            mean = (time.perf_counter() - t_all) / runs
+            print(f"  {reader:<16} {name:<20} mean {mean * 1e6:8.2f} us   worst {worst * 1e3:7.3f} ms")
+        shutdown()
+        pipe.close()
+
+    # JSON record shape
+    buf = io.StringIO()
+    setup(fmt="json", stream=buf, window=60)
+    get("audio").warning("Status: %s", "input overflow", extra={"fields": {"chunk": 12}})
+    for _ in range(3):
+        get("audio").warning("Status: %s", "input overflow")
+    shutdown()
+    print(f"  json: {buf.getvalue().strip()}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Queued structured logging')
+    parser.add_argument('--bench', action='store_true', help='Producer-side cost vs print()')
+    args = parser.parse_args()
+    if args.bench:
+        bench()
+    else:
+        parser.print_help()
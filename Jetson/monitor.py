@@ -0,0 +1,120 @@
+"""
+Asyncio plumbing for the camera monitors.
+
+The camera loops used to be one `while True` that polled every interval and
+did HTTP, GPIO and file writes inline, so each frame waited on the slowest of
+them. With a Monitor:
+
+    frames(capture)  capture runs on its own thread (the next frame is grabbed
+                     while the current one is analysed on the event loop)
+    every(...)       periodic work (settings reload, store flush, metrics)
+                     on timers with their own deadlines
+    fire(...)        blocking side effects (/recommend, exposure re-locks) on
+                     an I/O pool with a timeout; never awaited by the frame
+                     loop. One call per name in flight, and while one is busy
+                     only the newest request is kept (features that changed
+                     twice during a slow /recommend only need the latest
+                     vector sent). Visor moves have their own thread
+                     (actuator.py).
+
+Everything that touches analysis state (glare controller, zone map) runs on
+the event loop thread, so none of it needs locks.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+
+
+class Monitor:
+    def __init__(self, name="monitor", workers=4, lag=None):
+        self.name = name
+        self._capture_pool = ThreadPoolExecutor(1, thread_name_prefix=f"{name}-capture")
+        self._io_pool = ThreadPoolExecutor(workers, thread_name_prefix=f"{name}-io")
+        self._timers = []
+        self._effects = {}      # name -> [running task, newest pending call]
+        self._lag = lag         # optional Histogram of timer lateness (s)
+        self.log = logs.get(name)
+
+    # ---- periodic work ----
+    def every(self, interval, fn, name=None, blocking=False, timeout=None):
+        """Call fn(now) every `interval` s, first call at start-up. Blocking
+        functions run on the I/O pool and are abandoned after `timeout`."""
+        self._timers.append((interval, fn, name or fn.__name__, blocking, timeout))
+
+    async def _timer(self, interval, fn, name, blocking, timeout):
+        loop = asyncio.get_running_loop()
+        due = loop.time()
+        while True:
+            late = loop.time() - due
+            if self._lag is not None:
+                self._lag.observe(max(0.0, late))
+            try:
+                if blocking:
+                    await asyncio.wait_for(loop.run_in_executor(self._io_pool, fn, time.time()), timeout)
+                else:
+                    fn(time.time())
+            except asyncio.TimeoutError:
+                self.log.warning("✗ %s took longer than %ss", name, timeout)
+            except Exception as e:
+                self.log.error("✗ %s failed: %s", name, e)
+            # Skip ticks we're too late for instead of bursting to catch up
+            due = max(due + interval, loop.time())
+            await asyncio.sleep(due - loop.time())
+
+    # ---- side effects ----
+    def fire(self, name, fn, *args, timeout=2.0):
+        """Run fn(*args) on the I/O pool without waiting for it"""
+        slot = self._effects.setdefault(name, [None, None])
+        if slot[0] is not None and not slot[0].done():
+            slot[1] = (fn, args, timeout)
+            return
+        slot[0] = asyncio.ensure_future(self._effect(name, slot, fn, args, timeout))
+
+    async def _effect(self, name, slot, fn, args, timeout):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(loop.run_in_executor(self._io_pool, fn, *args), timeout)
+            except asyncio.TimeoutError:
+                self.log.warning("✗ %s timed out after %ss", name, timeout)
+            except Exception as e:
+                self.log.error("✗ %s failed: %s", name, e)
+            if slot[1] is None:
+                return
+            (fn, args, timeout), slot[1] = slot[1], None
+
+    # ---- frames ----
+    async def frames(self, capture):
+        """Yield capture() results; the next capture is already running while
+        the caller handles this one"""
+        loop = asyncio.get_running_loop()
+        pending = loop.run_in_executor(self._capture_pool, capture)
+        while True:
+            item = await pending
+            pending = loop.run_in_executor(self._capture_pool, capture)
+            yield item
+            # A capture that finished during analysis doesn't suspend on
+            # await, so give timers and side effects a turn every frame
+            await asyncio.sleep(0)
+
+    def run(self, frame_loop):
+        """Run timers alongside `frame_loop` (a coroutine) until it ends or Ctrl-C"""
+        async def _main():
+            timers = [asyncio.ensure_future(self._timer(*t)) for t in self._timers]
+            try:
+                await frame_loop
+            finally:
+                for t in timers:
+                    t.cancel()
+                effects = [s[0] for s in self._effects.values() if s[0] is not None]
+                if effects:
+                    # Let in-flight side effects (a visor move) finish
+                    await asyncio.wait(effects, timeout=2.0)
+
+        try:
+            asyncio.run(_main())
+        finally:
+            self._capture_pool.shutdown(wait=False)
+            self._io_pool.shutdown(wait=False)
@@ -1,39 +1,69 @@
 #!/usr/bin/env python3
 """
 Tiny Flask server to keep parity with original architecture.
-Reads the latest BRIGHTNESS from store.env and returns a simple recommendation.
+Reads the latest BRIGHTNESS (plus brightest-zone luma and zone flicker) from
+store.env, or the windowed features the camera posts (see features.py), and
+returns a simple recommendation.
 """
-from flask import Flask, jsonify, request
-from dotenv import load_dotenv
-import os
+from startup import timeline
+from flask import Flask, Response, jsonify, request
+from envstore import open_env
+from timeseries import open_series, history_json
+from features import features_from_request, loudness_from_store
+import time
+import metrics
 
 SETTINGS_ENV = "settings.env"
 STORE_ENV    = "store.env"
 
+# A bright spot this far over the threshold counts as glare even when the
+# weighted average is below it
+PEAK_MARGIN  = 0.25
+FLICKER_T    = 0.35
+# With windowed features: glare when over the threshold this much of the window
+ABOVE_T      = 0.5
+
 app = Flask(__name__)
 
+server_metrics = metrics.Registry("server")
+M_RECOMMEND = server_metrics.histogram("vyz_recommend_seconds", "/recommend handling time",
+                                       labels={"engine": "rules"})
+server_metrics.open()
+
 def load_threshold():
-    load_dotenv(SETTINGS_ENV, override=True)
-    try:
-        return float(os.getenv("BRIGHTNESS_THRESHOLD", "0.5"))
-    except Exception:
-        return 0.5
+    settings = open_env(SETTINGS_ENV)
+    settings.refresh()
+    return settings.get_float("BRIGHTNESS_THRESHOLD", 0.5)
 
 def read_brightness():
-    load_dotenv(STORE_ENV, override=True)
-    try:
-        return float(os.getenv("BRIGHTNESS", "0.0"))
-    except Exception:
-        return 0.0
+    """(brightness, brightest zone, zone flicker) from store.env"""
+    store = open_env(STORE_ENV)
+    store.refresh()
+    bright = store.get_float("BRIGHTNESS", 0.0)
+    return bright, store.get_float("BRIGHTNESS_PEAK", bright), store.get_float("FLICKER_PEAK", 0.0)
 
 @app.route("/recommend", methods=["POST"])
 def recommend():
+    t0 = time.perf_counter()
     thr = load_threshold()
-    bright = read_brightness()
+    bright, peak, flicker = read_brightness()
+    try:
+        sent = features_from_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    features = dict(loudness_from_store(open_env(STORE_ENV)))
+    features.update(sent)
+    if "above_threshold" in features:
+        glare = (features["above_threshold"] > ABOVE_T or peak > thr + PEAK_MARGIN
+                 or features.get("flicker", 0.0) > FLICKER_T)
+    else:
+        glare = bright > thr or peak > thr + PEAK_MARGIN or flicker > FLICKER_T
 
-    light = "visor_down" if bright > thr else "visor_up"
+    light = "visor_down" if glare else "visor_up"
     # You can expand with audio logic here
-    audio = "white_noise" if bright > thr else "none"
+    audio = "white_noise" if glare else "none"
+    open_series().event("recommend", f"{audio} / {light}")
+    M_RECOMMEND.observe(time.perf_counter() - t0)
 
     return jsonify({
         "success": True,
@@ -41,13 +71,32 @@ def recommend():
             "light": light,
             "audio": audio,
             "brightness": bright,
-            "threshold": thr
+            "brightness_peak": peak,
+            "flicker": flicker,
+            "threshold": thr,
+            "features": features
         }
     })
 
+@app.route("/history", methods=["GET"])
+def history():
+    """Downsampled sensor history, e.g. ?series=brightness&minutes=60&points=200"""
+    try:
+        body = history_json(open_series(), request.args.get("series", "brightness"),
+                            float(request.args.get("minutes", 60)), int(request.args.get("points", 200)))
+        return jsonify({"success": True, **body})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text format for camera, audio and server metrics"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"ok": True})
 
 if __name__ == "__main__":
+    timeline.ready("serving")
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -1,11 +1,77 @@
+from startup import timeline
 import numpy as np
-from scipy import signal
-import sounddevice as sd
 import sys
+import os
 import threading, time
-from server import app, settings
+from metrics import Registry
+from sensor_trace import TraceWriter
+from timeseries import open_series
+from envstore import open_env
+from features import LoudnessFeatures
+import logs
+from dsp import (LookaheadLimiter, HarshSuppressor, MultibandCompressor, PlanCache,
+                 LIMITER_LOOKAHEAD_MS, LIMITER_RELEASE_MS, MB_CROSSOVERS_HZ, MB_RATIOS, NOISE_TABLE_S)
+# scipy.signal, sounddevice and the Flask app are imported where first used,
+# so --devices doesn't pay for scipy/Flask and the stream opens sooner
+
+# ---- Metrics (served on /metrics) ----
+metrics = Registry("audio")
+M_CALLBACK = metrics.histogram("vyz_audio_callback_seconds", "Audio callback processing time")
+M_LOAD     = metrics.histogram("vyz_audio_callback_load_ratio", "Callback time / callback deadline",
+                               buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.5, 2.0))
+M_DEADLINE = metrics.gauge("vyz_audio_deadline_seconds", "Callback deadline (blocksize / sample rate)")
+M_MISSES   = metrics.counter("vyz_audio_deadline_misses_total", "Callbacks that took longer than their deadline")
+M_ERRORS   = metrics.counter("vyz_audio_callback_errors_total", "Exceptions raised while processing a chunk")
+M_LIMIT    = metrics.gauge("vyz_audio_limiter_reduction_db", "Peak limiter gain reduction in the last chunk")
+M_BANDS    = metrics.gauge("vyz_audio_multiband_reduction_db", "Largest per-band compressor gain reduction in the last chunk")
+M_HARSH    = metrics.gauge("vyz_audio_harsh_cut_db", "Largest harsh-sound suppressor cut in the last chunk")
+M_STREAM   = metrics.gauge("vyz_audio_stream_up", "1 while the audio stream is open")
+M_RECOVER  = metrics.histogram("vyz_audio_recover_seconds", "Time from losing the audio stream to audio flowing again",
+                               buckets=(0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+XRUN_FLAGS = ("input_underflow", "input_overflow", "output_underflow", "output_overflow")
+M_XRUNS    = {flag: metrics.counter("vyz_audio_xruns_total", "PortAudio under/overflows",
+                                    labels={"kind": flag}) for flag in XRUN_FLAGS}
+
+# The callback only ever enqueues log records (see logs.py); xrun storms are rate-limited
+log = logs.get("audio")
+
+# Record per-chunk input levels next to the camera trace (see sensor_trace.py)
+TRACE_ENABLED = True
+
+# Keep input loudness history for the app (see timeseries.py)
+HISTORY_ENABLED = True
+
+# Publish windowed loudness (EMA, 90th percentile, time above
+# AMPLITUDE_THRESHOLD) to store.env for /recommend (see features.py)
+FEATURES_ENABLED = True
+STORE_ENV = "store.env"
+
+# The DSP chain runs channel-major: (channels, frames), one contiguous row per
+# channel, so filtering, stereo-linked gain and the noise bed are one NumPy
+# call per stage whatever the channel count. The callback's (frames, channels)
+# buffers go in and out through a transposed view.
+
+# Filter coefficients, crossovers, STFT windows and the noise table for each
+# (sample rate, chunk, settings) seen, so a settings change or a device reopen
+# doesn't redesign anything (set VYZ_DSP_PLAN_DIR to keep them across runs)
+PLANS = PlanCache()
+
+# Settings the app writes (see Flask.py / server.py), checked every few seconds
+SETTINGS_ENV = "settings.env"
+SETTINGS_RELOAD_INTERVAL = 2.0
+SETTINGS_KEYS = {
+    "TARGET_PEAK": "target_peak",
+    "WHITE_NOISE_LEVEL": "white_noise_level",
+    "HIGHCUT": "highcut",
+    "LOWCUT": "lowcut",
+    "RATIO": "ratio",
+    "THRESHOLD_DB": "threshold_db",
+    "AMPLITUDE_THRESHOLD": "amplitude_threshold",
+}
+DEFAULT_RATIO = 4       # band_ratios are scaled by ratio / DEFAULT_RATIO
 
 def run_web_server():
+    from server import app
     app.run(host="0.0.0.0", port=5000, debug=False)
 
 class LiveMicCompressor:
@@ -15,6 +81,7 @@ class LiveMicCompressor:
         self.SAMPLE_RATE = 22050  # Sample rate in Hz (lower for Pi performance)
         # For Raspberry Pi: Use 22050 or 32000 if CPU struggles
         # For Laptop: Can use 44100 for better quality
+        self.CHANNELS = 2       # Capped to what the devices offer; mono mics feed both ears
         
         # ========== ADJUSTABLE SETTINGS ==========
         
@@ -22,14 +89,24 @@ class LiveMicCompressor:
         self.threshold_db = -20  # Start compressing above this (-30 to -10)
         self.ratio = 4           # How much to compress (1 = off, 4 = moderate, 10 = heavy)
         self.makeup_gain_db = 0  # Boost overall volume after compression (-10 to +10)
+        self.stereo_link = True  # Same gain on every channel (keeps the stereo image steady)
+        self.multiband = True    # Compress bass / voice / treble separately (a drum won't duck speech)
+        self.crossovers = MB_CROSSOVERS_HZ  # Band edges in Hz (2 = 3 bands, 3 = 4 bands)
+        self.band_ratios = MB_RATIOS        # Ratio per band, low to high
         
         # VOLUME LIMITING - Maximum output level
         self.target_peak = 0.7   # Max volume (0.5 = quiet, 0.9 = loud)
+        self.limiter_lookahead_ms = LIMITER_LOOKAHEAD_MS  # Added latency; catches peaks before they happen
+        self.limiter_release_ms = LIMITER_RELEASE_MS      # How fast volume comes back after a peak
         
         # FREQUENCY FILTERING - What frequencies to allow through
         self.lowcut = 200        # Remove bass below this Hz (100-500)
         self.highcut = 6000      # Remove treble above this Hz (4000-10000)
         
+        # HARSH SOUNDS - Turn down sudden whistles, sirens and feedback (2-5 kHz)
+        self.harsh_suppress = True
+        self.spectral_gate = False  # Also hush quiet background hiss between sounds
+        
         # WHITE NOISE - Background soothing sound
         self.white_noise_level = 0.08  # Volume of white noise (0.0 to 0.2)
         
@@ -38,175 +115,434 @@ class LiveMicCompressor:
         # Internal state
         self.filter_b = None
         self.filter_a = None
-        self.zi = None
-        
-    def setup_filter(self):
-        """Pre-calculate filter coefficients"""
-        nyquist = self.SAMPLE_RATE / 2
-        low = self.lowcut / nyquist
-        high = self.highcut / nyquist
+        self.zi = None           # (channels, filter order)
+        self._lfilter = None
+        self._rng = np.random.default_rng()
+        self._noise = None
+        self.plan = None
+        self._pending_plan = None
+        self._settings_mtime = None
+        self.limiter = None
+        self.suppressor = None
+        self.band_compressor = None
+        self.trace = None
+        self.history = None
+        self.loudness = None
+        self.amplitude_threshold = 0.5   # "loud" for the recommender's features
+        self.chunk_idx = 0
+        self._live = False
         
-        self.filter_b, self.filter_a = signal.butter(4, [low, high], btype='band')
-        self.zi = signal.lfilter_zi(self.filter_b, self.filter_a) * 0
+    def get_plan(self):
+        """DSP plan for the current sample rate, chunk size and filter settings"""
+        return PLANS.get(self.SAMPLE_RATE, self.CHUNK, lowcut=self.lowcut, highcut=self.highcut,
+                         crossovers=self.crossovers)
+    
+    def setup_filter(self, channels=None):
+        """Load the DSP plan and set up per-channel filter state"""
+        self.apply_plan(self.get_plan(), channels)
+    
+    def apply_plan(self, plan, channels=None):
+        """Switch to `plan`. Stages whose coefficients didn't change keep their
+        state, and so does the bandpass, if the sample rate and channel count
+        are the same."""
+        from scipy.signal import lfilter
+
+        old = self.plan
+        C = channels or (self.zi.shape[0] if self.zi is not None else self.CHANNELS)
+        same_rate = (old is not None and old.sample_rate == plan.sample_rate
+                     and self.zi is not None and self.zi.shape[0] == C)
+        b, a = plan.bandpass
+        self.filter_b, self.filter_a = b, a
+        if not (same_rate and self.zi.shape == (C, len(a) - 1)):
+            self.zi = np.zeros((C, len(a) - 1))
+        self._lfilter = lfilter
+        self._noise = plan.noise
+        rate = plan.sample_rate
+        if self.suppressor is None or not same_rate:
+            self.suppressor = HarshSuppressor(rate, C, gate=self.spectral_gate, windows=plan.stft_windows)
+        if (self.band_compressor is None or not same_rate
+                or self.band_compressor.crossovers != plan.settings["crossovers"]):
+            self.band_compressor = MultibandCompressor(rate, C, plan.settings["crossovers"],
+                                                       self.band_ratios, sos=plan.crossover_sos)
+        if self.limiter is None or not same_rate:
+            self.limiter = LookaheadLimiter(rate, self.target_peak, self.limiter_lookahead_ms,
+                                            self.limiter_release_ms, C)
+        self.plan = plan
+    
+    def reload_settings(self, path=SETTINGS_ENV):
+        """Pick up settings the app changed. A new filter plan is looked up
+        here and swapped in by the audio callback at the next chunk."""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        if mtime == self._settings_mtime:
+            return False
+        self._settings_mtime = mtime
+        from dotenv import dotenv_values
+
+        changed = []
+        for key, value in dotenv_values(path).items():
+            attr = SETTINGS_KEYS.get(key)
+            if attr is None or value is None:
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                print(f"✗ Ignoring {key}={value!r} in {path}")
+                continue
+            if getattr(self, attr) != value:
+                setattr(self, attr, value)
+                changed.append(f"{attr}={value:g}")
+        if changed and self.plan is not None:
+            plan = self.get_plan()
+            if plan is not self.plan:
+                self._pending_plan = plan
+        if changed and self.loudness is not None:
+            self.loudness.set_threshold(self.amplitude_threshold)
+        if changed:
+            print(f"✓ Settings reloaded: {', '.join(changed)}")
+        return bool(changed)
+
+    def publish_features(self):
+        """Loudness features to store.env, where the camera's trigger and
+        /recommend read them"""
+        if self.loudness is None:
+            return
+        values = self.loudness.store_values()
+        if values:
+            open_env(STORE_ENV).update(values)
+
+    def idle(self):
+        self.reload_settings()
+        self.publish_features()
         
     def bandpass_filter_chunk(self, data):
-        """Apply bandpass filter to a chunk"""
-        filtered, self.zi = signal.lfilter(self.filter_b, self.filter_a, data, zi=self.zi)
+        """Apply bandpass filter to a (channels, frames) chunk, all channels at once"""
+        if self.zi.shape[0] != data.shape[0]:
+            self.zi = np.zeros((data.shape[0], self.zi.shape[1]))
+        filtered, self.zi = self._lfilter(self.filter_b, self.filter_a, data, axis=-1, zi=self.zi)
         return filtered
     
+    def suppress_harsh_chunk(self, data):
+        """Turn down piercing tones in the 2-5 kHz band (STFT, see dsp.py)"""
+        self.suppressor.gate = self.spectral_gate
+        suppressed = self.suppressor.process(data)
+        M_HARSH.set(self.suppressor.cut_db)
+        return suppressed
+    
     def compress_chunk(self, data):
-        """Apply dynamic range compression to a chunk"""
+        """Apply dynamic range compression to a (channels, frames) chunk.
+        Above threshold the level is cut to threshold * (level/threshold)^(1/ratio);
+        with stereo_link the loudest channel sets the gain for all of them."""
+        if self.multiband:
+            return self.compress_bands_chunk(data)
         threshold = 10 ** (self.threshold_db / 20)
-        compressed = np.copy(data)
-        
-        for i in range(len(data)):
-            amplitude = np.abs(data[i])
-            
-            if amplitude > threshold:
-                over_db = 20 * np.log10(amplitude / threshold)
-                compressed_over_db = over_db / self.ratio
-                compressed_amplitude = threshold * (10 ** (compressed_over_db / 20))
-                compressed[i] = np.sign(data[i]) * compressed_amplitude
+        amplitude = np.abs(data)
+        if self.stereo_link and len(data) > 1:
+            amplitude = np.maximum.reduce(amplitude, axis=0)
+        gain = np.maximum(amplitude, threshold, out=amplitude)
+        gain *= 1.0 / threshold
+        np.power(gain, 1.0 / self.ratio - 1.0, out=gain)
         
         if self.makeup_gain_db != 0:
-            makeup_gain = 10 ** (self.makeup_gain_db / 20)
-            compressed *= makeup_gain
+            gain *= 10 ** (self.makeup_gain_db / 20)
             
-        return compressed
-    
-    def normalize_chunk(self, data):
-        """Soft normalization to prevent clipping"""
-        current_peak = np.abs(data).max()
-        if current_peak > self.target_peak:
-            data = data * (self.target_peak / current_peak)
+        data *= gain
         return data
     
+    def limit_chunk(self, data):
+        """Keep the output under target_peak (lookahead limiter, one gain for all channels)"""
+        self.limiter.ceiling = self.target_peak
+        limited = self.limiter.process(data)
+        M_LIMIT.set(self.limiter.reduction_db)
+        return limited
+    
+    def compress_bands_chunk(self, data):
+        """Multiband version of compress_chunk: band_ratios per crossover band"""
+        mb = self.band_compressor
+        mb.threshold_db = self.threshold_db
+        mb.makeup_db = self.makeup_gain_db
+        mb.ratios = np.maximum(1.0, np.asarray(self.band_ratios, dtype=float) * (self.ratio / DEFAULT_RATIO))
+        if mb.link != self.stereo_link:
+            mb.link = self.stereo_link
+            mb.reset(len(data))
+        compressed = mb.process(data)
+        M_BANDS.set(float(mb.reduction_db.max()))
+        return compressed
+    
     def add_white_noise_chunk(self, data):
-        """Add white noise to chunk"""
-        white_noise = np.random.normal(0, self.white_noise_level, len(data))
-        mixed = data + white_noise
-        
-        # Prevent clipping
-        max_val = np.abs(mixed).max()
-        if max_val > 1.0:
-            mixed = mixed / max_val
-            
-        return mixed
+        """Add white noise to chunk (a different slice of the table per channel)"""
+        channels, frames = data.shape
+        if self._noise is None or len(self._noise) < 2 * frames:
+            self._noise = self._rng.standard_normal(max(int(NOISE_TABLE_S * self.SAMPLE_RATE), 2 * frames))
+        starts = self._rng.integers(0, len(self._noise) - frames, channels)
+        white_noise = self._noise[starts[:, None] + np.arange(frames)]
+        white_noise *= self.white_noise_level
+        data += white_noise
+        return data
     
     def process_chunk(self, chunk):
-        """Process a single chunk through the pipeline"""
-        # Convert to 1D if needed
-        if len(chunk.shape) > 1:
-            chunk = chunk[:, 0]  # Take first channel if stereo
+        """Process a (frames,) or (frames, channels) chunk through the pipeline;
+        returns the same shape"""
+        mono = chunk.ndim == 1
+        if mono:
+            chunk = chunk[:, None]
         
-        # 1. Frequency filter
-        filtered = self.bandpass_filter_chunk(chunk)
+        # 1. Frequency filter (returns a new channel-major array)
+        filtered = self.bandpass_filter_chunk(chunk.T)
         
-        # 2. Compress
-        compressed = self.compress_chunk(filtered)
+        # 2. Harsh-sound suppression
+        if self.harsh_suppress:
+            filtered = self.suppress_harsh_chunk(filtered)
         
-        # 3. Normalize
-        normalized = self.normalize_chunk(compressed)
+        # 3. Compress
+        compressed = self.compress_chunk(filtered)
         
         # 4. Add white noise
-        final = self.add_white_noise_chunk(normalized)
+        mixed = self.add_white_noise_chunk(compressed)
         
-        return final
+        # 5. Limit (the noise bed counts towards the max volume too)
+        final = self.limit_chunk(mixed)
+        
+        return final[0] if mono else final.T
     
     def audio_callback(self, indata, outdata, frames, time_info, status):
         """Callback function for sounddevice duplex stream"""
+        t0 = time.perf_counter()
         if status:
-            print(f"Status: {status}")
+            for flag in XRUN_FLAGS:
+                if getattr(status, flag):
+                    M_XRUNS[flag].inc()
+            log.warning("Status: %s", status)
         
         try:
-            # Process incoming audio
-            processed = self.process_chunk(indata[:, 0])
+            plan = self._pending_plan
+            if plan is not None:
+                self._pending_plan = None
+                self.apply_plan(plan)
+            if self.trace or self.history or self.loudness:
+                now, rms = time.time(), float(np.sqrt(np.mean(indata * indata)))
+                if self.trace:
+                    self.trace.audio(self.chunk_idx, now, rms, float(np.abs(indata).max()))
+                if self.history:
+                    self.history.record("amplitude", rms, now)
+                if self.loudness:
+                    self.loudness.add(now, rms)
+            self.chunk_idx += 1
+
+            # Process incoming audio (all channels in one pass)
+            processed = self.process_chunk(indata)
             
-            # Output processed audio
-            outdata[:, 0] = processed
+            # Output processed audio; a mono mic feeds every output channel
+            route_channels(processed, outdata)
             
         except Exception as e:
-            print(f"Error in callback: {e}")
+            M_ERRORS.inc()
+            log.error("Error in callback: %s", e)
             outdata.fill(0)
+
+        elapsed = time.perf_counter() - t0
+        deadline = frames / self.SAMPLE_RATE
+        M_CALLBACK.observe(elapsed)
+        M_LOAD.observe(elapsed / deadline)
+        if elapsed > deadline:
+            M_MISSES.inc()
     
-    def start_live_processing(self, input_device=None, output_device=None):
-        """Start live microphone processing"""
-        
-        # Set devices if specified
-        if input_device is not None or output_device is not None:
-            sd.default.device = (input_device, output_device)
-        
-        # Get the actual devices we'll use
-        input_dev_info = sd.query_devices(sd.default.device[0])
-        output_dev_info = sd.query_devices(sd.default.device[1])
-        
-        # Use the device's native sample rate
-        device_sample_rate = int(input_dev_info['default_samplerate'])
-        
-        # Update our sample rate to match the device
+    def prepare_stream(self, in_info, out_info):
+        """Match a (re)opened device pair: its native sample rate, channels
+        capped to what it has, and the cached plan for that rate"""
+        device_sample_rate = int(in_info['default_samplerate'])
         if device_sample_rate != self.SAMPLE_RATE:
             print(f"\n⚠ Adjusting sample rate from {self.SAMPLE_RATE} to {device_sample_rate} Hz (device native rate)")
             self.SAMPLE_RATE = device_sample_rate
+        in_channels = clamp_channels(self.CHANNELS, in_info['max_input_channels'])
+        out_channels = clamp_channels(self.CHANNELS, out_info['max_output_channels'])
+        # The stream is closed, so the plan can be applied here rather than in the callback
+        self._pending_plan = None
+        self.setup_filter(in_channels)
+        if not self._live:
+            timeline.mark("filter")
+        M_DEADLINE.set(self.CHUNK / self.SAMPLE_RATE)
+        return self.SAMPLE_RATE, (in_channels, out_channels)
+    
+    def stream_opened(self, in_info, out_info):
+        M_STREAM.set(1)
+        print(f"\nUsing devices:")
+        print(f"  Input: {in_info['name']}")
+        print(f"  Output: {out_info['name']}")
+        print(f"  {self.SAMPLE_RATE} Hz, {self.zi.shape[0]} channel(s) processed")
+        if not self._live:
+            self._live = True
+            print(f"DSP plan: {'loaded from ' + PLANS.directory if PLANS.loads else 'built'} "
+                  f"({len(self.plan.noise) / self.SAMPLE_RATE:.1f} s noise table)")
+            timeline.ready("stream_live")
+            print("✓ Processing active - speak into your microphone!")
+            print("  (You should hear yourself with processing applied)\n")
+    
+    def start_live_processing(self, input_device=None, output_device=None):
+        """Start live microphone processing; the stream is reopened on its
+        own if a device is unplugged or stops delivering audio"""
+        import sounddevice as sd
+        from audio_devices import AudioStreamManager
+        timeline.mark("import_sounddevice")
+        
+        # Settings saved from the app win over the defaults in __main__
+        self.reload_settings()
         
         print("\n" + "="*60)
         print("LIVE MICROPHONE COMPRESSOR")
         print("="*60)
-        print(f"Sample Rate: {self.SAMPLE_RATE} Hz")
+        print(f"Sample Rate: {self.SAMPLE_RATE} Hz (or the device's native rate)")
         print(f"Chunk Size: {self.CHUNK} samples")
-        print(f"Latency: ~{(self.CHUNK / self.SAMPLE_RATE) * 1000:.1f} ms")
+        print(f"Channels: up to {self.CHANNELS}")
+        print(f"Latency: ~{(self.CHUNK / self.SAMPLE_RATE) * 1000 + self.limiter_lookahead_ms:.1f} ms"
+              f"{' + harsh-sound suppressor' if self.harsh_suppress else ''}")
         
         print(f"\n" + "="*60)
         print("CURRENT SETTINGS:")
         print("="*60)
         print(f"  Compression:")
         print(f"    - Threshold: {self.threshold_db} dB")
-        print(f"    - Ratio: {self.ratio}:1")
+        if self.multiband:
+            print(f"    - Bands: split at {', '.join(f'{f:g}' for f in self.crossovers)} Hz, "
+                  f"ratios {', '.join(f'{r:g}:1' for r in self.band_ratios)}")
+        else:
+            print(f"    - Ratio: {self.ratio}:1")
         print(f"    - Makeup Gain: {self.makeup_gain_db} dB")
+        print(f"    - Stereo Link: {'on' if self.stereo_link else 'off'}")
         print(f"  Frequency Filter:")
         print(f"    - Low Cut: {self.lowcut} Hz")
         print(f"    - High Cut: {self.highcut} Hz")
+        print(f"  Harsh Sounds:")
+        print(f"    - Suppressor: {'on' if self.harsh_suppress else 'off'}")
+        print(f"    - Spectral Gate: {'on' if self.spectral_gate else 'off'}")
         print(f"  Output:")
-        print(f"    - Max Volume: {self.target_peak}")
+        print(f"    - Max Volume: {self.target_peak} "
+              f"(lookahead {self.limiter_lookahead_ms} ms, release {self.limiter_release_ms} ms)")
         print(f"    - White Noise: {self.white_noise_level * 100:.1f}%")
         print("="*60)
         
-        # Setup filter with correct sample rate
-        self.setup_filter()
-        
-        print(f"\nUsing devices:")
-        print(f"  Input: {input_dev_info['name']}")
-        print(f"  Output: {output_dev_info['name']}")
+        metrics.open()
+        if TRACE_ENABLED and self.trace is None:
+            self.trace = TraceWriter("audio").start()
+        if HISTORY_ENABLED and self.history is None:
+            self.history = open_series()
+        if FEATURES_ENABLED and self.loudness is None:
+            self.loudness = LoudnessFeatures(self.amplitude_threshold)
         
         print("\n🎤 Starting LIVE audio processing...")
         print("Press Ctrl+C to stop\n")
         
+        streams = AudioStreamManager(sd, self.audio_callback, self.prepare_stream,
+                                     input_device=input_device, output_device=output_device,
+                                     blocksize=self.CHUNK, on_open=self.stream_opened,
+                                     on_lost=lambda reason: M_STREAM.set(0), on_recover=M_RECOVER.observe)
         try:
-            # Open duplex stream (input and output simultaneously)
-            with sd.Stream(
-                samplerate=self.SAMPLE_RATE,
-                channels=1,
-                callback=self.audio_callback,
-                blocksize=self.CHUNK,
-                dtype='float32'
-            ):
-                print("✓ Processing active - speak into your microphone!")
-                print("  (You should hear yourself with processing applied)\n")
-                
-                # Keep running until interrupted
-                while True:
-                    sd.sleep(1000)
+            # First open; the filter plan for the device's rate is set up in prepare_stream
+            streams.check()
+            if not streams.up:
+                print("\nTroubleshooting:")
+                print("  1. Run with --devices to see available devices")
+                print("  2. Make sure no other app is using your microphone")
+                print("  3. Check your system audio permissions")
+                print("Waiting for an audio device...")
+            
+            # Keep running until interrupted; reopen on unplug, pick up settings
+            # from the app, publish loudness features for it
+            streams.run(idle=self.idle, idle_s=SETTINGS_RELOAD_INTERVAL)
                     
         except KeyboardInterrupt:
             print("\n\n✓ Stopped by user")
         except Exception as e:
             print(f"\n\nError: {e}")
-            print("\nTroubleshooting:")
-            print("  1. Run with --devices to see available devices")
-            print("  2. Make sure no other app is using your microphone")
-            print("  3. Check your system audio permissions")
+        finally:
+            streams.close()
+            M_STREAM.set(0)
+            if self.trace:
+                self.trace.close()
+                self.trace = None
+
+def clamp_channels(requested, available):
+    """Channels to open on one side of the stream: what was asked for, capped to
+    what the device has, never below 1 (route_channels bridges any in/out pair)"""
+    return max(1, min(int(requested), int(available)))
+
+def route_channels(processed, outdata):
+    """Write (frames, n) processed audio to (frames, m) outdata: a mono source is
+    copied to every output, fewer inputs than outputs repeat the last input on
+    the extra outputs, extra inputs are mixed down into the last output"""
+    n, m = processed.shape[1], outdata.shape[1]
+    if n == m:
+        outdata[:] = processed
+    elif n == 1:
+        outdata[:] = processed
+    elif m == 1:
+        outdata[:, 0] = processed.mean(axis=1)
+    elif n < m:
+        outdata[:, :n] = processed
+        outdata[:, n:] = processed[:, n - 1:]
+    else:
+        outdata[:, :m - 1] = processed[:, :m - 1]
+        outdata[:, m - 1] = processed[:, m - 1:].mean(axis=1)
+
+# (input, output) device channels for the routing check in bench()
+ROUTE_LAYOUTS = ((1, 1), (1, 2), (2, 1), (2, 2), (2, 4), (3, 4), (4, 2), (8, 2))
+
+def bench(runs=200, sample_rate=22050, chunk=2048):
+    """Per-chunk cost of one vectorised pass over N channels vs N mono passes"""
+    rng = np.random.default_rng(0)
+    print(f"{chunk} frames @ {sample_rate} Hz, deadline {chunk / sample_rate * 1e3:.1f} ms")
+    for channels in (1, 2, 4, 8):
+        x = (0.3 * rng.standard_normal((chunk, channels))).astype(np.float32)
+        multi = LiveMicCompressor()
+        multi.SAMPLE_RATE = sample_rate
+        multi.setup_filter(channels)
+        mono = []
+        for _ in range(channels):
+            c = LiveMicCompressor()
+            c.SAMPLE_RATE = sample_rate
+            c.setup_filter(1)
+            mono.append(c)
+
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            multi.process_chunk(x)
+        t_multi = (time.perf_counter() - t0) / runs
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            for k, c in enumerate(mono):
+                c.process_chunk(x[:, k])
+        t_mono = (time.perf_counter() - t0) / runs
+        print(f"  {channels} ch: one pass {t_multi * 1e3:6.3f} ms   "
+              f"per channel {t_mono * 1e3:6.3f} ms   ({t_mono / t_multi:.1f}x)")
+
+    # Routing for --channels 4 on devices with fewer/more inputs than outputs
+    ok = True
+    for have_in, have_out in ROUTE_LAYOUTS:
+        n, m = clamp_channels(4, have_in), clamp_channels(4, have_out)
+        x = (0.3 * rng.standard_normal((chunk, n))).astype(np.float32)
+        out = np.zeros((chunk, m), dtype=np.float32)
+        t0 = time.perf_counter()
+        try:
+            for _ in range(runs):
+                route_channels(x, out)
+        except ValueError as e:
+            print(f"  ✗ route {have_in} in / {have_out} out: {e}")
+            ok = False
+            continue
+        t_route = (time.perf_counter() - t0) / runs
+        silent = [k for k in range(m) if not out[:, k].any()]
+        if silent:
+            ok = False
+        print(f"  {'✓' if not silent else '✗'} route {have_in} in / {have_out} out -> {n}:{m}   "
+              f"{t_route * 1e6:6.1f} µs" + (f"   silent outputs {silent}" if silent else ""))
+    return ok
 
 def list_audio_devices():
     """List available audio devices"""
+    import sounddevice as sd
+
     print("\n" + "="*60)
     print("AVAILABLE AUDIO DEVICES")
     print("="*60)
@@ -233,12 +569,12 @@ def list_audio_devices():
 if __name__ == "__main__":
     import argparse
 
-    threading.Thread(target=run_web_server, daemon=True).start()
-
     parser = argparse.ArgumentParser(description='Live Microphone Audio Compressor')
     parser.add_argument('--devices', action='store_true', help='List available audio devices')
     parser.add_argument('--input', type=int, help='Input device number (see --devices)', default=None)
     parser.add_argument('--output', type=int, help='Output device number (see --devices)', default=None)
+    parser.add_argument('--channels', type=int, help='Channels to process (default 2)', default=None)
+    parser.add_argument('--bench', action='store_true', help='Time the DSP chain per chunk for 1-8 channels and check channel routing')
     
     args = parser.parse_args()
     
@@ -246,20 +582,33 @@ if __name__ == "__main__":
     if args.devices:
         list_audio_devices()
         sys.exit(0)
-    
+    if args.bench:
+        sys.exit(0 if bench() else 1)
+
+    threading.Thread(target=run_web_server, daemon=True).start()
+    timeline.mark("args")
+
     # Create compressor
     compressor = LiveMicCompressor()
     
     # ========== ADJUST THESE SETTINGS ==========
     
+    # CHANNELS - 2 for stereo headphones / a second mic
+    if args.channels:
+        compressor.CHANNELS = args.channels
+    
     # COMPRESSION - Make loud sounds quieter
     compressor.threshold_db = -20       # Lower = compress more sounds
     compressor.ratio = 4                # Higher = more compression
     compressor.makeup_gain_db = 0       # Increase to boost overall volume
+    compressor.stereo_link = True       # False = compress each ear on its own
+    compressor.multiband = True         # False = one full-band compressor (uses ratio)
     
     # FREQUENCY FILTERING - Remove annoying frequencies
     compressor.lowcut = 200             # Higher = remove more bass
     compressor.highcut = 6000           # Lower = remove more treble
+    compressor.harsh_suppress = True    # Turn down whistles/sirens/feedback
+    compressor.spectral_gate = False    # True = also hush steady background hiss
     
     # OUTPUT LEVELS
     compressor.target_peak = 0.7        # Higher = louder output
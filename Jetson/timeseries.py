@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Session history: sensor series and events in SQLite, rolled up as they land.
+
+store.env only ever holds the latest values. SeriesStore keeps the history
+in one SQLite file (WAL, so the camera, audio and server processes can all
+use it at once):
+
+    samples     every value at full rate, kept RAW_KEEP_S
+    rollup_1s   per-series count/sum/min/max/sum of squares per second,
+    rollup_1m   ... per minute
+    rollup_1h   ... per hour (kept for good)
+    events      visor flips, recommendations, settings changes, ...
+
+record()/event() append to an in-memory deque and return, so they're safe
+from the frame loop and the audio callback. A writer thread inserts the
+batch once a second in one transaction and, in that same transaction,
+folds it into the three rollup tables with one INSERT ... SELECT ...
+GROUP BY ... ON CONFLICT DO UPDATE each. query() reads only rollups, the
+finest one that fits the range in `points` buckets, so a day of history is
+a few hundred rows whatever the sample rate was. The servers expose it as
+GET /history?series=brightness&minutes=60&points=200 (see history_json).
+
+Insert rate, rollup exactness and query latency on an hour of 30 Hz data:
+    python timeseries.py --bench
+"""
+import collections
+import math
+import os
+import sqlite3
+import threading
+import time
+
+SERIES_DB = os.getenv("VYZ_SERIES_DB", "series.db")
+FLUSH_S = 1.0               # writer period
+MAX_PENDING = 200_000       # samples held in memory if the DB stalls (oldest dropped)
+PRUNE_EVERY_S = 60.0
+
+# (table, bucket seconds, keep seconds or None)
+ROLLUPS = (("rollup_1s", 1, 24 * 3600),
+           ("rollup_1m", 60, 30 * 24 * 3600),
+           ("rollup_1h", 3600, None))
+RAW_KEEP_S = 3600
+QUERY_POINTS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (series TEXT NOT NULL, t REAL NOT NULL, v REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS samples_t ON samples (t);
+CREATE TABLE IF NOT EXISTS events (t REAL NOT NULL, kind TEXT NOT NULL, detail TEXT);
+CREATE INDEX IF NOT EXISTS events_t ON events (t);
+""" + "".join(f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    series TEXT NOT NULL, bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL, sum REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL, sumsq REAL NOT NULL,
+    PRIMARY KEY (series, bucket)) WITHOUT ROWID;
+""" for table, _, _ in ROLLUPS)
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class SeriesStore:
+    def __init__(self, path=SERIES_DB, flush_s=FLUSH_S, max_pending=MAX_PENDING):
+        self.path = path
+        self.flush_s = flush_s
+        self._samples = collections.deque(maxlen=max_pending)
+        self._events = collections.deque(maxlen=max_pending)
+        self._db = None             # writer thread's connection
+        self._read = None           # query connection (callers' threads, serialised)
+        self._read_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_prune = 0.0
+        self.inserted = 0
+        self._thread = threading.Thread(target=self._run, name="series", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # ---- producers (any thread, never block) ----
+    def record(self, series, value, t=None):
+        self._samples.append((series, time.time() if t is None else t, float(value)))
+
+    def record_many(self, values, t=None):
+        """{series: value} sharing one timestamp"""
+        t = time.time() if t is None else t
+        for series, value in values.items():
+            self._samples.append((series, t, float(value)))
+
+    def event(self, kind, detail=None, t=None):
+        self._events.append((time.time() if t is None else t, kind, detail))
+
+    # ---- writer ----
+    def _run(self):
+        try:
+            self._db = connect(self.path)
+        except sqlite3.Error as e:
+            print(f"✗ Session history disabled ({self.path}): {e}")
+            return
+        while not self._stop.wait(self.flush_s):
+            self.flush()
+        self.flush()
+        self._db.close()
+
+    def flush(self):
+        """Write what's queued (writer thread, or the caller's if never started)"""
+        if self._db is None:
+            self._db = connect(self.path)
+        samples = [self._samples.popleft() for _ in range(len(self._samples))]
+        events = [self._events.popleft() for _ in range(len(self._events))]
+        if not samples and not events:
+            return 0
+        db = self._db
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            first = db.execute("SELECT coalesce(max(rowid), 0) FROM samples").fetchone()[0]
+            db.executemany("INSERT INTO samples (series, t, v) VALUES (?, ?, ?)", samples)
+            for table, secs, _ in ROLLUPS:
+                db.execute(f"""
+                    INSERT INTO {table} (series, bucket, n, sum, min, max, sumsq)
+                    SELECT series, CAST(t / {secs} AS INTEGER) * {secs}, count(*), sum(v), min(v), max(v), sum(v * v)
+                    FROM samples WHERE rowid > ? GROUP BY 1, 2
+                    ON CONFLICT (series, bucket) DO UPDATE SET
+                        n = n + excluded.n, sum = sum + excluded.sum, sumsq = sumsq + excluded.sumsq,
+                        min = min(min, excluded.min), max = max(max, excluded.max)""", (first,))
+            db.executemany("INSERT INTO events (t, kind, detail) VALUES (?, ?, ?)", events)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            print(f"✗ Session history write failed: {e}")
+            return 0
+        self.inserted += len(samples)
+        now = time.time()
+        if now - self._last_prune >= PRUNE_EVERY_S:
+            self._last_prune = now
+            self.prune(now)
+        return len(samples)
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        db = self._db
+        db.execute("DELETE FROM samples WHERE t < ?", (now - RAW_KEEP_S,))
+        for table, _, keep in ROLLUPS:
+            if keep is not None:
+                db.execute(f"DELETE FROM {table} WHERE bucket < ?", (now - keep,))
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        elif self._db is not None:
+            self.flush()
+
+    # ---- queries ----
+    def _query(self, sql, args):
+        with self._read_lock:
+            if self._read is None:
+                self._read = connect(self.path)
+            return self._read.execute(sql, args).fetchall()
+
+    def query(self, series, start, end=None, points=QUERY_POINTS):
+        """[(t, mean, min, max, std, n)] for `series` over [start, end), at
+        most `points` buckets, from the finest rollup that fits"""
+        end = time.time() if end is None else end
+        span = max(end - start, 1.0)
+        table, secs = ROLLUPS[-1][:2]
+        for name, s, keep in ROLLUPS:
+            if span / s <= points and (keep is None or start >= time.time() - keep):
+                table, secs = name, s
+                break
+        # Merge neighbouring buckets if even that is too many
+        step = secs * max(1, math.ceil(span / secs / points))
+        rows = self._query(f"""
+            SELECT (bucket / {step}) * {step}, sum(n), sum(sum), min(min), max(max), sum(sumsq)
+            FROM {table} WHERE series = ? AND bucket >= ? AND bucket < ?
+            GROUP BY 1 ORDER BY 1""", (series, int(start // secs) * secs, end))
+        out = []
+        for t, n, s, lo, hi, sq in rows:
+            mean = s / n
+            out.append((t, mean, lo, hi, math.sqrt(max(0.0, sq / n - mean * mean)), n))
+        return out
+
+    def events(self, start, end=None, kind=None):
+        end = time.time() if end is None else end
+        if kind is None:
+            return self._query("SELECT t, kind, detail FROM events WHERE t >= ? AND t < ? ORDER BY t",
+                               (start, end))
+        return self._query("SELECT t, kind, detail FROM events WHERE kind = ? AND t >= ? AND t < ? ORDER BY t",
+                           (kind, start, end))
+
+    def series(self):
+        return [r[0] for r in self._query("SELECT DISTINCT series FROM rollup_1h", ())]
+
+
+def history_json(store, series, minutes=60.0, points=200):
+    """/history response body: a series' buckets plus the events in range"""
+    end = time.time()
+    start = end - minutes * 60
+    return {
+        "series": series,
+        "start": start,
+        "end": end,
+        "points": [{"t": t, "mean": mean, "min": lo, "max": hi, "std": std, "n": n}
+                   for t, mean, lo, hi, std, n in store.query(series, start, end, points)],
+        "events": [{"t": t, "kind": kind, "detail": detail} for t, kind, detail in store.events(start, end)],
+    }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def open_series(path=SERIES_DB):
+    """The process's SeriesStore, started on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            import atexit
+            _store = SeriesStore(path).start()
+            atexit.register(_store.close)
+        return _store
+
+
+def bench(hours=1.0, rate=30.0, series=("brightness", "peak", "flicker", "amplitude")):
+    import tempfile
+
+    import numpy as np
+
+    path = os.path.join(tempfile.mkdtemp(prefix="series-"), "bench.db")
+    store = SeriesStore(path)
+    rng = np.random.default_rng(0)
+    n = int(hours * 3600 * rate)
+    t0 = time.time() - hours * 3600
+    ts = t0 + np.arange(n) / rate
+    data = {s: rng.random(n) for s in series}
+
+    # Producer cost
+    t = time.perf_counter()
+    for i in range(n):
+        store.record("brightness", data["brightness"][i], ts[i])
+    per_call = (time.perf_counter() - t) / n
+    store._samples.clear()
+
+    # Writer: one-second batches, as the thread would see them
+    per_batch = int(rate) * len(series)
+    t = time.perf_counter()
+    for i in range(0, n, int(rate)):
+        for s in series:
+            for j in range(i, min(i + int(rate), n)):
+                store._samples.append((s, ts[j], data[s][j]))
+        store.flush()
+    write = time.perf_counter() - t
+    total = n * len(series)
+    print(f"{hours:g} h of {len(series)} series at {rate:g} Hz ({total} samples), {path}")
+    print(f"  record()             {per_call * 1e6:7.2f} us/sample")
+    print(f"  write + 3 rollups    {write / total * 1e6:7.2f} us/sample   "
+          f"{write / (n / rate) * 1e3:6.2f} ms per 1 s batch of {per_batch}")
+
+    # Rollups must match the raw data exactly (minute buckets)
+    rows = store.query("amplitude", t0, t0 + hours * 3600, points=int(hours * 60))
+    buckets = (ts // 60).astype(np.int64) * 60
+    ok = True
+    for bt, mean, lo, hi, std, cnt in rows:
+        sel = data["amplitude"][buckets == bt]
+        ok &= (cnt == len(sel) and abs(mean - sel.mean()) < 1e-9 and lo == sel.min() and hi == sel.max()
+               and abs(std - sel.std()) < 1e-6)
+    print(f"  {'✓' if ok else '✗'} 1-minute rollups match the raw samples ({len(rows)} buckets)")
+
+    for label, span, pts in (("last 5 min", 300, 300), ("last hour", 3600, 500), ("whole range", hours * 3600, 200)):
+        end = t0 + hours * 3600
+        t = time.perf_counter()
+        for _ in range(20):
+            rows = store.query("brightness", end - span, end, points=pts)
+        print(f"  query {label:<12} {len(rows):4d} points  {(time.perf_counter() - t) / 20 * 1e3:6.2f} ms")
+    size = os.path.getsize(path) + (os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0)
+    print(f"  database {size / 1e6:.1f} MB")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Session history store')
+    parser.add_argument('--bench', action='store_true', help='Insert an hour of 30 Hz data and query it')
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--db', default=SERIES_DB, help='Database for --show')
+    parser.add_argument('--show', metavar='SERIES', help='Print the last hour of a series')
+    args = parser.parse_args()
+
+    if args.bench:
+        sys.exit(0 if bench(args.hours) else 1)
+    elif args.show:
+        store = SeriesStore(args.db)
+        for t, mean, lo, hi, std, n in store.query(args.show, time.time() - 3600, points=60):
+            print(f"  {time.strftime('%H:%M:%S', time.localtime(t))}  mean {mean:.3f}  "
+                  f"min {lo:.3f}  max {hi:.3f}  sd {std:.3f}  n {n}")
+    else:
+        parser.print_help()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Vision backends for the Jetson camera loop.
+
+    cpu   GRAY8 frames mapped straight from the GStreamer appsink
+          (gst_source.AppsinkCamera), or cv2.VideoCapture if PyGObject isn't
+          there; ZoneMap sums the frame with cv2.reduce on the A57 cores.
+    cuda  jetson_utils.videoSource keeps frames in NVMM-mapped CUDA memory and
+          CuPy reduces them on the GPU to the 12x12 sub-grid channel sums; only
+          those 432 integers come back to Python.
+
+Both hand exact integer sums to `ZoneMap.update_sums()`, so zones, centre,
+peak and the per-zone luma series are bit-identical whichever backend ran.
+The series themselves (16 floats a frame) stay on the host: copying them
+back for the flicker FFT would cost more than the FFT.
+
+`cell_sums()` is written against the array module, so the GPU reduction is
+exercised with NumPy on machines without CUDA:
+
+    python vision.py --selftest     # cuda vs cpu parity (NumPy stands in for CuPy)
+    python vision.py --bench
+"""
+import importlib.util
+
+import numpy as np
+
+from zones import ZoneMap, SUBGRID, BGR_LUMA, subgrid_edges
+
+BACKEND_AUTO = "auto"
+BACKEND_CPU  = "cpu"
+BACKEND_CUDA = "cuda"
+
+
+def cell_sums(img, rows, cols, xp=np):
+    """Exact per-channel sums of each sub-grid cell, (SUBGRID, SUBGRID, c) int64.
+    `img` is a NumPy or CuPy (h, w[, c]) array; `xp` its array module."""
+    if img.ndim == 2:
+        img = img[:, :, None]
+    w = img.shape[1]
+    bands = xp.stack([img[rows[k]:rows[k + 1]].sum(axis=0, dtype=xp.int64) for k in range(SUBGRID)])
+    cs = xp.cumsum(bands, axis=1)
+    ends = xp.asarray(cols[1:] + [w]) - 1
+    hi = cs[:, ends]
+    lo = xp.concatenate([xp.zeros_like(hi[:, :1]), hi[:, :-1]], axis=1)
+    return hi - lo
+
+
+class CpuBackend:
+    name = BACKEND_CPU
+
+    def update(self, zmap: ZoneMap, frame, now, flicker=True):
+        return zmap.update(frame, now, flicker)
+
+    def sample_luma(self, frame):
+        from zones import roi_luma
+        return roi_luma(frame)
+
+
+class CudaBackend:
+    """Frames are jetson_utils cudaImages (rgb8) or anything exposing
+    __cuda_array_interface__; CuPy wraps them without copying."""
+    name = BACKEND_CUDA
+
+    def __init__(self, xp=None):
+        if xp is None:
+            import cupy as xp
+        self.xp = xp
+        self._edges = {}
+
+    def _cells(self, frame):
+        a = self.xp.asarray(frame)
+        h, w = a.shape[:2]
+        edges = self._edges.get((h, w))
+        if edges is None:
+            edges = self._edges[(h, w)] = subgrid_edges(h, w)
+        sums = cell_sums(a, *edges, xp=self.xp)
+        if sums.shape[2] >= 3:
+            sums = sums[:, :, [2, 1, 0]]          # rgb8 -> ZoneMap's BGR order
+        host = sums.get() if hasattr(sums, "get") else sums
+        return host, (h, w, host.shape[2]) if a.ndim == 3 else (h, w)
+
+    def update(self, zmap: ZoneMap, frame, now, flicker=True):
+        cells, shape = self._cells(frame)
+        return zmap.update_sums(cells, shape, now, flicker)
+
+    def sample_luma(self, frame):
+        a = self.xp.asarray(frame)
+        h, w = a.shape[:2]
+        s = a[h//3:2*h//3, w//3:2*w//3].sum(axis=(0, 1), dtype=self.xp.int64)
+        s = s.get() if hasattr(s, "get") else s
+        area = (2*h//3 - h//3) * (2*w//3 - w//3)
+        if a.ndim == 2:
+            return float(s) / area
+        r, g, b = (float(v) / area for v in s[:3])
+        return b * BGR_LUMA[0] + g * BGR_LUMA[1] + r * BGR_LUMA[2]
+
+
+class CudaCamera:
+    """CSI camera through jetson_utils: frames stay in NVMM-mapped CUDA memory.
+    Same read()/set()/release() surface as cv2.VideoCapture."""
+
+    def __init__(self, uri="csi://0", width=640, height=480, fps=30):
+        from jetson_utils import videoSource
+
+        self.src = videoSource(uri, argv=[f"--input-width={width}", f"--input-height={height}",
+                                          f"--input-rate={fps}"])
+
+    def isOpened(self):
+        return self.src is not None
+
+    def read(self):
+        img = self.src.Capture(format="rgb8", timeout=1000)
+        return img is not None, img
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.src.Close()
+
+
+def cuda_available():
+    try:
+        import cupy
+        if importlib.util.find_spec("jetson_utils") is None:
+            return False
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except Exception:
+        return False
+
+
+def select_backend(prefer=BACKEND_AUTO):
+    """CudaBackend when CuPy, jetson_utils and a GPU are all there, else CpuBackend"""
+    if prefer == BACKEND_CPU:
+        return CpuBackend()
+    if cuda_available():
+        return CudaBackend()
+    if prefer == BACKEND_CUDA:
+        print("✗ CUDA vision backend unavailable (needs cupy + jetson_utils + a GPU); using CPU")
+    return CpuBackend()
+
+
+def selftest(runs=20, seed=0):
+    """CUDA-path reduction (NumPy, and CuPy if present) must match the CPU path exactly"""
+    rng = np.random.default_rng(seed)
+    modules = [np]
+    if cuda_available():
+        import cupy
+        modules.append(cupy)
+    ok = True
+    for xp in modules:
+        gpu = CudaBackend(xp)
+        for shape in ((480, 640, 3), (720, 1280, 3), (481, 643, 3), (480, 640)):
+            cpu_zm, gpu_zm = ZoneMap(), ZoneMap()
+            for i in range(runs):
+                bgr = rng.integers(0, 256, size=shape, dtype=np.uint8)
+                rgb = xp.asarray(bgr[:, :, ::-1].copy() if bgr.ndim == 3 else bgr)
+                a = CpuBackend().update(cpu_zm, bgr, i / 30.0)
+                b = gpu.update(gpu_zm, rgb, i / 30.0)
+                same = (a == b and np.array_equal(cpu_zm.zones, gpu_zm.zones)
+                        and cpu_zm.centre == gpu_zm.centre and cpu_zm.peak == gpu_zm.peak)
+                if not same:
+                    ok = False
+                    print(f"✗ {xp.__name__} {shape} frame {i}: {a!r} vs {b!r}")
+                    break
+            samp_c = CpuBackend().sample_luma(bgr)
+            samp_g = gpu.sample_luma(rgb)
+            if abs(samp_c - samp_g) > 1e-9:
+                ok = False
+                print(f"✗ {xp.__name__} {shape} sample luma {samp_c} vs {samp_g}")
+        print(f"{'✓' if ok else '✗'} {xp.__name__} reduction matches the CPU path")
+    return ok
+
+
+def bench(runs=200):
+    import time
+
+    frame = np.random.default_rng(0).integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    backends = [("cpu (cv2.reduce)", CpuBackend(), frame)]
+    backends.append(("cuda path on numpy", CudaBackend(np), frame))
+    if cuda_available():
+        import cupy
+        backends.append(("cuda (cupy)", CudaBackend(), cupy.asarray(frame)))
+    for name, be, f in backends:
+        zm = ZoneMap()
+        be.update(zm, f, 0.0)
+        t0 = time.perf_counter()
+        for i in range(runs):
+            be.update(zm, f, i / 30.0, flicker=False)
+        print(f"  {name:<20} {(time.perf_counter() - t0) / runs * 1e6:8.1f} us/frame")
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Jetson vision backends')
+    parser.add_argument('--selftest', action='store_true', help='Check CUDA-path parity with the CPU path')
+    parser.add_argument('--bench', action='store_true')
+    args = parser.parse_args()
+
+    print(f"Backend available here: {select_backend().name}")
+    if args.bench:
+        bench()
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
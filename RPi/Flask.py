@@ -1,12 +1,16 @@
-from flask import Flask, render_template, request, jsonify
+from startup import timeline, preload
+from flask import Flask, Response, render_template, request, jsonify
 import os
-from dotenv import load_dotenv, set_key
-import json
-import openai
-import serial
-from serial.tools import list_ports
 import time
-import glob
+from dotenv import load_dotenv
+from envstore import open_env
+from timeseries import open_series, history_json
+from features import FEATURE_WINDOW_S, features_from_request, loudness_from_store
+from recommender import Recommender, RecommendError, parse_response, readings_from
+import json
+from serial_link import SerialLink
+import metrics
+# openai is imported on the first /recommend (it is the slowest import here)
 
 app = Flask(__name__)
 
@@ -14,28 +18,20 @@ app = Flask(__name__)
 SETTINGS_ENV = "settings.env"
 STORE_ENV = "store.env"
 
-# -------- UART auto-detect (for Arduino LED control) --------
-def open_serial():
-    """Auto-detect and open serial connection to Arduino"""
-    candidates = [
-        '/dev/serial0', '/dev/ttyAMA0', '/dev/ttyS0',
-        '/dev/ttyACM0', '/dev/ttyUSB0'
-    ]
-    detected = [p.device for p in list_ports.comports()]
-    for c in candidates + detected:
-        try:
-            if c and (glob.glob(c) or c in detected):
-                s = serial.Serial(c, baudrate=9600, timeout=1)
-                print(f"[UART] Connected on {c}")
-                time.sleep(2.0)  # Arduino reset guard
-                s.reset_input_buffer()
-                return s
-        except Exception:
-            pass
-    print("[UART] No serial port available. Running without Arduino.")
-    return None
+# -------- Metrics (all components, served on /metrics) --------
+server_metrics = metrics.Registry("server")
+M_RECOMMEND = server_metrics.histogram("vyz_recommend_seconds", "/recommend handling time",
+                                       labels={"engine": "gpt"})
+M_LLM = server_metrics.histogram("vyz_recommend_llm_seconds", "Time spent waiting on the LLM",
+                                 labels={"engine": "gpt"})
+M_RECOMMEND_ERRORS = server_metrics.counter("vyz_recommend_errors_total", "Failed /recommend calls",
+                                            labels={"engine": "gpt"})
+server_metrics.open()
 
-ser = open_serial()
+# -------- UART (for Arduino LED control) --------
+# Port discovery, the Arduino reset guard and reconnects all happen on a
+# background thread so the server binds immediately.
+link = SerialLink().start()
 
 # Initialize .env files if they don't exist
 def init_env_files():
@@ -55,6 +51,8 @@ AMPLITUDE_THRESHOLD=0.5
     if not os.path.exists(STORE_ENV):
         with open(STORE_ENV, 'w') as f:
             f.write("""BRIGHTNESS=0.0
+BRIGHTNESS_PEAK=0.0
+FLICKER_PEAK=0.0
 AMPLITUDE=0.0
 """)
 
@@ -64,23 +62,12 @@ init_env_files()
 load_dotenv(SETTINGS_ENV)
 load_dotenv(STORE_ENV)
 
-# Available patterns for GPT to choose from
-AVAILABLE_AUDIO_PATTERNS = [
-    "white_noise_calm",
-    "white_noise_rain",
-    "white_noise_ocean",
-    "pink_noise_soft",
-    "brown_noise_deep"
-]
+# Reads come from memory; writes are batched into atomic file swaps (envstore.py)
+settings_env = open_env(SETTINGS_ENV, durable=True)
+store_env = open_env(STORE_ENV)
 
-AVAILABLE_LIGHT_PATTERNS = [
-    "steady_warm",
-    "steady_cool",
-    "breathing_slow",
-    "breathing_fast",
-    "pulse_gentle",
-    "off"
-]
+# Sensor history and events shared with the camera/audio processes (timeseries.py)
+history_store = open_series()
 
 # Map light patterns to RGB values (0-100 range)
 LIGHT_PATTERN_RGB = {
@@ -94,12 +81,18 @@ LIGHT_PATTERN_RGB = {
 
 # OpenAI setup
 api_=""
-openai.api_key = api_
+
+def get_openai():
+    """Import and configure the OpenAI client on first use"""
+    import openai
+    openai.api_key = api_
+    return openai
+
+# Prompt prefix, pattern enum and reply parsing (set VYZ_LLM_URL for the mock server)
+recommender = Recommender(get_openai)
 
 def send_rgb_to_arduino(r, g, b):
-    """Send RGB values to Arduino in the format: !R.G.B#"""
-    if not ser:
-        return False
+    """Queue RGB values for the Arduino in the format: !R.G.B#"""
     try:
         # Ensure values are 0-100
         r = max(0, min(100, int(r)))
@@ -107,8 +100,8 @@ def send_rgb_to_arduino(r, g, b):
         b = max(0, min(100, int(b)))
         
         frame = f"!{r}.{g}.{b}#".encode("ascii")
-        ser.write(frame)
-        ser.flush()
+        if not link.write(frame):
+            return False
         print(f"✓ Sent to Arduino: R={r} G={g} B={b}")
         return True
     except Exception as e:
@@ -118,17 +111,18 @@ def send_rgb_to_arduino(r, g, b):
 @app.route("/")
 def index():
     # Load current settings
-    load_dotenv(SETTINGS_ENV, override=True)
+    settings_env.refresh()
+    env = settings_env.get
     settings = {
-        "brightness_threshold": float(os.getenv("BRIGHTNESS_THRESHOLD", 0.5)),
-        "background_audio": os.getenv("BACKGROUND_AUDIO", "white_noise_calm"),
-        "target_peak": float(os.getenv("TARGET_PEAK", 0.7)),
-        "white_noise_level": float(os.getenv("WHITE_NOISE_LEVEL", 0.08)),
-        "highcut": int(os.getenv("HIGHCUT", 6000)),
-        "lowcut": int(os.getenv("LOWCUT", 200)),
-        "ratio": int(os.getenv("RATIO", 4)),
-        "threshold_db": int(os.getenv("THRESHOLD_DB", -20)),
-        "amplitude_threshold": float(os.getenv("AMPLITUDE_THRESHOLD", 0.5))
+        "brightness_threshold": float(env("BRIGHTNESS_THRESHOLD", 0.5)),
+        "background_audio": env("BACKGROUND_AUDIO", "white_noise_calm"),
+        "target_peak": float(env("TARGET_PEAK", 0.7)),
+        "white_noise_level": float(env("WHITE_NOISE_LEVEL", 0.08)),
+        "highcut": int(env("HIGHCUT", 6000)),
+        "lowcut": int(env("LOWCUT", 200)),
+        "ratio": int(env("RATIO", 4)),
+        "threshold_db": int(env("THRESHOLD_DB", -20)),
+        "amplitude_threshold": float(env("AMPLITUDE_THRESHOLD", 0.5))
     }
     return render_template("index.html", settings=settings)
 
@@ -145,16 +139,15 @@ def update_settings():
             "AMPLITUDE_THRESHOLD"
         ]
         
-        # Update each setting in the .env file
+        # Update all settings in one write of the .env file
         updated = {}
         for key, value in data.items():
             env_key = key.upper()
             if env_key in valid_keys:
-                set_key(SETTINGS_ENV, env_key, str(value))
                 updated[env_key] = value
-        
-        # Reload settings
-        load_dotenv(SETTINGS_ENV, override=True)
+        settings_env.update(updated)
+        settings_env.flush(timeout=1.0)
+        history_store.event("settings", json.dumps(updated))
         
         print(f"✓ Settings updated: {updated}")
         return jsonify({"success": True, "message": "Settings updated", "updated": updated})
@@ -166,108 +159,91 @@ def update_settings():
 @app.route("/recommend", methods=["POST"])
 def recommend():
     """
-    Get current store values (brightness, amplitude),
+    Get current store values (brightness, amplitude) and the windowed
+    features the camera sends (see features.py),
     query GPT for recommendations,
     update settings.env with new audio pattern,
     send light pattern to Arduino via serial
     """
+    t0 = time.perf_counter()
+    try:
+        sent = features_from_request(request.get_json(silent=True))
+    except ValueError as e:
+        M_RECOMMEND_ERRORS.inc()
+        return jsonify({"success": False, "error": str(e)}), 400
     try:
         # 1. Load current values from store.env
-        load_dotenv(STORE_ENV, override=True)
-        brightness = float(os.getenv("BRIGHTNESS", 0.0))
-        amplitude = float(os.getenv("AMPLITUDE", 0.0))
+        store_env.refresh()
+        brightness = store_env.get_float("BRIGHTNESS", 0.0)
+        brightness_peak = store_env.get_float("BRIGHTNESS_PEAK", brightness)
+        flicker = store_env.get_float("FLICKER_PEAK", 0.0)
+        amplitude = store_env.get_float("AMPLITUDE", 0.0)
+        # Windowed features from the camera's trigger; loudness from the audio script
+        features = dict(loudness_from_store(store_env))
+        features.update(sent)
+        settings_env.refresh()
+        threshold = settings_env.get_float("BRIGHTNESS_THRESHOLD", 0.5)
         
         print(f"\n{'='*60}")
         print(f"RECOMMEND REQUEST")
         print(f"{'='*60}")
-        print(f"Current values - Brightness: {brightness:.3f}, Amplitude: {amplitude:.3f}")
+        print(f"Current values - Brightness: {brightness:.3f} (peak zone {brightness_peak:.3f}, flicker {flicker:.2f}), Amplitude: {amplitude:.3f}")
+        if features:
+            print(f"Features ({FEATURE_WINDOW_S:g} s) - " + ", ".join(f"{k} {v:.3f}" for k, v in features.items()))
         
-        # 2. Build GPT prompt
-        prompt = f"""Based on the current sensor readings, recommend the most soothing audio and light pattern.
-
-Current readings:
-- Brightness: {brightness:.3f} (0.0 = dark, 1.0 = very bright)
-- Amplitude: {amplitude:.3f} (0.0 = silent, 1.0 = very loud)
-
-Available audio patterns: {', '.join(AVAILABLE_AUDIO_PATTERNS)}
-Available light patterns: {', '.join(AVAILABLE_LIGHT_PATTERNS)}
-
-Consider:
-- If brightness is high, use warmer/dimmer lights to reduce visual stimulation
-- If brightness is low, can use brighter/cooler lights
-- If amplitude is high (loud environment), use calming audio with more white noise
-- If amplitude is low (quiet environment), use gentler audio
-- Choose patterns that create a soothing, peaceful environment
-- When both brightness and amplitude are normal (around 0.3-0.6), recommend baseline calming settings
-
-Respond ONLY with valid JSON in this exact format:
-{{"audio": "pattern_name", "light": "pattern_name", "reason": "brief explanation"}}"""
-
-        # 3. Call GPT
+        # 2. Call GPT (static prompt prefix + one line of readings, see recommender.py)
+        readings = readings_from({"brightness": brightness, "brightness_peak": brightness_peak,
+                                  "flicker": flicker, "amplitude": amplitude, "threshold": threshold}, features)
         print("Calling OpenAI API...")
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a calming environment assistant. Respond only with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=150
-        )
-        
-        # 4. Parse GPT response
-        gpt_response = response['choices'][0]['message']['content'].strip()
+        t_llm = time.perf_counter()
+        gpt_response = recommender.ask(readings)
+        M_LLM.observe(time.perf_counter() - t_llm)
         print(f"GPT Response: {gpt_response}")
         
-        # Extract JSON (in case GPT wraps it in markdown)
-        if "```json" in gpt_response:
-            gpt_response = gpt_response.split("```json")[1].split("```")[0].strip()
-        elif "```" in gpt_response:
-            gpt_response = gpt_response.split("```")[1].split("```")[0].strip()
-        
-        recommendation = json.loads(gpt_response)
-        
-        # Validate recommendations
-        if recommendation.get("audio") not in AVAILABLE_AUDIO_PATTERNS:
-            print(f"⚠ Invalid audio pattern '{recommendation.get('audio')}', defaulting to white_noise_calm")
-            recommendation["audio"] = "white_noise_calm"
-        if recommendation.get("light") not in AVAILABLE_LIGHT_PATTERNS:
-            print(f"⚠ Invalid light pattern '{recommendation.get('light')}', defaulting to steady_warm")
-            recommendation["light"] = "steady_warm"
+        # 3. Parse and validate (unknown patterns fall back to the defaults)
+        rec, invalid = parse_response(gpt_response)
+        for field in invalid:
+            print(f"⚠ Invalid pattern {field} from GPT, using the default")
+        recommendation = rec._asdict()
         
         print(f"✓ Recommendation: {recommendation}")
         
-        # 5. Update BACKGROUND_AUDIO in settings.env (audio processor will pick this up)
-        set_key(SETTINGS_ENV, "BACKGROUND_AUDIO", recommendation["audio"])
+        # 4. Update BACKGROUND_AUDIO in settings.env (audio processor will pick this up)
+        settings_env.set("BACKGROUND_AUDIO", recommendation["audio"])
         print(f"✓ Updated BACKGROUND_AUDIO to: {recommendation['audio']}")
+        history_store.event("recommend", f"{recommendation['audio']} / {recommendation['light']}")
         
-        # 6. Send light pattern to Arduino via serial
+        # 5. Send light pattern to Arduino via serial
         light_pattern = recommendation["light"]
         rgb = LIGHT_PATTERN_RGB.get(light_pattern, (50, 50, 50))
         
-        if ser:
-            send_rgb_to_arduino(rgb[0], rgb[1], rgb[2])
-        else:
-            print("⚠ Arduino not connected - skipping light control")
+        if not send_rgb_to_arduino(rgb[0], rgb[1], rgb[2]):
+            print(f"⚠ Arduino {link.state} - light frame queued until it connects")
         
         print(f"{'='*60}\n")
+        M_RECOMMEND.observe(time.perf_counter() - t0)
         
         return jsonify({
             "success": True,
             "recommendation": recommendation,
             "current_values": {
                 "brightness": brightness,
+                "brightness_peak": brightness_peak,
+                "flicker": flicker,
                 "amplitude": amplitude
             },
+            "features": features,
             "light_rgb": rgb
         })
     
-    except json.JSONDecodeError as e:
+    except RecommendError as e:
+        M_RECOMMEND_ERRORS.inc()
         print(f"✗ JSON parsing error: {e}")
         print(f"Raw response: {gpt_response}")
         return jsonify({"success": False, "error": "Invalid JSON from GPT", "raw_response": gpt_response}), 500
     
     except Exception as e:
+        M_RECOMMEND_ERRORS.inc()
         print(f"✗ Error in recommend: {e}")
         import traceback
         traceback.print_exc()
@@ -277,11 +253,22 @@ Respond ONLY with valid JSON in this exact format:
 def get_store():
     """Get current store values (for debugging/monitoring)"""
     try:
-        load_dotenv(STORE_ENV, override=True)
+        store_env.refresh()
         store_values = {
-            "brightness": float(os.getenv("BRIGHTNESS", 0.0)),
-            "amplitude": float(os.getenv("AMPLITUDE", 0.0))
+            "brightness": store_env.get_float("BRIGHTNESS", 0.0),
+            "brightness_peak": store_env.get_float("BRIGHTNESS_PEAK", 0.0),
+            "flicker": store_env.get_float("FLICKER_PEAK", 0.0),
+            "amplitude": store_env.get_float("AMPLITUDE", 0.0)
         }
+        if store_env.get("VENUE_AUDIO"):
+            # Zone recommendation from the venue aggregator (fleet_client.py)
+            store_values["venue"] = {
+                "audio": store_env.get("VENUE_AUDIO"),
+                "light": store_env.get("VENUE_LIGHT"),
+                "level": store_env.get("VENUE_LEVEL"),
+                "brightness": store_env.get_float("VENUE_BRIGHTNESS", 0.0),
+                "loudness": store_env.get_float("VENUE_LOUDNESS", 0.0)
+            }
         return jsonify({"success": True, "store": store_values})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -290,34 +277,54 @@ def get_store():
 def get_settings():
     """Get current settings (for debugging/monitoring)"""
     try:
-        load_dotenv(SETTINGS_ENV, override=True)
+        settings_env.refresh()
+        env = settings_env.get
         settings = {
-            "brightness_threshold": float(os.getenv("BRIGHTNESS_THRESHOLD", 0.5)),
-            "amplitude_threshold": float(os.getenv("AMPLITUDE_THRESHOLD", 0.5)),
-            "background_audio": os.getenv("BACKGROUND_AUDIO", "white_noise_calm"),
-            "target_peak": float(os.getenv("TARGET_PEAK", 0.7)),
-            "white_noise_level": float(os.getenv("WHITE_NOISE_LEVEL", 0.08)),
-            "highcut": int(os.getenv("HIGHCUT", 6000)),
-            "lowcut": int(os.getenv("LOWCUT", 200)),
-            "ratio": int(os.getenv("RATIO", 4)),
-            "threshold_db": int(os.getenv("THRESHOLD_DB", -20))
+            "brightness_threshold": float(env("BRIGHTNESS_THRESHOLD", 0.5)),
+            "amplitude_threshold": float(env("AMPLITUDE_THRESHOLD", 0.5)),
+            "background_audio": env("BACKGROUND_AUDIO", "white_noise_calm"),
+            "target_peak": float(env("TARGET_PEAK", 0.7)),
+            "white_noise_level": float(env("WHITE_NOISE_LEVEL", 0.08)),
+            "highcut": int(env("HIGHCUT", 6000)),
+            "lowcut": int(env("LOWCUT", 200)),
+            "ratio": int(env("RATIO", 4)),
+            "threshold_db": int(env("THRESHOLD_DB", -20))
         }
         return jsonify({"success": True, "settings": settings})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/history", methods=["GET"])
+def history():
+    """Downsampled sensor history for the app, e.g. ?series=amplitude&minutes=60&points=200"""
+    try:
+        body = history_json(history_store, request.args.get("series", "brightness"),
+                            float(request.args.get("minutes", 60)), int(request.args.get("points", 200)))
+        return jsonify({"success": True, **body})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text format for camera, audio, serial and server metrics"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Liveness plus Arduino link state (connecting/connected/disconnected)"""
+    return jsonify({"ok": True, "arduino": link.status()})
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("CALMING ENVIRONMENT CONTROL SERVER")
     print("="*60)
     print(f"Settings file: {SETTINGS_ENV}")
     print(f"Store file: {STORE_ENV}")
-    print(f"Arduino serial: {'CONNECTED' if ser else 'NOT CONNECTED'}")
-    if ser:
-        print(f"  Port: {ser.port}")
-        print(f"  Baud: {ser.baudrate}")
+    print(f"Arduino serial: {link.state.upper()} (cache: {link.cache_path})")
     print(f"OpenAI API: {'CONFIGURED' if os.getenv('OPENAI_API_KEY') else 'NOT CONFIGURED'}")
     print("="*60 + "\n")
-    
+
+    timeline.ready("serving")
+    preload("openai")
     app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
     
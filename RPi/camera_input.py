@@ -1,24 +1,44 @@
 #!/usr/bin/env python3
+from startup import timeline, preload
+import importlib
 import time
 import os
-from collections import deque
-import numpy as np
-import cv2
-from picamera2 import Picamera2, Preview
+import signal
+import threading
 import RPi.GPIO as GPIO
-from dotenv import load_dotenv, set_key
-import requests
+from envstore import open_env
+from metrics import Registry
+from glare import GlareController, GlareParams, DOWN, GLARE_ENV, load_params
+from features import CameraFeatures, ChangeTrigger, loudness_from_store
+from fleet_client import FleetClient, FLEET_EVERY, store_values as venue_store_values
+from zones import ZoneMap, roi_luma
+from monitor import Monitor
+import logs
+from actuator import VisorActuator
+from timeseries import open_series
+from sensor_trace import TraceWriter, F_DOWN, F_FLIP, F_FORCED, F_RECOMMEND, F_CALIBRATE
+# cv2, picamera2 and requests are imported where first used so the visor
+# pins are driven before the camera stack loads (see startup.py)
 
 # Load settings
 SETTINGS_ENV = "settings.env"
 STORE_ENV = "store.env"
 
+log = logs.get("camera")
+
 # Flask server URL
 FLASK_URL = "http://localhost:5000/recommend"
 
 # Settings reload interval
 SETTINGS_RELOAD_INTERVAL = 2.0
 
+# Event loop timers / side-effect deadlines (see monitor.py)
+STORE_FLUSH_EVERY   = 0.1    # BRIGHTNESS to store.env
+METRICS_EVERY       = 1.0
+CALIBRATE_TIMEOUT_S = 3.0    # > LOCK_SETTLE_S plus a metadata frame
+RECOMMEND_TIMEOUT_S = 5.0
+STORE_TIMEOUT_S     = 1.0
+
 # ================== USER SETTINGS ==================
 # Glare logic
 THRESHOLD   = 55.0
@@ -27,18 +47,22 @@ REQ_FRAMES  = 4
 COOLDOWN_S  = 0.8
 PRINT_EVERY = 20
 
-# ---- Threshold monitoring ----
+# ---- Recommendations (features.py) ----
+# /recommend is called when the windowed brightness/flicker/loudness features
+# move, not on every threshold crossing
 API_COOLDOWN = 5.0  # minimum seconds between API calls
 
 # ---- Pi -> Arduino signal pins ----
 SIGNAL_PIN  = 23
 STROBE_PIN  = 24
 USE_STROBE  = False
+STROBE_PULSE_S = 0.01
 
 # Exposure/white balance
 EXPOSURE_US       = 8000
 ANALOGUE_GAIN     = 1.0
 FIX_WHITE_BALANCE = True
+LOCK_SETTLE_S     = 1.0      # let AE/AWB converge before reading them back
 WB_GAINS          = (1.8, 1.6)
 
 # ---- Flashing/strobe detection ----
@@ -51,8 +75,58 @@ MIN_DOWN_HOLD_S        = 2.0
 EXTRA_HOLD_PER_SCORE   = 3.0
 BIAS_UPPER_PER_SCORE   = 8.0
 BIAS_LOWER_PER_SCORE   = 4.0
+
+# ---- Sensor trace (replay with sensor_trace.py) ----
+TRACE_ENABLED = True
+
+# Keep brightness/flicker history and visor events for the app (see timeseries.py)
+HISTORY_ENABLED = True
+
+# ---- Venue fleet (fleet_client.py / Fleet/aggregator.py) ----
+# VYZ_FLEET=host:port sends telemetry to the venue aggregator; VYZ_FLEET_CELL=row,col
+# is where this hat is in the venue grid
+FLEET_ADDRESS = os.getenv("VYZ_FLEET")
+FLEET_CELL    = os.getenv("VYZ_FLEET_CELL", "0,0")
+
+# ---- Multi-zone luma (zones.py) ----
+ZONE_GRID         = (4, 4)    # rows, cols; must divide 12
+ZONE_PEAK_WEIGHT  = 0.3       # glare input = (1-w)*centre-weighted + w*brightest zone
+ZONE_GLARE_INPUT  = "blend"   # "centre" = old centre-third mean only
+ZONE_STORE_EVERY  = 1.0       # seconds between peak/flicker writes to store.env
+
+# ---- Flicker sampling (fast mode) ----
+# Runs the sensor in a binned 90-120 fps mode. Every frame only contributes the
+# centre luma of a small YUV stream to the flicker detector; zones and the
+# visor logic run on the 640x480 stream every FAST_DECIMATE-th frame.
+# EXPOSURE_US must fit in one frame (8333 us at 120 fps).
+FLICKER_FAST_MODE = False
+FLICKER_FPS       = 120
+FAST_LORES_SIZE   = (160, 120)
+FAST_DECIMATE     = 4         # ~30 fps glare analysis at 120 fps
 # ===================================================
 
+GLARE_PARAMS = GlareParams(
+    threshold=THRESHOLD, hysteresis=HYSTERESIS, req_frames=REQ_FRAMES, cooldown_s=COOLDOWN_S,
+    win_sec=WIN_SEC, flicker_check_every=FLICKER_CHECK_EVERY,
+    band_lo_hz=FLASH_BAND_LOW_HZ, band_hi_hz=FLASH_BAND_HIGH_HZ,
+    flicker_force_t=FLICKER_FORCE_T, min_down_hold_s=MIN_DOWN_HOLD_S,
+    extra_hold_per_score=EXTRA_HOLD_PER_SCORE,
+    bias_upper_per_score=BIAS_UPPER_PER_SCORE, bias_lower_per_score=BIAS_LOWER_PER_SCORE,
+)
+# The settings above are the fallback; tune_glare.py writes per-venue values to GLARE_ENV
+
+# ---- Metrics (served by the Flask server's /metrics) ----
+metrics = Registry("camera")
+M_CAPTURE      = metrics.histogram("vyz_frame_capture_seconds", "Time to grab one camera frame")
+M_ANALYSIS     = metrics.histogram("vyz_frame_analysis_seconds", "Per-frame luma, flicker and visor logic time")
+M_STORE_WRITES = metrics.counter("vyz_store_writes_total", "BRIGHTNESS writes to store.env")
+M_RECOMMEND    = metrics.histogram("vyz_recommend_request_seconds", "Round trip of camera-triggered /recommend calls")
+M_VISOR_CMDS   = metrics.counter("vyz_visor_commands_total", "Visor up/down commands sent")
+M_VISOR_COLLAPSED = metrics.counter("vyz_visor_commands_collapsed_total",
+                                    "Visor requests dropped as redundant by the actuator")
+M_FPS          = metrics.gauge("vyz_camera_fps", "Analysed frames per second")
+M_TIMER_LAG    = metrics.histogram("vyz_timer_lag_seconds", "How late camera monitor timers fire")
+
 def setup_signal_pins():
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(SIGNAL_PIN, GPIO.OUT, initial=GPIO.LOW)
@@ -60,16 +134,44 @@ def setup_signal_pins():
         GPIO.setup(STROBE_PIN, GPIO.OUT, initial=GPIO.LOW)
 
 def notify_arduino(state_down: bool):
+    M_VISOR_CMDS.inc()
     GPIO.output(SIGNAL_PIN, GPIO.HIGH if state_down else GPIO.LOW)
     if USE_STROBE:
         GPIO.output(STROBE_PIN, GPIO.HIGH)
-        time.sleep(0.01)
-        GPIO.output(STROBE_PIN, GPIO.LOW)
 
-def make_camera():
+def end_strobe():
+    GPIO.output(STROBE_PIN, GPIO.LOW)
+
+def make_visor():
+    """Actuator thread that owns the pin timing: notify_arduino, then the
+    strobe drop STROBE_PULSE_S later instead of a sleep in the frame loop"""
+    followups = [(STROBE_PULSE_S, end_strobe)] if USE_STROBE else []
+    return VisorActuator(notify_arduino, followups, collapsed=M_VISOR_COLLAPSED).start()
+
+def pick_sensor_mode(modes, fps):
+    """Largest sensor mode (least crop) that still reaches `fps`, else the fastest"""
+    fast = [m for m in modes if m.get("fps", 0) >= fps]
+    if not fast:
+        return max(modes, key=lambda m: m.get("fps", 0))
+    return max(fast, key=lambda m: m["size"][0] * m["size"][1])
+
+def make_camera(fast=False):
+    from picamera2 import Picamera2, Preview
+
     picam2 = Picamera2()
     picam2.start_preview(Preview.NULL)
-    config = picam2.create_preview_configuration(main={"size": (640, 480)})
+    if fast:
+        mode = pick_sensor_mode(picam2.sensor_modes, FLICKER_FPS)
+        frame_us = int(1e6 / min(FLICKER_FPS, mode.get("fps", FLICKER_FPS)))
+        config = picam2.create_video_configuration(
+            main={"size": (640, 480)},
+            lores={"size": FAST_LORES_SIZE, "format": "YUV420"},
+            sensor={"output_size": mode["size"], "bit_depth": mode["bit_depth"]},
+            controls={"FrameDurationLimits": (frame_us, frame_us)},
+            buffer_count=6)
+        print(f"Flicker sampling: sensor mode {mode['size']} @ {1e6 / frame_us:.0f} fps")
+    else:
+        config = picam2.create_preview_configuration(main={"size": (640, 480)})
     picam2.configure(config)
 
     controls = {
@@ -87,11 +189,32 @@ def make_camera():
     picam2.start()
     return picam2
 
+def capture_frame(picam2):
+    """Frame and its metadata from the same request, so logging exposure/gain
+    never costs an extra frame wait (capture_metadata() blocks for one)"""
+    request = picam2.capture_request()
+    try:
+        return request.make_array("main"), request.get_metadata()
+    finally:
+        request.release()
+
+def capture_fast(picam2, full):
+    """One fast-mode frame: lores centre luma always, the main frame only if `full`"""
+    request = picam2.capture_request()
+    try:
+        yuv = request.make_array("lores")        # YUV420: the first h rows are Y
+        luma = roi_luma(yuv[:FAST_LORES_SIZE[1]])
+        if not full:
+            return luma, None, None
+        return luma, request.make_array("main"), request.get_metadata()
+    finally:
+        request.release()
+
 def lock_current_exposure_and_wb(picam2):
     picam2.set_controls({"AeEnable": True})
     if FIX_WHITE_BALANCE:
         picam2.set_controls({"AwbEnable": True})
-    time.sleep(1.0)
+    time.sleep(LOCK_SETTLE_S)
 
     meta  = picam2.capture_metadata()
     exp   = meta.get("ExposureTime")
@@ -108,193 +231,279 @@ def lock_current_exposure_and_wb(picam2):
     picam2.set_controls(lock)
     return exp, gain, cgain
 
-def compute_flicker_score(ts, xs, band_lo=FLASH_BAND_LOW_HZ, band_hi=FLASH_BAND_HIGH_HZ):
-    if len(xs) < 20:
-        return 0.0
-    dur = ts[-1] - ts[0]
-    if dur < 0.8:
-        return 0.0
-
-    est_fs = max(10.0, min(50.0, len(xs) / dur))
-    t_uniform = np.linspace(ts[0], ts[-1], int(est_fs * dur), endpoint=True)
-    x_uniform = np.interp(t_uniform, ts, xs)
-
-    x = x_uniform - np.mean(x_uniform)
-    if np.max(np.abs(x)) < 1e-6:
-        return 0.0
-    w = np.hanning(len(x))
-    X = np.fft.rfft(x * w)
-    P = (np.abs(X) ** 2)
-    freqs = np.fft.rfftfreq(len(x), 1.0 / est_fs)
-
-    band = (freqs >= band_lo) & (freqs <= band_hi)
-    num = float(np.sum(P[band]))
-    den = float(np.sum(P[1:]) + 1e-9)
-    score = num / den
-    return float(np.clip(score, 0.0, 1.0))
-
 def update_store_brightness(normalized_brightness):
     """Update BRIGHTNESS in store.env"""
     try:
-        set_key(STORE_ENV, "BRIGHTNESS", f"{normalized_brightness:.6f}")
+        open_env(STORE_ENV).set("BRIGHTNESS", f"{normalized_brightness:.6f}")
+        M_STORE_WRITES.inc()
     except Exception as e:
-        print(f"✗ Error updating store: {e}")
+        log.error("✗ Error updating store: %s", e)
 
-def trigger_recommend_api():
-    """Call Flask /recommend endpoint"""
+def update_store_zones(values):
+    """Peak/weighted zone luma and zone flicker for the recommender"""
     try:
-        response = requests.post(FLASK_URL, timeout=3)
+        open_env(STORE_ENV).update({key: f"{v:.6f}" for key, v in values.items()})
+        M_STORE_WRITES.inc(len(values))
+    except Exception as e:
+        log.error("✗ Error updating store: %s", e)
+
+def trigger_recommend_api(features):
+    """Call Flask /recommend endpoint with the windowed sensor features"""
+    import requests
+
+    try:
+        t0 = time.perf_counter()
+        response = requests.post(FLASK_URL, json={"features": features}, timeout=3)
+        M_RECOMMEND.observe(time.perf_counter() - t0)
         if response.status_code == 200:
             result = response.json()
             if result.get("success"):
                 rec = result.get("recommendation", {})
-                print(f"✓ API Response - Audio: {rec.get('audio')}, Light: {rec.get('light')}")
+                log.info("✓ API Response - Audio: %s, Light: %s", rec.get('audio'), rec.get('light'))
         else:
-            print(f"✗ API error: {response.status_code}")
+            log.warning("✗ API error: %s", response.status_code)
     except requests.exceptions.ConnectionError:
-        print(f"✗ API call failed: Flask server not reachable at {FLASK_URL}")
+        log.warning("✗ API call failed: Flask server not reachable at %s", FLASK_URL)
     except Exception as e:
-        print(f"✗ API call failed: {e}")
+        log.warning("✗ API call failed: %s", e)
 
-def load_brightness_threshold():
-    """Load brightness threshold from settings.env"""
-    load_dotenv(SETTINGS_ENV, override=True)
-    return float(os.getenv("BRIGHTNESS_THRESHOLD", 0.5))
+# ---- Control signals ----
+# `kill -USR1 <pid>` re-locks exposure/WB on the next frame. The old
+# `touch /tmp/calibrate` still works but is only checked with the settings reload.
+CALIBRATE_FILE = "/tmp/calibrate"
+_calibrate_requested = threading.Event()
 
-def main():
-    setup_signal_pins()
-    picam2 = make_camera()
+def request_calibration(signum=None, frame=None):
+    _calibrate_requested.set()
 
-    current_state = "up"
-    notify_arduino(state_down=False)
+def install_control_signals():
+    signal.signal(signal.SIGUSR1, request_calibration)
 
-    last_flip = 0.0
-    hi_cnt = lo_cnt = 0
-    frame_idx = 0
-    last_info = ""
+def venue_recommendation(rec):
+    """Zone recommendation from the aggregator (fleet thread) -> store.env"""
+    log.info("📡 Venue: %s / %s (%s, %d hats in cell %s)", rec["audio"], rec["light"], rec["level"],
+             rec["devices"], rec["cell"])
+    open_env(STORE_ENV).update(venue_store_values(rec))
 
-    avg_ema = THRESHOLD
+def load_brightness_threshold():
+    """Load brightness threshold from settings.env"""
+    settings = open_env(SETTINGS_ENV)
+    settings.refresh()
+    return settings.get_float("BRIGHTNESS_THRESHOLD", 0.5)
 
-    lum_buf = deque(maxlen=1000)
-    last_flicker_check = 0.0
-    flicker_score = 0.0
-    hold_until = 0.0
+def main():
+    timeline.mark("modules")
+    install_control_signals()
+    setup_signal_pins()
+    visor = make_visor()
+    visor.set(False)
+    timeline.mark("gpio")
+
+    # Loaded here so the startup timeline shows what cv2 costs (the frame
+    # helpers import it where they use it)
+    importlib.import_module("cv2")
+    timeline.mark("import_cv2")
+    picam2 = make_camera(fast=FLICKER_FAST_MODE)
+    timeline.mark("camera")
+    metrics.open()
+
+    glare_params = load_params(GLARE_ENV, GLARE_PARAMS)
+    glare = GlareController(glare_params, state="up")
+    recommend = ChangeTrigger(API_COOLDOWN)
+    zmap = ZoneMap(ZONE_GRID, glare_params, ZONE_PEAK_WEIGHT, glare_input=ZONE_GLARE_INPUT)
+    trace = TraceWriter("camera").start() if TRACE_ENABLED else None
+    history = open_series() if HISTORY_ENABLED else None
+    mon = Monitor("camera", lag=M_TIMER_LAG)
 
-    # Threshold tracking
-    last_api_call = 0.0
-    was_above_threshold = False
-    
-    # Settings reload tracking
-    last_settings_reload = 0.0
     brightness_threshold = load_brightness_threshold()
-
-    print("\n" + "="*60)
-    print("CAMERA BRIGHTNESS MONITOR (HOT-RELOAD ENABLED)")
-    print("="*60)
-    print(f"Settings reload: every {SETTINGS_RELOAD_INTERVAL}s")
-    print(f"Initial brightness threshold: {brightness_threshold}")
-    print(f"API cooldown: {API_COOLDOWN}s")
-    print("="*60 + "\n")
-
-    try:
+    features = CameraFeatures(brightness_threshold)
+    loudness = {}                    # the audio script's features, from store.env
+    fleet = FleetClient(FLEET_ADDRESS, cell=FLEET_CELL, on_recommend=venue_recommendation).start() \
+        if FLEET_ADDRESS else None
+    normalized_brightness = None     # latest value, flushed to store.env by a timer
+    last_zone_store = 0.0
+    last_info = ""
+    frames_seen = 0
+    fps_mark = (time.monotonic(), 0)
+    if trace:
+        trace.setting(time.time(), brightness_threshold)
+
+    # ---- timers ----
+    def reload_settings(now):
+        nonlocal brightness_threshold, loudness
+        new_threshold = load_brightness_threshold()
+        if trace and new_threshold != brightness_threshold:
+            trace.setting(now, new_threshold)
+        brightness_threshold = new_threshold
+        features.set_threshold(new_threshold)
+        store = open_env(STORE_ENV)
+        store.refresh()
+        loudness = loudness_from_store(store)
+        if os.path.exists(CALIBRATE_FILE):
+            os.remove(CALIBRATE_FILE)
+            _calibrate_requested.set()
+
+    def flush_store(now):
+        nonlocal last_zone_store
+        if normalized_brightness is not None:
+            update_store_brightness(normalized_brightness)
+        if now - last_zone_store >= ZONE_STORE_EVERY:
+            update_store_zones(zmap.summary())
+            last_zone_store = now
+
+    def publish_metrics(now):
+        nonlocal fps_mark
+        t, n = fps_mark
+        fps_mark = (time.monotonic(), frames_seen)
+        M_FPS.set((fps_mark[1] - n) / max(1e-6, fps_mark[0] - t))
+
+    mon.every(SETTINGS_RELOAD_INTERVAL, reload_settings, blocking=True, timeout=STORE_TIMEOUT_S)
+    mon.every(glare_params.flicker_check_every, zmap.update_flicker, name="zone_flicker")
+    mon.every(STORE_FLUSH_EVERY, flush_store, blocking=True, timeout=STORE_TIMEOUT_S)
+    mon.every(METRICS_EVERY, publish_metrics)
+
+    def send_fleet(now):
+        values = features.vector()
+        values.update(loudness)
+        fleet.send(values, down=glare.state == DOWN)
+
+    if fleet:
+        mon.every(FLEET_EVERY, send_fleet)
+
+    # ---- side effects ----
+    # A lock that outlives its deadline keeps running on the I/O pool; don't
+    # start another on top of it
+    calibrating = threading.Lock()
+
+    def calibrate():
+        nonlocal last_info
+        if not calibrating.acquire(blocking=False):
+            log.warning("⚠ Exposure lock still running, skipping")
+            return
+        try:
+            exp, gain, cg = lock_current_exposure_and_wb(picam2)
+            last_info = f"LOCKED exp={int(exp) if exp else '?'}us gain={f'{gain:.2f}' if gain else '?'}"
+        finally:
+            calibrating.release()
+
+    # ---- frames (capture thread) ----
+    def grab():
+        """Blocks for the next frame to analyse. In fast mode also returns the
+        flicker samples of the frames in between."""
+        t0 = time.perf_counter()
+        if not FLICKER_FAST_MODE:
+            frame, meta = capture_frame(picam2)
+            M_CAPTURE.observe(time.perf_counter() - t0)
+            return time.time(), frame, meta, ()
+        samples = []
         while True:
-            # Reload settings if due
-            now = time.time()
-            if now - last_settings_reload > SETTINGS_RELOAD_INTERVAL:
-                brightness_threshold = load_brightness_threshold()
-                last_settings_reload = now
-
-            frame = picam2.capture_array()
-            gray  = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            h, w = gray.shape
-            roi = gray[h//3:2*h//3, w//3:2*w//3]
-            inst_luma = float(np.mean(roi))
-
-            avg_ema = 0.6 * avg_ema + 0.4 * inst_luma
-            lum_buf.append((now, inst_luma))
+            sample_luma, frame, meta = capture_fast(picam2, len(samples) == FAST_DECIMATE - 1)
+            samples.append((time.time(), sample_luma))
+            if frame is not None:
+                M_CAPTURE.observe(time.perf_counter() - t0)
+                return samples[-1][0], frame, meta, samples
+
+    async def frame_loop():
+        nonlocal normalized_brightness, last_info, frames_seen
+        frame_idx = 0
+        fast_idx = 0
+        async for now, frame, meta, samples in mon.frames(grab):
+            t_frame = time.perf_counter()
+            for t, sample_luma in samples:
+                glare.sample(t, sample_luma)
+                if trace:
+                    trace.sample(fast_idx, t, sample_luma)
+                fast_idx += 1
+
+            # One pass: zone grid, centre ROI and peak (zone flicker is on a timer)
+            inst_luma = zmap.update(frame, now, flicker=False)
+            flags = 0
+
+            # Glare/visor state machine (EMA, flicker bias, hold, cooldown)
+            moved = glare.step(now, inst_luma, sample=not FLICKER_FAST_MODE)
+            if moved is not None:
+                visor.set(moved == DOWN)
+                flags |= F_FLIP | (F_FORCED if glare.forced else 0)
+                if history:
+                    history.event("visor", "down" if moved == DOWN else "up", now)
+            current_state = glare.state
+            avg_ema = glare.avg_ema
+            flicker_score = glare.flicker_score
 
             # Normalize brightness to 0-1 range (assuming 0-255 grayscale)
             normalized_brightness = avg_ema / 255.0
-            
-            # Update store.env continuously
-            update_store_brightness(normalized_brightness)
 
-            # Check threshold crossing
-            is_above_threshold = normalized_brightness > brightness_threshold
-            crossed_threshold = is_above_threshold != was_above_threshold
-            
-            if crossed_threshold and (now - last_api_call) > API_COOLDOWN:
-                print(f"\n🔔 Brightness threshold crossed! {normalized_brightness:.3f} vs {brightness_threshold:.3f}")
-                trigger_recommend_api()
-                last_api_call = now
-            
-            was_above_threshold = is_above_threshold
-
-            # flicker score
-            if now - last_flicker_check >= FLICKER_CHECK_EVERY:
-                ts = np.array([t for t,_ in lum_buf], dtype=np.float64)
-                xs = np.array([x for _,x in lum_buf], dtype=np.float32)
-                if len(ts) >= 2:
-                    t0 = ts[-1] - WIN_SEC
-                    keep = ts >= t0
-                    ts, xs = ts[keep], xs[keep]
-                flicker_score = compute_flicker_score(ts, xs)
-                last_flicker_check = now
-
-            upper = THRESHOLD + HYSTERESIS/2.0
-            lower = THRESHOLD - HYSTERESIS/2.0
-            upper_down = upper - BIAS_UPPER_PER_SCORE * flicker_score
-            lower_up   = lower + BIAS_LOWER_PER_SCORE * flicker_score
-
-            if flicker_score >= FLICKER_FORCE_T:
-                hold = MIN_DOWN_HOLD_S + EXTRA_HOLD_PER_SCORE * flicker_score
-                hold_until = max(hold_until, now + hold)
-                if current_state != "down" and (now - last_flip) > 0.1:
-                    notify_arduino(state_down=True)
-                    current_state = "down"
-                    last_flip = now
-
-            if os.path.exists("/tmp/calibrate"):
-                exp, gain, cg = lock_current_exposure_and_wb(picam2)
-                last_info = f"LOCKED exp={int(exp) if exp else '?'}us gain={gain:.2f if gain else '?'}"
-                os.remove("/tmp/calibrate")
-
-            if current_state == "up":
-                hi_cnt = hi_cnt + 1 if avg_ema >= upper_down else 0
-                if hi_cnt >= REQ_FRAMES and (now - last_flip) > COOLDOWN_S:
-                    notify_arduino(state_down=True)
-                    current_state = "down"
-                    last_flip = now
-            else:
-                can_release = now >= hold_until
-                lo_cnt = lo_cnt + 1 if avg_ema <= lower_up else 0
-                if can_release and lo_cnt >= REQ_FRAMES and (now - last_flip) > COOLDOWN_S:
-                    notify_arduino(state_down=False)
-                    current_state = "up"
-                    last_flip = now
+            # Recommend when the windowed features have moved, not on every crossing
+            features.add(now, inst_luma / 255.0, max(flicker_score, zmap.peak_flicker))
+            vector = features.vector()
+            vector.update(loudness)
+            if recommend.step(now, vector, features.span()):
+                log.info("🔔 Sensor features changed (distance %.1f): brightness %.3f, %.0f%% above %.3f, flicker %.2f",
+                         recommend.distance, vector["brightness"], vector["above_threshold"] * 100,
+                         brightness_threshold, vector["flicker"])
+                mon.fire("recommend", trigger_recommend_api, vector, timeout=RECOMMEND_TIMEOUT_S)
+                flags |= F_RECOMMEND
+                if history:
+                    history.event("features", f"{recommend.distance:.1f}", now)
+
+            if _calibrate_requested.is_set():
+                _calibrate_requested.clear()
+                mon.fire("calibrate", calibrate, timeout=CALIBRATE_TIMEOUT_S)
+                flags |= F_CALIBRATE
+
+            if trace:
+                flags |= F_DOWN if current_state == DOWN else 0
+                trace.frame(frame_idx, now, inst_luma, flicker_score, avg_ema, flags)
+            if history:
+                history.record_many({"brightness": normalized_brightness, "brightness_peak": zmap.peak / 255.0,
+                                     "flicker": flicker_score}, now)
+
+            M_ANALYSIS.observe(time.perf_counter() - t_frame)
+
+            if frame_idx == 0:
+                timeline.ready("visor_live")
+                preload("requests")
 
             if (frame_idx % PRINT_EVERY) == 0:
                 if not last_info:
-                    meta = picam2.capture_metadata()
                     exp  = meta.get("ExposureTime")
                     ag   = meta.get("AnalogueGain")
                     if exp and ag:
                         last_info = f"exp={int(exp)}us gain={ag:.2f}"
-                print(f"Bright={normalized_brightness:.3f} ({avg_ema:.1f})  Flicker={flicker_score:.2f}  State={current_state}  Threshold={brightness_threshold:.3f}  {last_info}")
+                log.info("Bright=%.3f (%.1f)  Peak=%.3f@%s  Flicker=%.2f/%.2f  State=%s  Threshold=%.3f  %s",
+                         normalized_brightness, avg_ema, zmap.peak / 255.0, zmap.peak_zone, flicker_score,
+                         zmap.peak_flicker, current_state, brightness_threshold, last_info,
+                         extra={"fields": {"frame": frame_idx, "brightness": normalized_brightness,
+                                           "peak": zmap.peak / 255.0, "flicker": flicker_score,
+                                           "state": current_state}})
                 last_info = ""
             frame_idx += 1
+            frames_seen = frame_idx
 
+    print("\n" + "="*60)
+    print("CAMERA BRIGHTNESS MONITOR (HOT-RELOAD ENABLED)")
+    print("="*60)
+    print(f"Settings reload: every {SETTINGS_RELOAD_INTERVAL}s")
+    print(f"Initial brightness threshold: {brightness_threshold}")
+    print(f"API cooldown: {API_COOLDOWN}s")
+    print(f"Glare settings: {GLARE_ENV if glare_params != GLARE_PARAMS else 'built-in defaults'}")
+    print(f"Sensor trace: {trace.path if trace else 'off'}")
+    print(f"Re-lock exposure/WB: kill -USR1 {os.getpid()}")
+    print("="*60 + "\n")
+
+    try:
+        mon.run(frame_loop())
     except KeyboardInterrupt:
         pass
     finally:
-        try:
-            notify_arduino(state_down=False)
-            time.sleep(0.1)
-        except Exception:
-            pass
+        # Visor up, after any servo move/strobe pulse still in progress
+        visor.stop(final=False)
         GPIO.cleanup()
         picam2.stop()
+        if trace:
+            trace.close()
+        if fleet:
+            fleet.close()
         print("\n✓ Camera processor stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Venue fleet link: compact UDP telemetry to the aggregator (Fleet/aggregator.py)
+and the zone recommendations it sends back.
+
+Every hat serves its own Flask app on :5000, so staff watching a venue would
+have to poll each one. With VYZ_FLEET=host:port set, the camera loop sends one
+44-byte datagram every FLEET_EVERY seconds instead, and the aggregator answers
+on the same socket (so it works through NAT and needs no port on the hat):
+
+    header     4s magic "VYZF", u8 version, u8 kind, u16 cell (row << 8 | col),
+               u32 seq, u32 device id                                   16 bytes
+    TELEMETRY  f32 brightness, flicker, above_threshold,
+                   loudness, loudness_p90, loud_fraction, u8 visor down  +28
+    RECOMMEND  u8 audio, u8 light (codes into AUDIO_PATTERNS /
+               LIGHT_PATTERNS), u8 level, u8 devices in the cell (capped),
+               f32 cell brightness, cell loudness, venue brightness,
+               venue loudness                                            +20
+
+UDP rather than a WebSocket: nothing to keep alive or reconnect on a hat
+that roams between access points, a lost datagram is replaced by the next
+one, and the aggregator needs no third-party server library. This file is
+the same in RPi/ and Jetson/ (check_shared.py); Fleet/ imports the RPi/ one.
+
+    VYZ_FLEET=10.0.0.5:9900 VYZ_FLEET_CELL=3,7 python camera_input.py
+"""
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+MAGIC   = b"VYZF"
+VERSION = 1
+HEADER    = struct.Struct("<4sBBHII")
+TELEMETRY = struct.Struct("<6fB3x")
+RECOMMEND = struct.Struct("<4B4f")
+
+KIND_TELEMETRY = 1
+KIND_RECOMMEND = 2
+
+FLEET_PORT  = 9900
+FLEET_EVERY = 1.0       # seconds between telemetry datagrams
+RESOLVE_RETRY_S = 5.0   # aggregator name lookups (fleet thread only)
+RESOLVE_EVERY_S = 300.0 # re-resolve a good address this often (DHCP moves)
+
+# Same order as recommender.py (the codes are what goes over the wire)
+AUDIO_PATTERNS = ("white_noise_calm", "white_noise_rain", "white_noise_ocean",
+                  "pink_noise_soft", "brown_noise_deep")
+LIGHT_PATTERNS = ("steady_warm", "steady_cool", "breathing_slow", "breathing_fast",
+                  "pulse_gentle", "off")
+LEVELS = ("calm", "elevated", "high")
+
+# Telemetry fields, in wire order
+FIELDS = ("brightness", "flicker", "above_threshold", "loudness", "loudness_p90", "loud_fraction")
+
+
+def parse_address(spec, default_port=FLEET_PORT):
+    """"host:port" (or "host") -> (host, port)"""
+    host, _, port = spec.rpartition(":") if ":" in spec else (spec, "", "")
+    return host, int(port) if port else default_port
+
+
+def parse_cell(spec):
+    """"row,col" -> wire cell (row << 8 | col)"""
+    try:
+        row, col = (int(v) for v in spec.split(","))
+    except ValueError:
+        return 0
+    return (max(0, min(255, row)) << 8) | max(0, min(255, col))
+
+
+def device_id(name=None):
+    """Stable 32-bit id: VYZ_DEVICE_ID if numeric, else a CRC of it or the hostname"""
+    name = name or os.getenv("VYZ_DEVICE_ID") or socket.gethostname()
+    return int(name) & 0xFFFFFFFF if name.isdigit() else zlib.crc32(name.encode())
+
+
+def pack_telemetry(device, seq, cell, values, down=False):
+    return HEADER.pack(MAGIC, VERSION, KIND_TELEMETRY, cell, seq & 0xFFFFFFFF, device) + \
+        TELEMETRY.pack(*(float(values.get(k) or 0.0) for k in FIELDS), 1 if down else 0)
+
+
+def pack_recommend(device, seq, cell, audio, light, level, devices, cell_b, cell_l, venue_b, venue_l):
+    return HEADER.pack(MAGIC, VERSION, KIND_RECOMMEND, cell, seq & 0xFFFFFFFF, device) + \
+        RECOMMEND.pack(audio, light, level, min(255, devices), cell_b, cell_l, venue_b, venue_l)
+
+
+def unpack_recommend(data):
+    """Recommendation dict from a datagram, None if it isn't one"""
+    if len(data) < HEADER.size + RECOMMEND.size:
+        return None
+    magic, version, kind, cell, seq, device = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or kind != KIND_RECOMMEND:
+        return None
+    audio, light, level, devices, cell_b, cell_l, venue_b, venue_l = RECOMMEND.unpack_from(data, HEADER.size)
+    if audio >= len(AUDIO_PATTERNS) or light >= len(LIGHT_PATTERNS):
+        return None
+    return {
+        "device": device, "seq": seq, "cell": (cell >> 8, cell & 0xFF),
+        "audio": AUDIO_PATTERNS[audio], "light": LIGHT_PATTERNS[light],
+        "level": LEVELS[min(level, len(LEVELS) - 1)], "devices": devices,
+        "cell_brightness": cell_b, "cell_loudness": cell_l,
+        "venue_brightness": venue_b, "venue_loudness": venue_l,
+    }
+
+
+class FleetClient:
+    """Sends telemetry without blocking; a thread resolves the aggregator's
+    address and hands recommendations to `on_recommend`"""
+
+    def __init__(self, address, device=None, cell=0, on_recommend=None):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.device = device_id() if device is None else device
+        self.cell = parse_cell(cell) if isinstance(cell, str) else cell
+        self.on_recommend = on_recommend
+        self.seq = 0
+        self.sent = 0
+        self.errors = 0
+        self.last = None            # latest recommendation
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._resolved = None       # last good (ip, port); only the fleet thread sets it
+        self._resolve_at = 0.0
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._recv, name="fleet", daemon=True)
+        self._thread.start()
+        return self
+
+    def send(self, values, down=False):
+        """One telemetry datagram; never blocks (a full buffer, a network
+        error or an address not resolved yet drops it)"""
+        target = self._resolved
+        try:
+            if target is None:
+                raise OSError("aggregator address not resolved yet")
+            self._sock.sendto(pack_telemetry(self.device, self.seq, self.cell, values, down), target)
+            self.sent += 1
+        except OSError:
+            self.errors += 1
+        self.seq += 1
+
+    def _resolve(self):
+        """Look the aggregator up (blocking DNS, fleet thread); keeps the last
+        good address when a lookup fails"""
+        now = time.monotonic()
+        if now < self._resolve_at:
+            return
+        try:
+            self._resolved = (socket.gethostbyname(self.address[0]), self.address[1])
+            self._resolve_at = now + RESOLVE_EVERY_S
+        except OSError:
+            self._resolve_at = now + RESOLVE_RETRY_S
+
+    def _recv(self):
+        import select
+
+        while not self._closed:
+            self._resolve()
+            try:
+                ready, _, _ = select.select([self._sock], [], [], 0.5)
+                if not ready:
+                    continue
+                data, _ = self._sock.recvfrom(256)
+            except OSError:
+                if self._closed:
+                    return
+                time.sleep(0.5)
+                continue
+            rec = unpack_recommend(data)
+            if rec is None or rec["device"] != self.device:
+                continue
+            self.last = rec
+            if self.on_recommend is not None:
+                try:
+                    self.on_recommend(rec)
+                except Exception as e:
+                    print(f"✗ Fleet recommendation handler failed: {e}")
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self._sock.close()
+
+
+def store_values(rec):
+    """store.env keys for a venue recommendation (shown by /get_store)"""
+    return {
+        "VENUE_AUDIO": rec["audio"], "VENUE_LIGHT": rec["light"], "VENUE_LEVEL": rec["level"],
+        "VENUE_BRIGHTNESS": f"{rec['cell_brightness']:.6f}", "VENUE_LOUDNESS": f"{rec['cell_loudness']:.6f}",
+    }
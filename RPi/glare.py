@@ -0,0 +1,442 @@
+"""
+Glare/visor state machine shared by the camera loops and the offline tools.
+
+The camera scripts feed one ROI luma value per frame into
+`GlareController.step()` and move the visor when it returns a new state.
+Replay (sensor_trace.py) and parameter search use `GlareController.run()` /
+`run_batch()` on whole recordings.
+
+All three go through the same kernel, `_scan()`: it advances the EMA,
+hysteresis counters, flicker bias, hold-until and cooldown for P parameter
+sets across T frames. `step()` is simply T=1, P=1. If Numba is installed,
+batch runs use a compiled copy of that kernel; the live loop always uses the
+plain one so start-up never waits on a JIT.
+"""
+from collections import deque
+from dataclasses import dataclass, fields, replace
+
+import numpy as np
+
+UP   = "up"
+DOWN = "down"
+
+# Same as the camera loop's lum_buf
+LUM_BUF_LEN = 1000
+
+# Flicker spectra are taken at the measured sample rate. (It used to be
+# clamped to 50 Hz, so 90-120 fps input was decimated without filtering and
+# strobes above the band aliased into it.)
+FLICKER_FS_MIN = 10.0
+FLICKER_FS_MAX = 240.0
+
+
+@dataclass(frozen=True)
+class GlareParams:
+    # Glare logic
+    threshold: float   = 55.0
+    hysteresis: float  = 10.0
+    req_frames: int    = 4
+    cooldown_s: float  = 0.8
+    ema_alpha: float   = 0.4
+    # Flashing/strobe detection
+    win_sec: float              = 2.0
+    flicker_check_every: float  = 0.10
+    band_lo_hz: float           = 3.0
+    band_hi_hz: float           = 15.0
+    flicker_force_t: float      = 0.35
+    min_down_hold_s: float      = 2.0
+    extra_hold_per_score: float = 3.0
+    bias_upper_per_score: float = 8.0
+    bias_lower_per_score: float = 4.0
+    force_min_flip_s: float     = 0.1
+
+    def with_(self, **kw):
+        return replace(self, **kw)
+
+    def flicker_key(self):
+        """Params that change the flicker score series (everything else is per-frame logic)"""
+        return (self.win_sec, self.flicker_check_every, self.band_lo_hz, self.band_hi_hz)
+
+
+# Kernel parameter columns, in _scan() argument order
+_KERNEL_FIELDS = ("threshold", "hysteresis", "req_frames", "cooldown_s", "ema_alpha",
+                  "flicker_force_t", "min_down_hold_s", "extra_hold_per_score",
+                  "bias_upper_per_score", "bias_lower_per_score", "force_min_flip_s")
+
+
+def compute_flicker_score(ts, xs, band_lo=3.0, band_hi=15.0):
+    if len(xs) < 20:
+        return 0.0
+    dur = ts[-1] - ts[0]
+    if dur < 0.8:
+        return 0.0
+
+    est_fs = max(FLICKER_FS_MIN, min(FLICKER_FS_MAX, len(xs) / dur))
+    band_hi = min(band_hi, 0.5 * est_fs)
+    t_uniform = np.linspace(ts[0], ts[-1], int(est_fs * dur), endpoint=True)
+    x_uniform = np.interp(t_uniform, ts, xs)
+
+    x = x_uniform - np.mean(x_uniform)
+    if np.max(np.abs(x)) < 1e-6:
+        return 0.0
+    w = np.hanning(len(x))
+    X = np.fft.rfft(x * w)
+    P = (np.abs(X) ** 2)
+    freqs = np.fft.rfftfreq(len(x), 1.0 / est_fs)
+
+    band = (freqs >= band_lo) & (freqs <= band_hi)
+    num = float(np.sum(P[band]))
+    den = float(np.sum(P[1:]) + 1e-9)
+    score = num / den
+    return float(np.clip(score, 0.0, 1.0))
+
+
+def window_flicker(ts, xs, p: GlareParams):
+    """Flicker score over the last `win_sec` of (up to LUM_BUF_LEN) samples"""
+    ts = np.asarray(ts, dtype=np.float64)
+    xs = np.asarray(xs, dtype=np.float32)
+    if len(ts) >= 2:
+        keep = ts >= ts[-1] - p.win_sec
+        ts, xs = ts[keep], xs[keep]
+    return compute_flicker_score(ts, xs, p.band_lo_hz, p.band_hi_hz)
+
+
+def flicker_series(ts, xs, p: GlareParams, last_check=0.0, score=0.0):
+    """Flicker score as the live loop sees it on every frame (recomputed every
+    `flicker_check_every`, held in between). Returns (scores, last_check)."""
+    ts = np.asarray(ts, dtype=np.float64)
+    xs = np.asarray(xs, dtype=np.float32)
+    out = np.empty(len(ts), dtype=np.float64)
+    every = p.flicker_check_every
+    for i, now in enumerate(ts.tolist()):
+        if now - last_check >= every:
+            lo = max(0, i + 1 - LUM_BUF_LEN)
+            score = window_flicker(ts[lo:i + 1], xs[lo:i + 1], p)
+            last_check = now
+        out[i] = score
+    return out, last_check
+
+
+def _scan(ts, xs, flick,
+          thr, hyst, req, cool, alpha, force_t, min_hold, hold_per_score,
+          bias_up, bias_lo, force_min_flip,
+          ema, state, hi, lo, last_flip, hold_until, forced,
+          flips, forced_flips, down_s, prev_t, out):
+    """Advance P parameter sets over T frames, in place.
+
+    ts/xs/flick: (T,) frame time, inst luma, flicker score.
+    Parameter and state arguments are (P,) arrays; state is 1 when down.
+    flips/forced_flips/down_s accumulate; prev_t (1,) is the previous frame time.
+    out is (P, T) uint8 to record the state after each frame, or (P, 0).
+
+    Plain scalar loops on purpose: with list arguments this is the cheapest
+    form for the live loop (T=P=1) in pure Python, and it is what Numba
+    compiles best for batch runs on arrays.
+    """
+    record = out.shape[1] > 0
+    for i in range(len(ts)):
+        now = ts[i]
+        x = xs[i]
+        score = flick[i]
+        dt = now - prev_t[0] if prev_t[0] >= 0.0 else 0.0
+        prev_t[0] = now
+
+        for j in range(len(ema)):
+            if state[j]:
+                down_s[j] += dt
+            e = (1.0 - alpha[j]) * ema[j] + alpha[j] * x
+            ema[j] = e
+            upper_down = thr[j] + hyst[j] / 2.0 - bias_up[j] * score
+            lower_up   = thr[j] - hyst[j] / 2.0 + bias_lo[j] * score
+
+            # Strobe: hold the visor down, and force it down if it isn't
+            if score >= force_t[j]:
+                hold_until[j] = max(hold_until[j], now + min_hold[j] + hold_per_score[j] * score)
+                if state[j] == 0 and (now - last_flip[j]) > force_min_flip[j]:
+                    state[j] = 1
+                    last_flip[j] = now
+                    forced[j] = True
+                    flips[j] += 1
+                    forced_flips[j] += 1
+
+            # Hysteresis on the EMA (each counter only advances in its own state)
+            if state[j] == 0:
+                hi[j] = hi[j] + 1 if e >= upper_down else 0
+                if hi[j] >= req[j] and (now - last_flip[j]) > cool[j]:
+                    state[j] = 1
+                    last_flip[j] = now
+                    forced[j] = False
+                    flips[j] += 1
+            else:
+                lo[j] = lo[j] + 1 if e <= lower_up else 0
+                if now >= hold_until[j] and lo[j] >= req[j] and (now - last_flip[j]) > cool[j]:
+                    state[j] = 0
+                    last_flip[j] = now
+                    forced[j] = False
+                    flips[j] += 1
+            if record:
+                out[j, i] = state[j]
+
+
+_scan_fast = _scan
+try:
+    from numba import njit
+    _scan_fast = njit(cache=True, nogil=True)(_scan)
+except ImportError:
+    pass
+
+
+def _columns(params_list):
+    return [np.array([getattr(p, f) for p in params_list], dtype=np.float64) for f in _KERNEL_FIELDS]
+
+
+# (field, dtype) of the per-parameter-set kernel state, in _scan() argument order
+_STATE_FIELDS = (("ema", np.float64), ("state", np.int64), ("hi", np.int64), ("lo", np.int64),
+                 ("last_flip", np.float64), ("hold_until", np.float64), ("forced", np.bool_),
+                 ("flips", np.int64), ("forced_flips", np.int64), ("down_s", np.float64))
+
+
+class _ScanState:
+    """Kernel state for P parameter sets (numpy arrays, or lists via as_lists())"""
+
+    def __init__(self, params_list, state=UP):
+        n = len(params_list)
+        self.ema        = np.array([p.threshold for p in params_list], dtype=np.float64)
+        self.state      = np.full(n, 1 if state == DOWN else 0, dtype=np.int64)
+        self.hi         = np.zeros(n, dtype=np.int64)
+        self.lo         = np.zeros(n, dtype=np.int64)
+        self.last_flip  = np.zeros(n, dtype=np.float64)
+        self.hold_until = np.zeros(n, dtype=np.float64)
+        self.forced     = np.zeros(n, dtype=np.bool_)
+        self.flips        = np.zeros(n, dtype=np.int64)
+        self.forced_flips = np.zeros(n, dtype=np.int64)
+        self.down_s       = np.zeros(n, dtype=np.float64)
+        self.prev_t       = np.full(1, -1.0)
+
+    def as_lists(self):
+        """Python lists are much cheaper than numpy scalars for T=P=1"""
+        for name, _ in _STATE_FIELDS + (("prev_t", None),):
+            setattr(self, name, getattr(self, name).tolist())
+        return self
+
+    def as_arrays(self):
+        for name, dtype in _STATE_FIELDS + (("prev_t", np.float64),):
+            setattr(self, name, np.asarray(getattr(self, name), dtype=dtype))
+        return self
+
+    def args(self):
+        return (self.ema, self.state, self.hi, self.lo, self.last_flip, self.hold_until,
+                self.forced, self.flips, self.forced_flips, self.down_s, self.prev_t)
+
+
+class GlareController:
+    def __init__(self, params: GlareParams = None, state=UP):
+        self.params = params or GlareParams()
+        self.reset(state)
+
+    def reset(self, state=UP):
+        self._cols = _columns([self.params])
+        self._cols_list = [c.tolist() for c in self._cols]
+        self._s = _ScanState([self.params], state).as_lists()
+        self._no_out = np.zeros((1, 0), dtype=np.uint8)
+        self._frame = [[0.0], [0.0], [0.0]]   # (t, luma, flicker) for step()
+        self.flicker_score = 0.0
+        self.last_flicker_check = 0.0
+        self.lum_buf = deque(maxlen=LUM_BUF_LEN)
+
+    # ---- current state (what the camera loop prints/traces) ----
+    @property
+    def state(self):
+        return DOWN if self._s.state[0] else UP
+
+    @property
+    def avg_ema(self):
+        return float(self._s.ema[0])
+
+    @property
+    def forced(self):
+        """Last flip was forced by the flicker detector"""
+        return bool(self._s.forced[0])
+
+    @property
+    def hi_cnt(self):
+        return int(self._s.hi[0])
+
+    @property
+    def lo_cnt(self):
+        return int(self._s.lo[0])
+
+    @property
+    def hold_until(self):
+        return float(self._s.hold_until[0])
+
+    @property
+    def flips(self):
+        return int(self._s.flips[0])
+
+    @property
+    def time_down_s(self):
+        return float(self._s.down_s[0])
+
+    def update_flicker(self, now):
+        ts = [t for t,_ in self.lum_buf]
+        xs = [x for _,x in self.lum_buf]
+        self.flicker_score = window_flicker(ts, xs, self.params)
+        self.last_flicker_check = now
+
+    def sample(self, now, luma):
+        """Add a flicker sample without stepping the state machine (fast
+        flicker-sampling mode feeds every sensor frame here)"""
+        self.lum_buf.append((now, luma))
+
+    def step(self, now, inst_luma, sample=True):
+        """Feed one frame. Returns UP/DOWN when the visor should move, else None.
+        `sample=False` when the flicker samples come from sample() instead."""
+        if sample:
+            self.lum_buf.append((now, inst_luma))
+        if now - self.last_flicker_check >= self.params.flicker_check_every:
+            self.update_flicker(now)
+
+        t, x, f = self._frame
+        t[0], x[0], f[0] = now, inst_luma, self.flicker_score
+        before = self._s.state[0]
+        _scan(t, x, f, *self._cols_list, *self._s.args(), self._no_out)
+        if self._s.state[0] != before:
+            return self.state
+        return None
+
+    def run(self, luma, timestamps):
+        """Feed a block of frames (same result as calling step() on each).
+        Returns the visor state after every frame (1 = down) as uint8."""
+        ts = np.asarray(timestamps, dtype=np.float64)
+        xs = np.asarray(luma, dtype=np.float64)
+        if len(ts) == 0:
+            return np.zeros(0, dtype=np.uint8)
+
+        # Flicker needs the samples already in lum_buf as history
+        hist_t = np.array([t for t,_ in self.lum_buf], dtype=np.float64)
+        hist_x = np.array([x for _,x in self.lum_buf], dtype=np.float64)
+        flick, self.last_flicker_check = flicker_series(
+            np.concatenate([hist_t, ts]), np.concatenate([hist_x, xs]),
+            self.params, self.last_flicker_check, self.flicker_score)
+        flick = flick[len(hist_t):]
+        self.flicker_score = float(flick[-1])
+        self.lum_buf.extend(zip(ts.tolist(), xs.tolist()))
+
+        out = np.zeros((1, len(ts)), dtype=np.uint8)
+        self._s.as_arrays()
+        _scan_fast(ts, xs, flick, *self._cols, *self._s.args(), out)
+        self._s.as_lists()
+        return out[0]
+
+
+def run_batch(luma, timestamps, params_list, record=False, flicker=None):
+    """Evaluate many parameter sets over one recording.
+
+    The flicker series is computed once per distinct (win_sec, check interval,
+    band) and shared; the state machine runs vectorized over the rest.
+    Returns dict of (P,) arrays: flips, forced_flips, time_down_s, and
+    `states` (P, T) uint8 when record=True. `flicker` may carry a cache dict
+    keyed by GlareParams.flicker_key() to reuse across calls."""
+    ts = np.asarray(timestamps, dtype=np.float64)
+    xs = np.asarray(luma, dtype=np.float64)
+    params_list = list(params_list)
+    n, T = len(params_list), len(ts)
+    flicker = {} if flicker is None else flicker
+
+    result = {"flips": np.zeros(n, dtype=np.int64),
+              "forced_flips": np.zeros(n, dtype=np.int64),
+              "time_down_s": np.zeros(n, dtype=np.float64)}
+    if record:
+        result["states"] = np.zeros((n, T), dtype=np.uint8)
+
+    groups = {}
+    for idx, p in enumerate(params_list):
+        groups.setdefault(p.flicker_key(), []).append(idx)
+
+    for key, idxs in groups.items():
+        if key not in flicker:
+            flicker[key] = flicker_series(ts, xs, params_list[idxs[0]])[0]
+        group = [params_list[i] for i in idxs]
+        s = _ScanState(group)
+        out = np.zeros((len(group), T if record else 0), dtype=np.uint8)
+        _scan_fast(ts, xs, flicker[key], *_columns(group), *s.args(), out)
+        result["flips"][idxs] = s.flips
+        result["forced_flips"][idxs] = s.forced_flips
+        result["time_down_s"][idxs] = s.down_s
+        if record:
+            result["states"][idxs] = out
+    return result
+
+
+# Tuned settings file written by tune_glare.py and read by the camera scripts
+GLARE_ENV  = "glare.env"
+ENV_PREFIX = "GLARE_"
+
+
+def params_to_env(p: GlareParams):
+    return {ENV_PREFIX + f.name.upper(): getattr(p, f.name) for f in fields(GlareParams)}
+
+
+def load_params(path=GLARE_ENV, base: GlareParams = None):
+    """Overlay GLARE_* keys from a dotenv file on `base` (missing file -> base)"""
+    import os
+    from dotenv import dotenv_values
+
+    base = base or GlareParams()
+    if not os.path.exists(path):
+        return base
+    values = dotenv_values(path)
+    kw = {}
+    for f in fields(GlareParams):
+        raw = values.get(ENV_PREFIX + f.name.upper())
+        if raw is not None:
+            kw[f.name] = int(float(raw)) if f.type in (int, "int") else float(raw)
+    return base.with_(**kw)
+
+
+def save_params(p: GlareParams, path=GLARE_ENV, comment=""):
+    """Write GLARE_* keys (temp file + rename, so readers never see half a file)"""
+    import os
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        for line in comment.splitlines():
+            f.write(f"# {line}\n")
+        for k, v in params_to_env(p).items():
+            f.write(f"{k}={v}\n")
+    os.replace(tmp, path)
+
+
+def param_grid(base: GlareParams = None, **axes):
+    """Cartesian product of parameter values, e.g. param_grid(hysteresis=[6, 8, 10])"""
+    import itertools
+
+    base = base or GlareParams()
+    names = list(axes)
+    known = {f.name for f in fields(GlareParams)}
+    for name in names:
+        if name not in known:
+            raise ValueError(f"Unknown glare parameter: {name}")
+    return [base.with_(**dict(zip(names, combo)))
+            for combo in itertools.product(*(axes[k] for k in names))]
+
+
+class RecommendTrigger:
+    """Fires /recommend when normalized brightness crosses the user threshold,
+    at most once per `cooldown_s`. The camera loops now use
+    features.ChangeTrigger; this one stays as the baseline replay and
+    `features.py --bench` compare against."""
+
+    def __init__(self, cooldown_s=5.0):
+        self.cooldown_s = cooldown_s
+        self.last_call = 0.0
+        self.was_above = False
+
+    def step(self, now, normalized_brightness, threshold):
+        is_above = normalized_brightness > threshold
+        fire = is_above != self.was_above and (now - self.last_call) > self.cooldown_s
+        if fire:
+            self.last_call = now
+        self.was_above = is_above
+        return fire
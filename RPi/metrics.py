@@ -0,0 +1,244 @@
+"""
+Low-overhead metrics shared by the camera, audio and server processes.
+
+Each component declares its counters/gauges/histograms once, at import time,
+on a Registry. `Registry.open()` lays them out in one preallocated float64
+array backed by a memory-mapped file in METRICS_DIR, so the hot path is a
+single in-memory add (no locks, no syscalls, no allocation) and any other
+process can read the values. The servers expose everything found in
+METRICS_DIR on /metrics in Prometheus text format via `render()`.
+
+Files are named <component>.<pid>.bin/.json. Readers drop the files of
+processes that have exited, and two live processes of one component are
+told apart by a pid label.
+
+Every metric has a single writer thread; readers may see a histogram that is
+one observation behind, which is fine for scraping.
+"""
+import json
+import mmap
+import os
+import tempfile
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+METRICS_DIR = os.getenv("VYZ_METRICS_DIR") or (
+    "/dev/shm/vyz-metrics" if os.path.isdir("/dev/shm")
+    else os.path.join(tempfile.gettempdir(), "vyz-metrics"))
+
+# Seconds; covers 0.5 ms audio callbacks up to multi-second GPT calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER   = "counter"
+GAUGE     = "gauge"
+HISTOGRAM = "histogram"
+
+
+class _Metric:
+    def __init__(self, registry, kind, name, help_text, labels, size):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labels = dict(labels or {})
+        self.offset = registry._size
+        self.size = size
+        registry._grow(size)
+        registry._metrics.append(self)
+
+    def schema(self):
+        return {"kind": self.kind, "name": self.name, "help": self.help,
+                "labels": self.labels, "offset": self.offset, "size": self.size}
+
+
+class Counter(_Metric):
+    def __init__(self, registry, name, help_text, labels=None):
+        super().__init__(registry, COUNTER, name, help_text, labels, 1)
+
+    def inc(self, n=1.0):
+        self.registry.data[self.offset] += n
+
+
+class Gauge(_Metric):
+    def __init__(self, registry, name, help_text, labels=None):
+        super().__init__(registry, GAUGE, name, help_text, labels, 1)
+
+    def set(self, v):
+        self.registry.data[self.offset] = v
+
+
+class Histogram(_Metric):
+    """Slots: one per bucket (non-cumulative) + overflow, then sum, then count"""
+
+    def __init__(self, registry, name, help_text, buckets=LATENCY_BUCKETS, labels=None):
+        self.bounds = tuple(float(b) for b in buckets)
+        super().__init__(registry, HISTOGRAM, name, help_text, labels, len(self.bounds) + 3)
+        self._sum = self.offset + len(self.bounds) + 1
+        self._count = self._sum + 1
+
+    def observe(self, v):
+        d = self.registry.data
+        d[self.offset + bisect_left(self.bounds, v)] += 1
+        d[self._sum] += v
+        d[self._count] += 1
+
+    def schema(self):
+        s = super().schema()
+        s["buckets"] = self.bounds
+        return s
+
+
+class Registry:
+    def __init__(self, component):
+        self.component = component
+        self._metrics = []
+        self._size = 0
+        # Process-local until open(), so metrics are always safe to update.
+        # A plain double buffer: item updates are far cheaper than numpy scalars.
+        self.data = array('d')
+        self.path = None
+        self._mm = None
+        self._opened = False
+
+    def _grow(self, size):
+        self._size += size
+        self.data.extend([0.0] * size)
+
+    # ---- declaration (module import time) ----
+    def counter(self, name, help_text, labels=None):
+        return Counter(self, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None):
+        return Gauge(self, name, help_text, labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None):
+        return Histogram(self, name, help_text, buckets, labels)
+
+    # ---- storage ----
+    def open(self, directory=METRICS_DIR):
+        """Allocate the shared array. Falls back to process-local memory if
+        METRICS_DIR isn't writable (then only this process's /metrics sees it)."""
+        if self._opened:
+            return self
+        self._opened = True
+        try:
+            os.makedirs(directory, exist_ok=True)
+            base = os.path.join(directory, f"{self.component}.{os.getpid()}")
+            nbytes = max(1, self._size) * 8
+            with open(base + ".bin", "w+b") as f:
+                f.truncate(nbytes)
+                self._mm = mmap.mmap(f.fileno(), nbytes)
+            shared = memoryview(self._mm).cast('d')
+            shared[:self._size] = self.data
+            self.data = shared
+            tmp = base + ".json.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"component": self.component, "pid": os.getpid(),
+                           "metrics": [m.schema() for m in self._metrics]}, f)
+            os.replace(tmp, base + ".json")
+            self.path = base
+        except OSError as e:
+            print(f"✗ Metrics for {self.component} are process-local: {e}")
+        _local[self.component] = self
+        return self
+
+    def snapshot(self):
+        return {"component": self.component,
+                "metrics": [m.schema() for m in self._metrics]}, np.frombuffer(self.data, dtype=np.float64).copy()
+
+
+# Registries opened in this process (always rendered, even without a file)
+_local = {}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True         # exists, owned by someone else
+    return True
+
+
+def _read_dir(directory):
+    """{(component, pid): (schema, data)}; removes the files of exited processes"""
+    out = {}
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+    except OSError:
+        return out
+    for n in names:
+        base = os.path.join(directory, n[:-5])
+        pid = n[:-5].rpartition(".")[2]
+        if not pid.isdigit() or not _pid_alive(int(pid)):
+            # Left behind by a process that has exited (or an older, pid-less layout)
+            for ext in (".json", ".bin"):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+            continue
+        try:
+            with open(base + ".json") as f:
+                schema = json.load(f)
+            data = np.fromfile(base + ".bin", dtype=np.float64)
+        except (OSError, ValueError):
+            continue
+        out[schema["component"], int(pid)] = (schema, data)
+    return out
+
+
+def _fmt_labels(labels, extra=None):
+    items = dict(labels)
+    if extra:
+        items.update(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items.items()) + "}"
+
+
+def _fmt(v):
+    v = float(v)
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def render(directory=METRICS_DIR):
+    """Prometheus text exposition of every registry in `directory` plus this process's"""
+    sources = _read_dir(directory)
+    for comp, reg in _local.items():
+        sources[comp, os.getpid()] = reg.snapshot()
+    processes = {}
+    for comp, _ in sources:
+        processes[comp] = processes.get(comp, 0) + 1
+
+    families = {}
+    for (comp, pid), (schema, data) in sorted(sources.items()):
+        source = {"component": comp}
+        if processes[comp] > 1:
+            source["pid"] = pid
+        for m in schema["metrics"]:
+            if m["offset"] + m["size"] > len(data):
+                continue
+            families.setdefault(m["name"], []).append((source, m, data))
+
+    lines = []
+    for name, series in families.items():
+        _, first, _ = series[0]
+        lines.append(f"# HELP {name} {first['help']}")
+        lines.append(f"# TYPE {name} {first['kind']}")
+        for source, m, data in series:
+            labels = dict(m["labels"], **source)
+            off, size = m["offset"], m["size"]
+            if m["kind"] != HISTOGRAM:
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt(data[off])}")
+                continue
+            counts = np.cumsum(data[off:off + size - 2])
+            for le, c in zip(list(m["buckets"]) + ["+Inf"], counts):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, {'le': le})} {_fmt(c)}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt(data[off + size - 2])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {_fmt(data[off + size - 1])}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+LLM recommender client for Flask.py's /recommend.
+
+The old handler rebuilt a ~40-line f-string prompt on every call, stripped
+markdown fences with a few split() passes and checked the answer with
+linear `in` scans of the pattern lists. Here:
+
+- everything that doesn't change between calls (pattern list, field
+  meanings, rules, reply format) is one terse system message built at
+  import; a call formats only a short line of readings, in a fixed field
+  order (one precomputed %-format when every field is known). The
+  request is about three quarters of the old prompt's text and the reply 40%
+  shorter. CPU is a wash: building is a little faster than the old
+  f-string, parsing about 1 us slower than the old split()/`in` checks
+  (it also maps codes and reports fallbacks). --bench prints all of it.
+- patterns are a compact enum: the prompt numbers them and the model
+  answers {"audio": 2, "light": 0, "reason": "..."}; fewer output tokens,
+  nothing to misspell. Pattern names are still accepted.
+- JSON mode (response_format json_object) when the API supports it, and a
+  strict parser either way: one json.loads of the slice from the first "{"
+  to the last "}" (so fences and chatter cost nothing extra). Anything that
+  isn't an object with audio or light is a RecommendError.
+- validation is a dict/set lookup, not a list scan; an unknown pattern
+  falls back to the default for that field and is reported
+
+VYZ_LLM_URL points the client at any OpenAI-compatible server instead of
+the openai package, e.g. the mock below for offline runs:
+
+    python recommender.py --mock-server              # http://127.0.0.1:8089/v1
+    VYZ_LLM_URL=http://127.0.0.1:8089/v1 python Flask.py
+
+Request-building/parsing overhead vs the old code, and a round trip
+through the mock in every reply style:
+    python recommender.py --bench
+    python recommender.py --selftest
+"""
+import json
+import operator
+import os
+import threading
+import time
+from collections import namedtuple
+
+from features import FEATURE_EMA_S, FEATURE_WINDOW_S
+
+AUDIO_PATTERNS = (
+    "white_noise_calm",
+    "white_noise_rain",
+    "white_noise_ocean",
+    "pink_noise_soft",
+    "brown_noise_deep",
+)
+LIGHT_PATTERNS = (
+    "steady_warm",
+    "steady_cool",
+    "breathing_slow",
+    "breathing_fast",
+    "pulse_gentle",
+    "off",
+)
+DEFAULT_AUDIO = "white_noise_calm"
+DEFAULT_LIGHT = "steady_warm"
+
+# name -> code; also the validation sets
+AUDIO_CODES = {name: i for i, name in enumerate(AUDIO_PATTERNS)}
+LIGHT_CODES = {name: i for i, name in enumerate(LIGHT_PATTERNS)}
+
+LLM_MODEL       = os.getenv("VYZ_LLM_MODEL", "gpt-3.5-turbo")
+LLM_URL         = os.getenv("VYZ_LLM_URL")          # OpenAI-compatible base URL (else the openai package)
+LLM_JSON_MODE   = os.getenv("VYZ_LLM_JSON", "1") != "0"
+LLM_TEMPERATURE = 0.7
+LLM_MAX_TOKENS  = 80        # {"audio": n, "light": n, "reason": one sentence}
+LLM_TIMEOUT_S   = 10.0
+MAX_REASON      = 200
+
+MOCK_PORT = 8089
+
+Recommendation = namedtuple("Recommendation", "audio light reason")
+
+
+class RecommendError(ValueError):
+    """The model's reply isn't a usable recommendation"""
+
+
+# (key, meaning) explained once in the static prompt; a call only sends key=value
+READING_FIELDS = (
+    ("brightness", "now"),
+    ("brightness_peak", "brightest zone (spot/stage light)"),
+    ("flicker", "now, 1 = strobing"),
+    ("amplitude", "loudness now"),
+    ("brightness_ema", f"exponential average, {FEATURE_EMA_S:g} s time constant"),
+    ("brightness_std", f"variability over the last {FEATURE_WINDOW_S:g} s window"),
+    ("above_threshold", "window share above threshold"),
+    ("threshold", "user's brightness threshold"),
+    ("flicker_avg", "window mean"),
+    ("flicker_peak", "window max"),
+    ("loudness_ema", "exponential average"),
+    ("loudness_p90", "window 90th pct"),
+    ("loud_fraction", "window share loud"),
+)
+_FIELD_FORMATS = tuple((key, key + "=%.2f") for key, _ in READING_FIELDS)
+# Usual case, every field known: one itemgetter and one %-format
+_ALL_FIELDS = operator.itemgetter(*(key for key, _ in READING_FIELDS))
+_ALL_FORMAT = " ".join(fmt for _, fmt in _FIELD_FORMATS)
+
+# features.py names -> the keys above (brightness and loudness are RollingWindow.ema,
+# flicker the window mean)
+FEATURE_KEYS = {"brightness": "brightness_ema", "flicker": "flicker_avg", "loudness": "loudness_ema"}
+
+SYSTEM_PROMPT = "\n".join([
+    "You are a calming environment assistant for a wearable that helps people "
+    "overwhelmed by bright, flickering or loud surroundings.",
+    "Pick the most soothing audio and light pattern for these sensor readings "
+    "(key=value, 0-1, missing = unknown):",
+    "; ".join(f"{key}: {meaning}" for key, meaning in READING_FIELDS),
+    "Audio: " + ", ".join(f"{i}={name}" for i, name in enumerate(AUDIO_PATTERNS)),
+    "Light: " + ", ".join(f"{i}={name}" for i, name in enumerate(LIGHT_PATTERNS)),
+    "Bright, a bright zone or flicker: warmer/dimmer light. Dark: brighter/cooler is fine. "
+    "Loud: calming, more white noise. Quiet: gentler. Sustained readings outweigh one. "
+    "Both 0.3-0.6: baseline calm.",
+    'JSON only: {"audio": <n>, "light": <n>, "reason": "<brief>"}',
+])
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def readings_line(readings):
+    """Compact user message: key=value for the known fields, in a fixed order"""
+    try:
+        return _ALL_FORMAT % _ALL_FIELDS(readings)
+    except (KeyError, TypeError):
+        return " ".join([fmt % readings[key] for key, fmt in _FIELD_FORMATS if readings.get(key) is not None])
+
+
+def build_messages(readings):
+    return [_SYSTEM_MESSAGE, {"role": "user", "content": readings_line(readings)}]
+
+
+def _lookup(names, codes):
+    """Everything the model may answer for a pattern -> its name: the code
+    (as a number or a digit string) or the name itself"""
+    table = {name: name for name in codes}
+    for i, name in enumerate(names):
+        table[i] = table[str(i)] = name
+    return table
+
+
+AUDIO_LOOKUP = _lookup(AUDIO_PATTERNS, AUDIO_CODES)
+LIGHT_LOOKUP = _lookup(LIGHT_PATTERNS, LIGHT_CODES)
+# JSON types a code or name can come as (not bool, which hashes like 0/1,
+# and not lists/objects, which don't hash)
+_KEY_TYPES = frozenset((int, str))
+
+
+def parse_response(text):
+    """(Recommendation, [fields that fell back to their default]) from the
+    model's reply; RecommendError if there's no JSON object in it"""
+    # One decode of the outermost {...}: a bare object, a fenced one or one
+    # with chatter around it all parse the same way
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise RecommendError("no JSON object in the reply")
+    try:
+        obj = json.loads(text if start == 0 and end == len(text) - 1 else text[start:end + 1])
+    except ValueError as e:
+        raise RecommendError(f"invalid JSON in the reply: {e}") from None
+    if type(obj) is not dict:
+        raise RecommendError("reply is not a JSON object")
+    a, l = obj.get("audio"), obj.get("light")
+    if a is None and l is None:
+        raise RecommendError("reply has neither audio nor light")
+
+    audio = AUDIO_LOOKUP.get(a) if type(a) in _KEY_TYPES else None
+    light = LIGHT_LOOKUP.get(l) if type(l) in _KEY_TYPES else None
+    reason = obj.get("reason")
+    reason = reason[:MAX_REASON] if type(reason) is str else ""
+    invalid = []
+    if audio is None:
+        audio = DEFAULT_AUDIO
+        invalid.append(f"audio={a!r}")
+    if light is None:
+        light = DEFAULT_LIGHT
+        invalid.append(f"light={l!r}")
+    return Recommendation(audio, light, reason), invalid
+
+
+def readings_from(values, features=None):
+    """store.env values plus features.py's vector -> the READING_FIELDS keys"""
+    if not features:
+        return dict(values)
+    # Features first, renamed where they'd clash with an instantaneous value
+    readings = dict(features)
+    for name, key in FEATURE_KEYS.items():
+        if name in readings:
+            readings[key] = readings.pop(name)
+    readings.update(values)
+    return readings
+
+
+class Recommender:
+    def __init__(self, openai=None, url=LLM_URL, api_key="", model=LLM_MODEL,
+                 json_mode=LLM_JSON_MODE, timeout=LLM_TIMEOUT_S):
+        """`openai`: callable returning the configured openai module (used
+        when no `url` is set); `url`: an OpenAI-compatible base URL"""
+        self._openai = openai
+        self.url = url.rstrip("/") if url else None
+        self.api_key = api_key
+        self.model = model
+        self.json_mode = json_mode
+        self.timeout = timeout
+        self._params = {"model": model, "temperature": LLM_TEMPERATURE, "max_tokens": LLM_MAX_TOKENS}
+        if json_mode:
+            self._params["response_format"] = {"type": "json_object"}
+
+    def ask(self, readings):
+        """The model's raw reply for these readings"""
+        messages = build_messages(readings)
+        if self.url:
+            return self._post(messages)
+        response = self._openai().ChatCompletion.create(messages=messages, request_timeout=self.timeout,
+                                                        **self._params)
+        return response['choices'][0]['message']['content'].strip()
+
+    def _post(self, messages):
+        import urllib.request
+
+        body = json.dumps(dict(self._params, messages=messages)).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        req = urllib.request.Request(f"{self.url}/chat/completions", body, headers)
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            reply = json.load(resp)
+        return reply["choices"][0]["message"]["content"].strip()
+
+    def recommend(self, readings):
+        """(Recommendation, invalid fields, raw reply)"""
+        raw = self.ask(readings)
+        rec, invalid = parse_response(raw)
+        return rec, invalid, raw
+
+
+# ---- Mock LLM server (offline tests) ----
+MOCK_STYLES = ("json", "names", "fenced", "chatty", "invalid", "garbage")
+
+
+def mock_reply(readings, style="json"):
+    """Deterministic stand-in for the model: glare/noise rules like server.py"""
+    bright = max(readings.get("brightness_ema", readings.get("brightness", 0.0)),
+                 readings.get("brightness_peak", 0.0) - 0.25)
+    loud = readings.get("loudness_p90", readings.get("amplitude", 0.0))
+    flicker = readings.get("flicker_peak", readings.get("flicker", 0.0))
+    light = "breathing_slow" if flicker > 0.35 else "steady_warm" if bright > 0.5 else "steady_cool"
+    audio = "brown_noise_deep" if loud > 0.5 else "white_noise_rain" if loud > 0.2 else "pink_noise_soft"
+    reason = f"brightness {bright:.2f}, loudness {loud:.2f}, flicker {flicker:.2f}"
+    if style == "names":
+        return json.dumps({"audio": audio, "light": light, "reason": reason})
+    obj = json.dumps({"audio": AUDIO_CODES[audio], "light": LIGHT_CODES[light], "reason": reason})
+    if style == "fenced":
+        return f"```json\n{obj}\n```"
+    if style == "chatty":
+        return f"Here is my recommendation:\n{obj}\nHope this helps!"
+    if style == "invalid":
+        return json.dumps({"audio": "jazz", "light": 42, "reason": reason})
+    if style == "garbage":
+        return "I'm sorry, I can't help with that."
+    return obj
+
+
+def parse_readings_line(line):
+    readings = {}
+    for part in line.split():
+        key, _, value = part.partition("=")
+        try:
+            readings[key] = float(value)
+        except ValueError:
+            pass
+    return readings
+
+
+def mock_server(port=MOCK_PORT, style="json", delay_s=0.0, host="127.0.0.1"):
+    """OpenAI-compatible /v1/chat/completions answering with mock_reply()"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = payload.get("messages") or [{}]
+            readings = parse_readings_line(messages[-1].get("content", ""))
+            if delay_s:
+                time.sleep(delay_s)
+            content = mock_reply(readings, self.server.style)
+            body = json.dumps({
+                "id": "mock", "object": "chat.completion", "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.style = style
+    return server
+
+
+# ---- Benchmark / self-test ----
+def _legacy_prompt(brightness, brightness_peak, flicker, amplitude, features):
+    """The prompt as Flask.py built it before this module"""
+    trends = ""
+    if "brightness" in features:
+        trends += f"""
+- Brightness, last {FEATURE_WINDOW_S:g} s: average {features['brightness']:.3f}, variability (std) {features.get('brightness_std', 0.0):.3f}, {features.get('above_threshold', 0.0) * 100:.0f}% of the time above the user's threshold {features.get('threshold', 0.5):.3f}
+- Flicker, last {FEATURE_WINDOW_S:g} s: average {features.get('flicker', 0.0):.2f}, worst {features.get('flicker_peak', 0.0):.2f}"""
+    if "loudness" in features:
+        trends += f"""
+- Loudness, last {FEATURE_WINDOW_S:g} s: average {features['loudness']:.3f}, 90th percentile {features.get('loudness_p90', 0.0):.3f}, {features.get('loud_fraction', 0.0) * 100:.0f}% of the time above the loud threshold"""
+    prompt = f"""Based on the current sensor readings, recommend the most soothing audio and light pattern.
+
+Current readings:
+- Brightness: {brightness:.3f} (0.0 = dark, 1.0 = very bright)
+- Brightest zone of the view: {brightness_peak:.3f} (a bright spot or stage light off-centre)
+- Flicker: {flicker:.2f} (0.0 = steady, 1.0 = strobing somewhere in view)
+- Amplitude: {amplitude:.3f} (0.0 = silent, 1.0 = very loud){trends}
+
+Available audio patterns: {', '.join(AUDIO_PATTERNS)}
+Available light patterns: {', '.join(LIGHT_PATTERNS)}
+
+Consider:
+- If brightness is high, use warmer/dimmer lights to reduce visual stimulation
+- If brightness is low, can use brighter/cooler lights
+- A high brightest-zone value or flicker means harsh or strobing light even if the average is moderate; treat it like high brightness
+- If amplitude is high (loud environment), use calming audio with more white noise
+- If amplitude is low (quiet environment), use gentler audio
+- Sustained conditions (time above threshold, the 90th percentile) matter more than a single reading; high variability means a changing or unsettled scene
+- Choose patterns that create a soothing, peaceful environment
+- When both brightness and amplitude are normal (around 0.3-0.6), recommend baseline calming settings
+
+Respond ONLY with valid JSON in this exact format:
+{{"audio": "pattern_name", "light": "pattern_name", "reason": "brief explanation"}}"""
+    return [{"role": "system", "content": "You are a calming environment assistant. Respond only with valid JSON."},
+            {"role": "user", "content": prompt}]
+
+
+def _legacy_parse(gpt_response):
+    if "```json" in gpt_response:
+        gpt_response = gpt_response.split("```json")[1].split("```")[0].strip()
+    elif "```" in gpt_response:
+        gpt_response = gpt_response.split("```")[1].split("```")[0].strip()
+    recommendation = json.loads(gpt_response)
+    if recommendation.get("audio") not in AUDIO_PATTERNS:
+        recommendation["audio"] = DEFAULT_AUDIO
+    if recommendation.get("light") not in LIGHT_PATTERNS:
+        recommendation["light"] = DEFAULT_LIGHT
+    return recommendation
+
+
+_SAMPLE_VALUES = {"brightness": 0.62, "brightness_peak": 0.81, "flicker": 0.12, "amplitude": 0.18}
+_SAMPLE_FEATURES = {"brightness": 0.6, "brightness_std": 0.04, "above_threshold": 0.7, "flicker": 0.1,
+                    "flicker_peak": 0.2, "threshold": 0.5, "loudness": 0.17, "loudness_p90": 0.24,
+                    "loud_fraction": 0.1}
+
+
+def _time(fn, runs):
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - t0) / runs
+
+
+def bench(runs=20000):
+    v, f = _SAMPLE_VALUES, _SAMPLE_FEATURES
+    readings = readings_from(v, f)
+    old_msgs = _legacy_prompt(v["brightness"], v["brightness_peak"], v["flicker"], v["amplitude"], f)
+    new_msgs = build_messages(readings)
+    old_reply = ("```json\n" + json.dumps({"audio": "white_noise_rain", "light": "steady_warm",
+                                           "reason": "Bright, moderately loud room"}) + "\n```")
+    new_reply = json.dumps({"audio": 1, "light": 0, "reason": "Bright, moderately loud room"})
+    fenced_reply = f"```json\n{new_reply}\n```"
+
+    rows = [
+        ("build request", _time(lambda: _legacy_prompt(v["brightness"], v["brightness_peak"], v["flicker"],
+                                                        v["amplitude"], f), runs),
+         _time(lambda: build_messages(readings_from(v, f)), runs)),
+        ("parse + validate", _time(lambda: _legacy_parse(old_reply), runs),
+         _time(lambda: parse_response(new_reply), runs)),
+        ("parse fenced reply", _time(lambda: _legacy_parse(old_reply), runs),
+         _time(lambda: parse_response(fenced_reply), runs)),
+    ]
+    print(f"{runs} runs")
+    print(f"  {'':<20} {'old':>10} {'new':>10}")
+    for name, old, new in rows:
+        print(f"  {name:<20} {old * 1e6:>7.2f} us {new * 1e6:>7.2f} us")
+    per_call = lambda msgs: sum(len(m["content"]) for m in msgs)
+    print(f"  request text per call: old {per_call(old_msgs)} chars, "
+          f"new {per_call(new_msgs)} chars ({len(SYSTEM_PROMPT)} system prompt, "
+          f"{len(new_msgs[1]['content'])} readings)")
+    print(f"  reply: old {len(old_reply)} chars, new {len(new_reply)} chars")
+
+
+def selftest():
+    """Round trips through the mock server in every reply style"""
+    server = mock_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Recommender(url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    readings = readings_from(_SAMPLE_VALUES, _SAMPLE_FEATURES)
+    ok = True
+    for style in MOCK_STYLES:
+        server.style = style
+        t0 = time.perf_counter()
+        try:
+            rec, invalid, raw = client.recommend(readings)
+            result = f"{rec.audio} / {rec.light}" + (f"  (defaulted {', '.join(invalid)})" if invalid else "")
+            passed = style != "garbage" and bool(invalid) == (style == "invalid")
+        except RecommendError as e:
+            result = f"RecommendError: {e}"
+            passed = style == "garbage"
+        ok &= passed
+        print(f"  {'✓' if passed else '✗'} {style:<8} {(time.perf_counter() - t0) * 1e3:6.1f} ms  {result}")
+    server.shutdown()
+    print(f"{'✓' if ok else '✗'} recommender self-test")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='LLM recommender client')
+    parser.add_argument('--bench', action='store_true', help='Request building/parsing cost vs the old code')
+    parser.add_argument('--selftest', action='store_true', help='Round trips through the mock server')
+    parser.add_argument('--mock-server', action='store_true', help='Serve a mock OpenAI-compatible API')
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    parser.add_argument('--style', choices=MOCK_STYLES, default="json", help='Mock reply style')
+    parser.add_argument('--delay', type=float, default=0.0, help='Mock reply latency in seconds')
+    args = parser.parse_args()
+
+    if args.bench:
+        bench()
+    elif args.selftest:
+        sys.exit(0 if selftest() else 1)
+    elif args.mock_server:
+        server = mock_server(args.port, args.style, args.delay)
+        print(f"Mock LLM on http://127.0.0.1:{args.port}/v1 ({args.style} replies)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        parser.print_help()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Sensor traces: compact append-only recordings of what the camera (and audio)
+loops saw, plus deterministic replay through the glare state machine.
+
+File format (little endian):
+    header  b"VYZT" + u16 version + u16 record size
+    records fixed 32 bytes: u8 kind, u8 flags, u16 reserved, u32 seq,
+                            f64 t, f64 a, f32 b, f32 c
+
+    KIND_FRAME    a=inst luma     b=flicker score  c=avg_ema   flags=state|events
+                  (t and a are full precision so replay is bit-for-bit)
+    KIND_AUDIO    a=chunk rms     b=chunk peak     c=gain reduction dB
+    KIND_SETTING  a=brightness threshold (written on change)
+    KIND_SAMPLE   a=ROI luma of a fast flicker-sampling frame (only in that mode;
+                  frames then don't add their own flicker sample)
+
+Files are only ever appended to, so a crash loses at most the unflushed batch
+and a torn last record is ignored on read. A file is closed at ROTATE_BYTES;
+on each rotation the writer deletes the least recently written traces in
+its directory until they total under TRACE_MAX_BYTES (VYZ_TRACE_MAX_MB).
+
+Replay (faster than real time):
+    python sensor_trace.py replay traces/*.vyzt --hysteresis 8 --req-frames 3
+"""
+import glob
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from glare import GlareController, GlareParams, RecommendTrigger, DOWN
+from features import CameraFeatures, ChangeTrigger, LoudnessFeatures
+
+MAGIC   = b"VYZT"
+VERSION = 1
+HEADER  = struct.Struct("<4sHH")
+RECORD  = struct.Struct("<BBHIddff")
+
+KIND_FRAME   = 1
+KIND_AUDIO   = 2
+KIND_SETTING = 3
+KIND_SAMPLE  = 4
+
+# Frame record flags
+F_DOWN      = 0x01   # visor state after this frame
+F_FLIP      = 0x02   # visor moved on this frame
+F_FORCED    = 0x04   # ...because of the flicker detector
+F_RECOMMEND = 0x08   # /recommend was triggered
+F_CALIBRATE = 0x10   # exposure/WB were re-locked
+
+TRACE_DIR      = "traces"
+FLUSH_EVERY_S  = 0.5           # write batch to the OS
+FSYNC_EVERY_S  = 5.0           # make it durable
+ROTATE_BYTES   = 64 * 1024 * 1024
+TRACE_MAX_BYTES = int(float(os.getenv("VYZ_TRACE_MAX_MB", "512")) * 1024 * 1024)   # all traces in the directory
+
+RECORD_DTYPE = np.dtype([("kind", "u1"), ("flags", "u1"), ("_pad", "<u2"), ("seq", "<u4"),
+                         ("t", "<f8"), ("a", "<f8"), ("b", "<f4"), ("c", "<f4")])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+class TraceWriter:
+    """Hot path packs one record into a deque; a background thread appends
+    batches to disk and fsyncs every FSYNC_EVERY_S."""
+
+    def __init__(self, source, directory=TRACE_DIR, max_bytes=TRACE_MAX_BYTES):
+        self.source = source
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._q = deque()
+        self._f = None
+        self._written = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.path = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._rotate()
+        self._thread = threading.Thread(target=self._run, name=f"trace-{self.source}", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._drain(fsync=True)
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    # ---- hot path ----
+    def frame(self, seq, t, inst_luma, flicker, avg_ema, flags):
+        self._q.append(RECORD.pack(KIND_FRAME, flags, 0, seq, t, inst_luma, flicker, avg_ema))
+
+    def audio(self, seq, t, rms, peak, gain_reduction_db=0.0):
+        self._q.append(RECORD.pack(KIND_AUDIO, 0, 0, seq, t, rms, peak, gain_reduction_db))
+
+    def sample(self, seq, t, luma):
+        self._q.append(RECORD.pack(KIND_SAMPLE, 0, 0, seq, t, luma, 0.0, 0.0))
+
+    def setting(self, t, brightness_threshold):
+        self._q.append(RECORD.pack(KIND_SETTING, 0, 0, 0, t, brightness_threshold, 0.0, 0.0))
+
+    # ---- background ----
+    def _rotate(self):
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(self.directory, f"{self.source}-{stamp}-{os.getpid()}.vyzt")
+        self._f = open(self.path, "ab")
+        self._f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._written = HEADER.size
+
+    def _prune(self):
+        """Delete the least recently written traces (any source) over max_bytes"""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.vyzt")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == self.path:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _drain(self, fsync=False):
+        if self._f is None:
+            return
+        batch = []
+        q = self._q
+        while q:
+            batch.append(q.popleft())
+        if batch:
+            data = b"".join(batch)
+            self._f.write(data)
+            self._written += len(data)
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+        if self._written >= ROTATE_BYTES:
+            self._rotate()
+            self._prune()
+
+    def _run(self):
+        self._prune()
+        last_sync = time.monotonic()
+        while not self._stop.wait(FLUSH_EVERY_S):
+            now = time.monotonic()
+            sync = now - last_sync >= FSYNC_EVERY_S
+            try:
+                self._drain(fsync=sync)
+            except OSError as e:
+                print(f"✗ Trace write failed ({self.path}): {e}")
+            if sync:
+                last_sync = now
+
+
+def read_trace(path):
+    """Records of one file as a numpy structured array (torn tail dropped)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if len(raw) < HEADER.size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    magic, version, size = HEADER.unpack_from(raw)
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError(f"{path}: not a v{VERSION} sensor trace")
+    body = raw[HEADER.size:]
+    n = len(body) // RECORD.size
+    return np.frombuffer(body, dtype=RECORD_DTYPE, count=n)
+
+
+def load_traces(paths):
+    """Merge several traces (camera + audio) into one time-ordered array"""
+    arrays = [read_trace(p) for p in paths]
+    if not arrays:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    recs = np.concatenate(arrays)
+    return recs[np.argsort(recs["t"], kind="stable")]
+
+
+def replay(recs, params: GlareParams = None, brightness_threshold=0.5, api_cooldown=5.0):
+    """Drive the glare controller and recommend trigger from a recording.
+
+    Returns summary stats plus how often the replayed visor state disagrees
+    with the recorded one (0 when params match the recording), and how many
+    /recommend calls the old threshold-crossing trigger would have made."""
+    ctl = GlareController(params)
+    trigger = ChangeTrigger(api_cooldown)
+    features = CameraFeatures(brightness_threshold)
+    loudness = LoudnessFeatures()
+    crossing = RecommendTrigger(api_cooldown)
+    flips = forced = recommends = crossings = mismatches = frames = 0
+    down_s = 0.0
+    prev_t = None
+    # Recorded in fast flicker-sampling mode: flicker comes from the samples
+    fast = bool(np.any(recs["kind"] == KIND_SAMPLE))
+
+    for kind, flags, t, a in zip(recs["kind"].tolist(), recs["flags"].tolist(),
+                                 recs["t"].tolist(), recs["a"].tolist()):
+        if kind == KIND_SETTING:
+            brightness_threshold = a
+            features.set_threshold(a)
+            continue
+        if kind == KIND_AUDIO:
+            loudness.add(t, a)
+            continue
+        if kind == KIND_SAMPLE:
+            ctl.sample(t, a)
+            continue
+        if kind != KIND_FRAME:
+            continue
+        if prev_t is not None and ctl.state == DOWN:
+            down_s += t - prev_t
+        prev_t = t
+        frames += 1
+
+        moved = ctl.step(t, a, sample=not fast)
+        if moved is not None:
+            flips += 1
+            forced += ctl.forced
+        features.add(t, a / 255.0, ctl.flicker_score)
+        vector = features.vector()
+        vector.update(loudness.vector())
+        recommends += trigger.step(t, vector, features.span())
+        crossings += crossing.step(t, ctl.avg_ema / 255.0, brightness_threshold)
+        mismatches += (ctl.state == DOWN) != bool(flags & F_DOWN)
+
+    dur = float(recs["t"][-1] - recs["t"][0]) if len(recs) else 0.0
+    return {
+        "frames": frames,
+        "duration_s": dur,
+        "flips": flips,
+        "forced_flips": forced,
+        "recommends": recommends,
+        "recommends_crossing": crossings,
+        "time_down_s": down_s,
+        "state_mismatch_frames": mismatches,
+    }
+
+
+def _expand(patterns):
+    paths = []
+    for p in patterns:
+        paths.extend(sorted(glob.glob(p)) or [p])
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sensor trace tools')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    info = sub.add_parser('info', help='Summarize trace files')
+    info.add_argument('paths', nargs='+')
+
+    rp = sub.add_parser('replay', help='Replay traces through the glare state machine')
+    rp.add_argument('paths', nargs='+')
+    defaults = GlareParams()
+    rp.add_argument('--threshold', type=float, default=defaults.threshold)
+    rp.add_argument('--hysteresis', type=float, default=defaults.hysteresis)
+    rp.add_argument('--req-frames', type=int, default=defaults.req_frames)
+    rp.add_argument('--cooldown', type=float, default=defaults.cooldown_s)
+    rp.add_argument('--flicker-force-t', type=float, default=defaults.flicker_force_t)
+    rp.add_argument('--brightness-threshold', type=float, default=0.5)
+
+    args = parser.parse_args()
+    recs = load_traces(_expand(args.paths))
+
+    if args.cmd == 'info':
+        kinds = {KIND_FRAME: "frame", KIND_AUDIO: "audio", KIND_SETTING: "setting", KIND_SAMPLE: "sample"}
+        dur = float(recs["t"][-1] - recs["t"][0]) if len(recs) else 0.0
+        print(f"{len(recs)} records over {dur:.1f} s")
+        for k, name in kinds.items():
+            print(f"  {name:<8} {int(np.sum(recs['kind'] == k))}")
+    else:
+        params = GlareParams(threshold=args.threshold, hysteresis=args.hysteresis,
+                             req_frames=args.req_frames, cooldown_s=args.cooldown,
+                             flicker_force_t=args.flicker_force_t)
+        t0 = time.perf_counter()
+        stats = replay(recs, params, args.brightness_threshold)
+        wall = time.perf_counter() - t0
+        for k, v in stats.items():
+            print(f"  {k:<22} {v:.2f}" if isinstance(v, float) else f"  {k:<22} {v}")
+        if wall > 0:
+            print(f"  replayed {stats['duration_s']:.1f} s of data in {wall:.2f} s "
+                  f"({stats['duration_s'] / wall:.0f}x real time)")
@@ -0,0 +1,199 @@
+"""
+Background owner of the Arduino UART used by Flask.py.
+
+- Never blocks the caller: the port is found and opened on a worker thread,
+  writes are queued and the newest frame wins.
+- Remembers the last good port (and its USB hwid, so ttyACM0 -> ttyACM1 renames
+  still hit) plus the reset guard that worked, in SERIAL_CACHE, so a warm start
+  tries that port first instead of probing every candidate.
+- If the Arduino drops, the worker reconnects with exponential backoff.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+from metrics import Registry
+
+SERIAL_CACHE = "serial_cache.json"
+
+CANDIDATE_PORTS = [
+    '/dev/serial0', '/dev/ttyAMA0', '/dev/ttyS0',
+    '/dev/ttyACM0', '/dev/ttyUSB0'
+]
+
+BAUDRATE        = 9600
+RESET_GUARD_S   = 2.0    # Arduino auto-resets when the port opens
+BACKOFF_START_S = 0.5
+BACKOFF_MAX_S   = 30.0
+LIVENESS_S      = 1.0    # how often an idle link checks its device node
+
+metrics = Registry("serial")
+M_WRITE      = metrics.histogram("vyz_serial_write_seconds", "Arduino frame write + flush time")
+M_RECONNECTS = metrics.counter("vyz_serial_reconnects_total", "Times the Arduino link dropped")
+
+# Link states (reported by /health)
+CONNECTING   = "connecting"
+CONNECTED    = "connected"
+DISCONNECTED = "disconnected"
+
+
+def load_cache(path=SERIAL_CACHE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(info, path=SERIAL_CACHE):
+    """Write the cache via temp file + rename so a crash never leaves half a file"""
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"✗ [UART] Could not write {path}: {e}")
+
+
+class SerialLink:
+    def __init__(self, cache_path=SERIAL_CACHE, baudrate=BAUDRATE):
+        self.cache_path = cache_path
+        self.baudrate = baudrate
+        self.state = CONNECTING
+        self.port = None
+        self._ser = None
+        self._pending = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    # ---------- public API (safe to call from request handlers) ----------
+    def start(self):
+        if self._thread is None:
+            metrics.open()
+            self._thread = threading.Thread(target=self._run, name="serial-link", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._close()
+
+    @property
+    def connected(self):
+        return self.state == CONNECTED
+
+    def write(self, frame: bytes):
+        """Queue a frame for the Arduino (delivered once the link is up).
+        Returns False if the link is not up right now."""
+        with self._cond:
+            self._pending = frame
+            self._cond.notify_all()
+        return self.connected
+
+    def status(self):
+        return {"state": self.state, "port": self.port, "baudrate": self.baudrate}
+
+    # ---------- worker ----------
+    def _candidates(self, cache):
+        from serial.tools import list_ports
+
+        ports = list_ports.comports()
+        detected = [p.device for p in ports]
+        order = []
+        # 1. cached hwid (survives device renumbering), 2. cached path
+        if cache.get("hwid"):
+            order += [p.device for p in ports if p.hwid == cache["hwid"]]
+        if cache.get("port"):
+            order.append(cache["port"])
+        order += CANDIDATE_PORTS + detected
+
+        seen = set()
+        for c in order:
+            if c and c not in seen and (glob.glob(c) or c in detected):
+                seen.add(c)
+                yield c, next((p.hwid for p in ports if p.device == c), None)
+
+    def _open(self):
+        import serial
+
+        cache = load_cache(self.cache_path)
+        guard = float(cache.get("reset_guard_s", RESET_GUARD_S))
+        for port, hwid in self._candidates(cache):
+            try:
+                s = serial.Serial(port, baudrate=self.baudrate, timeout=1, write_timeout=1)
+            except Exception:
+                continue
+            # Wait out the Arduino reset without holding any lock
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop, timeout=guard)
+            s.reset_input_buffer()
+            self._ser, self.port = s, port
+            save_cache({"port": port, "hwid": hwid, "baudrate": self.baudrate,
+                        "reset_guard_s": guard}, self.cache_path)
+            print(f"[UART] Connected on {port}")
+            return True
+        return False
+
+    def _close(self):
+        s, self._ser = self._ser, None
+        if s is not None:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _alive(self):
+        return self._ser is not None and self.port is not None and os.path.exists(self.port)
+
+    def _run(self):
+        backoff = BACKOFF_START_S
+        while not self._stop:
+            if self._ser is None:
+                self.state = CONNECTING
+                if self._open():
+                    self.state = CONNECTED
+                    backoff = BACKOFF_START_S
+                else:
+                    self.state = DISCONNECTED
+                    with self._cond:
+                        self._cond.wait_for(lambda: self._stop, timeout=backoff)
+                    backoff = min(BACKOFF_MAX_S, backoff * 2)
+                    continue
+
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or self._pending is not None,
+                                    timeout=LIVENESS_S)
+            if self._stop:
+                break
+
+            if not self._alive():
+                # Leave the pending frame for the reconnected port
+                print(f"✗ [UART] Lost {self.port}; reconnecting")
+                M_RECONNECTS.inc()
+                self._close()
+                continue
+
+            with self._cond:
+                frame, self._pending = self._pending, None
+            if frame is None:
+                continue
+            try:
+                t0 = time.perf_counter()
+                self._ser.write(frame)
+                self._ser.flush()
+                M_WRITE.observe(time.perf_counter() - t0)
+            except Exception as e:
+                print(f"✗ [UART] Write failed on {self.port}: {e}; reconnecting")
+                M_RECONNECTS.inc()
+                self._close()
+                with self._cond:
+                    if self._pending is None:
+                        self._pending = frame  # resend once the link is back
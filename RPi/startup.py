@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Start-up timeline for the entry points (camera, audio, servers).
+
+Entry points call `timeline.mark("phase")` as they come up and `timeline.ready()`
+once they are doing their real job (for the camera scripts: visor control live).
+Times are measured from *process* start (not from this import), so interpreter
+and import cost are included.
+
+    VYZ_STARTUP_REPORT=1  print the phase table when ready() is reached
+    VYZ_STARTUP_EXIT=1    print the timeline as one JSON line and exit at ready()
+
+Benchmark (fails if the median is over budget):
+    python startup.py camera_input.py --runs 5 --budget-ms 1500          # RPi
+    python startup.py jetson_camera_input.py --runs 5 --budget-ms 1500   # Jetson
+"""
+import json
+import os
+import sys
+import time
+
+# Visor control must be live within this many ms of process start
+STARTUP_BUDGET_MS = 1500.0
+
+READY = "ready"
+
+
+def _process_age_s():
+    """Seconds since this process was started (Linux, 1 clock tick resolution), else 0"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 (starttime, in clock ticks since boot); comm may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return max(0.0, time.clock_gettime(time.CLOCK_BOOTTIME) - started)
+    except Exception:
+        return 0.0
+
+
+def rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+        return resident * os.sysconf("SC_PAGE_SIZE") // 1024
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StartupTimeline:
+    def __init__(self):
+        # Anchor a monotonic clock to process start so marks are cheap and steady
+        self._mono0 = time.monotonic() - _process_age_s()
+        self.phases = []   # (name, ms since process start, delta ms, rss kB)
+        self.mark("imports")
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self._mono0) * 1000.0
+
+    def mark(self, name):
+        t = self.elapsed_ms()
+        prev = self.phases[-1][1] if self.phases else 0.0
+        self.phases.append((name, t, t - prev, rss_kb()))
+        return t
+
+    def report(self):
+        print("\n" + "="*60)
+        print("START-UP TIMELINE (since process start)")
+        print("="*60)
+        for name, t, dt, rss in self.phases:
+            print(f"  {name:<24} {t:9.1f} ms  (+{dt:7.1f})  RSS {rss/1024:6.1f} MB")
+        print("="*60 + "\n")
+
+    def to_json(self):
+        return json.dumps({"phases": [
+            {"name": n, "ms": round(t, 2), "delta_ms": round(dt, 2), "rss_kb": rss}
+            for n, t, dt, rss in self.phases]})
+
+    def ready(self, name=READY):
+        self.mark(name)
+        if os.getenv("VYZ_STARTUP_EXIT"):
+            print(self.to_json(), flush=True)
+            os._exit(0)
+        if os.getenv("VYZ_STARTUP_REPORT"):
+            self.report()
+
+
+timeline = StartupTimeline()
+
+
+def preload(*modules):
+    """Import modules on a daemon thread so their first real use doesn't stall a hot loop"""
+    import importlib
+    import threading
+
+    def _load():
+        for m in modules:
+            try:
+                importlib.import_module(m)
+            except Exception as e:
+                print(f"✗ Preload of {m} failed: {e}")
+    threading.Thread(target=_load, name="preload", daemon=True).start()
+
+
+def bench(entry, runs=5, budget_ms=STARTUP_BUDGET_MS, args=()):
+    """Launch `entry` `runs` times and check median time-to-ready against budget"""
+    import statistics
+    import subprocess
+
+    env = dict(os.environ, VYZ_STARTUP_EXIT="1")
+    readies = []
+    for i in range(runs):
+        out = subprocess.run([sys.executable, entry, *args], env=env, timeout=60,
+                             capture_output=True, text=True)
+        line = next((l for l in reversed(out.stdout.splitlines()) if l.startswith('{"phases"')), None)
+        if line is None:
+            print(f"✗ Run {i}: {entry} never reached ready (exit {out.returncode})")
+            print(out.stderr[-2000:])
+            return False
+        phases = json.loads(line)["phases"]
+        readies.append(phases[-1]["ms"])
+        slowest = max(phases[1:] or phases, key=lambda p: p["delta_ms"])
+        print(f"  run {i}: ready at {phases[-1]['ms']:.1f} ms  "
+              f"(slowest phase: {slowest['name']} +{slowest['delta_ms']:.1f} ms, "
+              f"RSS {phases[-1]['rss_kb']/1024:.1f} MB)")
+
+    median = statistics.median(readies)
+    ok = median <= budget_ms
+    print(f"{'✓' if ok else '✗'} {entry}: median ready {median:.1f} ms (budget {budget_ms:.0f} ms)")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Start-up time benchmark')
+    parser.add_argument('entry', help='Entry point script, e.g. camera_input.py or jetson_camera_input.py')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS)
+    args, rest = parser.parse_known_args()
+
+    sys.exit(0 if bench(args.entry, args.runs, args.budget_ms, rest) else 1)
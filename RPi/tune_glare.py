@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Parameter search for the glare/flicker logic (glare.py).
+
+Scores parameter sets over labeled luma traces -- synthetic venue scenarios
+and/or recorded sensor traces -- on every core, then writes the best set to
+glare.env, which the camera scripts load at start-up.
+
+Labels are intervals where the visor *should* be down:
+    {"glare": [[t0, t1], ...], "strobe": [[t0, t1], ...]}
+For a recorded trace `x.vyzt` they are read from `x.labels.json`.
+
+Objectives (lower is better, combined with --w-* weights):
+    latency      mean time from event start to visor down (miss = event length, capped)
+    false/h      visor-down moves outside any labeled event, per hour
+    strobe_miss  fraction of strobe time the visor was up
+    idle_down    fraction of unlabeled time the visor was down
+
+    python tune_glare.py                                  # synthetic scenarios, default grid
+    python tune_glare.py --trace traces/venue.vyzt --grid hysteresis=4:16:7 req_frames=2,3,4
+    python tune_glare.py --search bayes --trials 400      # needs optuna
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from glare import GLARE_ENV, load_params, param_grid, run_batch, save_params
+
+MISS_PENALTY_CAP_S = 5.0
+
+DEFAULT_GRID = {
+    "threshold":            [45.0, 50.0, 55.0, 60.0, 65.0, 70.0],
+    "hysteresis":           [4.0, 8.0, 12.0, 16.0],
+    "req_frames":           [2, 4, 6],
+    "cooldown_s":           [0.4, 0.8, 1.2],
+    "bias_upper_per_score": [0.0, 4.0, 8.0, 12.0],
+    "bias_lower_per_score": [0.0, 4.0, 8.0],
+    "flicker_force_t":      [0.35, 0.5, 0.7, 0.9],
+}
+
+DEFAULT_WEIGHTS = {"latency": 1.0, "false_per_h": 0.5, "strobe_miss": 5.0, "idle_down": 2.0}
+
+
+# ---------------- labeled traces ----------------
+class LabeledTrace:
+    def __init__(self, name, ts, luma, glare=(), strobe=()):
+        self.name = name
+        self.ts = np.asarray(ts, dtype=np.float64)
+        self.luma = np.asarray(luma, dtype=np.float64)
+        self.glare = [tuple(iv) for iv in glare]
+        self.strobe = [tuple(iv) for iv in strobe]
+        self._index()
+
+    def _index(self):
+        ts = self.ts
+        self.events = [(np.searchsorted(ts, a), np.searchsorted(ts, b), a, b)
+                       for a, b in sorted(self.glare + self.strobe)]
+        self.in_event = np.zeros(len(ts), dtype=bool)
+        for ia, ib, _, _ in self.events:
+            self.in_event[ia:ib] = True
+        self.in_strobe = np.zeros(len(ts), dtype=bool)
+        for a, b in self.strobe:
+            self.in_strobe[np.searchsorted(ts, a):np.searchsorted(ts, b)] = True
+        self.hours = max(1e-9, (ts[-1] - ts[0]) / 3600.0) if len(ts) else 1e-9
+
+
+def load_recorded(path):
+    from sensor_trace import load_traces, KIND_FRAME
+
+    recs = load_traces([path])
+    frames = recs[recs["kind"] == KIND_FRAME]
+    labels_path = os.path.splitext(path)[0] + ".labels.json"
+    labels = {}
+    if os.path.exists(labels_path):
+        with open(labels_path) as f:
+            labels = json.load(f)
+    else:
+        print(f"⚠ {path}: no {labels_path}; every visor-down move counts as false")
+    return LabeledTrace(os.path.basename(path), frames["t"], frames["a"],
+                        labels.get("glare", ()), labels.get("strobe", ()))
+
+
+def synthetic_traces(seed=0, minutes=10.0, fps=30.0):
+    """Venue-like luma: drifting dim baseline with sensor noise, stage-light glare,
+    7-12 Hz strobes, and unlabeled distractors (photo flashes, slow pans near
+    the threshold) that should *not* move the visor."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for k in range(4):
+        T = int(minutes * 60 * fps)
+        ts = np.cumsum(np.full(T, 1.0 / fps) + rng.normal(0, 0.002, T))
+        base = 35.0 + 8.0 * rng.random()
+        drift = sum(a * np.sin(2 * np.pi * f * ts + ph) for a, f, ph in
+                    zip(rng.uniform(1, 3, 3), rng.uniform(0.005, 0.3, 3), rng.uniform(0, 6.28, 3)))
+        luma = base + drift + rng.normal(0, 0.4, T)
+        glare, strobe = [], []
+        t = 20.0
+        while t < ts[-1] - 40:
+            kind = rng.choice(["glare", "strobe", "flash", "pan", "none"], p=[.3, .25, .2, .1, .15])
+            dur = rng.uniform(4, 25)
+            m = (ts >= t) & (ts < t + dur)
+            if kind == "glare":
+                ramp = np.clip((ts[m] - t) / 0.3, 0, 1)
+                luma[m] += ramp * rng.uniform(40, 90)
+                glare.append((t, t + dur))
+            elif kind == "strobe":
+                hz, duty = rng.uniform(6, 12), rng.uniform(0.15, 0.5)
+                on = ((ts[m] - t) * hz) % 1.0 < duty
+                luma[m] += on * rng.uniform(40, 110)
+                strobe.append((t, t + dur))
+            elif kind == "flash":
+                mf = (ts >= t) & (ts < t + 0.1)
+                luma[mf] += 120
+                dur = 1.0
+            elif kind == "pan":
+                luma[m] += 12 * np.sin(np.pi * (ts[m] - t) / dur)
+            t += dur + rng.uniform(8, 30)
+        out.append(LabeledTrace(f"synthetic-{seed}-{k}", ts, np.clip(luma, 0, 255), glare, strobe))
+    return out
+
+
+# ---------------- objectives ----------------
+def score_states(trace, states):
+    """Objectives for a (P, T) visor state matrix on one trace"""
+    P = states.shape[0]
+    ts = trace.ts
+    lat_sum = np.zeros(P)
+    for ia, ib, a, b in trace.events:
+        if ib <= ia:
+            continue
+        sub = states[:, ia:ib]
+        hit = sub.any(axis=1)
+        first = sub.argmax(axis=1)
+        miss = min(b - a, MISS_PENALTY_CAP_S)
+        lat_sum += np.where(hit, np.maximum(0.0, ts[ia + first] - a), miss)
+    n_events = max(1, len(trace.events))
+
+    edges = np.diff(states.astype(np.int8), axis=1) == 1
+    false = (edges & ~trace.in_event[1:]).sum(axis=1)
+
+    n_strobe = trace.in_strobe.sum()
+    strobe_down = states[:, trace.in_strobe].sum(axis=1) / n_strobe if n_strobe else np.ones(P)
+    idle = ~trace.in_event
+    idle_down = states[:, idle].sum(axis=1) / max(1, idle.sum())
+
+    return {"latency": lat_sum / n_events,
+            "false_per_h": false / trace.hours,
+            "strobe_miss": 1.0 - strobe_down,
+            "idle_down": idle_down}
+
+
+def combine(objs, weights):
+    return sum(weights[k] * objs[k] for k in weights)
+
+
+# ---------------- process pool ----------------
+_traces = None
+_flicker = None
+
+
+def _init_worker(traces):
+    global _traces, _flicker
+    _traces = traces
+    _flicker = [dict() for _ in traces]
+
+
+def _evaluate(params_chunk):
+    """Mean objectives over all traces for a chunk of parameter sets"""
+    total = None
+    for i, tr in enumerate(_traces):
+        res = run_batch(tr.luma, tr.ts, params_chunk, record=True, flicker=_flicker[i])
+        objs = score_states(tr, res["states"])
+        total = objs if total is None else {k: total[k] + objs[k] for k in total}
+    return {k: v / len(_traces) for k, v in total.items()}
+
+
+def evaluate_all(pool, params_list, chunk):
+    chunks = [params_list[i:i + chunk] for i in range(0, len(params_list), chunk)]
+    parts = list(pool.map(_evaluate, chunks))
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def grid_search(pool, base, grid, weights, chunk):
+    params_list = param_grid(base, **grid)
+    print(f"Grid: {len(params_list)} parameter sets")
+    objs = evaluate_all(pool, params_list, chunk)
+    return params_list, objs, combine(objs, weights)
+
+
+def bayes_search(pool, base, grid, weights, chunk, trials, batch):
+    """Optuna TPE over the grid's ranges, evaluating `batch` trials per pool round"""
+    try:
+        import optuna
+    except ImportError:
+        sys.exit("✗ --search bayes needs optuna (pip install optuna)")
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.create_study(direction="minimize", sampler=optuna.samplers.TPESampler(seed=0))
+
+    def suggest(trial):
+        kw = {}
+        for name, values in grid.items():
+            lo, hi = min(values), max(values)
+            if name == "req_frames":
+                kw[name] = trial.suggest_int(name, int(lo), int(hi))
+            else:
+                kw[name] = trial.suggest_float(name, float(lo), float(hi))
+        return base.with_(**kw)
+
+    all_params, all_objs = [], []
+    while len(all_params) < trials:
+        round_trials = [study.ask() for _ in range(min(batch, trials - len(all_params)))]
+        params_list = [suggest(t) for t in round_trials]
+        objs = evaluate_all(pool, params_list, chunk)
+        scores = combine(objs, weights)
+        for t, s in zip(round_trials, scores):
+            study.tell(t, float(s))
+        all_params += params_list
+        all_objs.append(objs)
+        print(f"  {len(all_params)}/{trials} trials, best {study.best_value:.3f}")
+    objs = {k: np.concatenate([o[k] for o in all_objs]) for k in all_objs[0]}
+    return all_params, objs, combine(objs, weights)
+
+
+def parse_axis(spec):
+    """'name=a:b:n' (linspace) or 'name=v1,v2,...'"""
+    name, _, vals = spec.partition("=")
+    if ":" in vals:
+        a, b, n = vals.split(":")
+        values = np.linspace(float(a), float(b), int(n)).tolist()
+    else:
+        values = [float(v) for v in vals.split(",")]
+    if name == "req_frames":
+        values = sorted({int(round(v)) for v in values})
+    return name, values
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Glare/flicker parameter search')
+    parser.add_argument('--trace', action='append', default=[], help='Recorded .vyzt trace (with .labels.json)')
+    parser.add_argument('--synthetic', type=int, default=None,
+                        help='Synthetic scenario sets to add (default: 1 if no --trace)')
+    parser.add_argument('--grid', nargs='*', default=None, help='Axes, e.g. hysteresis=4:16:7 req_frames=2,3,4')
+    parser.add_argument('--search', choices=['grid', 'bayes'], default='grid')
+    parser.add_argument('--trials', type=int, default=500, help='Bayesian search trials')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=256, help='Parameter sets per task')
+    parser.add_argument('--base', default=GLARE_ENV, help='Start from this settings file (if present)')
+    parser.add_argument('--out', default=GLARE_ENV, help='Write the best settings here')
+    parser.add_argument('--top', type=int, default=10)
+    for k, v in DEFAULT_WEIGHTS.items():
+        parser.add_argument(f'--w-{k.replace("_", "-")}', dest=f'w_{k}', type=float, default=v)
+    args = parser.parse_args()
+
+    weights = {k: getattr(args, f'w_{k}') for k in DEFAULT_WEIGHTS}
+    grid = dict(parse_axis(a) for a in args.grid) if args.grid else DEFAULT_GRID
+    base = load_params(args.base)
+
+    traces = [load_recorded(p) for p in args.trace]
+    n_synth = args.synthetic if args.synthetic is not None else (0 if traces else 1)
+    for s in range(n_synth):
+        traces += synthetic_traces(seed=s)
+    if not traces:
+        sys.exit("✗ No traces to tune on")
+    hours = sum(t.hours for t in traces)
+    print(f"Traces: {len(traces)} ({hours * 60:.1f} min), workers: {args.workers}")
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(traces,)) as pool:
+        if args.search == 'grid':
+            params_list, objs, scores = grid_search(pool, base, grid, weights, args.chunk)
+        else:
+            params_list, objs, scores = bayes_search(pool, base, grid, weights, args.chunk,
+                                                     args.trials, batch=max(32, args.workers * 8))
+    wall = time.perf_counter() - t0
+
+    order = np.argsort(scores)
+    names = list(grid)
+    print(f"\nEvaluated {len(params_list)} sets in {wall:.1f} s")
+    print(f"{'score':>7} {'latency':>8} {'false/h':>8} {'strobe':>7} {'idle':>6}  " + "  ".join(names))
+    for i in order[:args.top]:
+        p = params_list[i]
+        print(f"{scores[i]:7.3f} {objs['latency'][i]:8.2f} {objs['false_per_h'][i]:8.1f} "
+              f"{objs['strobe_miss'][i]:7.2f} {objs['idle_down'][i]:6.2f}  "
+              + "  ".join(f"{getattr(p, n):g}" for n in names))
+
+    best = order[0]
+    summary = (f"Written by tune_glare.py on {time.strftime('%Y-%m-%d %H:%M')}\n"
+               f"{len(traces)} traces, {hours * 60:.1f} min; score {scores[best]:.3f} "
+               f"(latency {objs['latency'][best]:.2f}s, false/h {objs['false_per_h'][best]:.1f}, "
+               f"strobe miss {objs['strobe_miss'][best]:.2f}, idle down {objs['idle_down'][best]:.2f})")
+    save_params(params_list[best], args.out, summary)
+    print(f"\n✓ Best settings written to {args.out}")
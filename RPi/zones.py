@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Multi-zone luma: a tiled brightness grid from one pass over the frame.
+
+The camera loops used to reduce each frame to one mean over the centre third,
+so an off-centre stage light or a strobe in the periphery never reached the
+glare logic. `ZoneMap.update()` sums the frame straight from BGR (no
+cvtColor) into a 12x12 sub-grid with `cv2.reduce`, and everything else is
+read off those 144 sums:
+
+    zones     mean luma per zone of the ZONE_GRID (any divisor of 12)
+    centre    the old centre-third ROI mean (same pixels, exact)
+    weighted  centre-weighted mean of the zones
+    peak      brightest zone
+    ema       per-zone EMA (GlareParams.ema_alpha)
+    flicker   per-zone flicker score, every `flicker_check_every`
+
+`glare_luma` is what the glare controller gets: a blend of the weighted and
+peak luma, so a bright spot anywhere pulls the visor down sooner.
+
+Cost check against the old cvtColor + ROI mean:
+    python zones.py --bench
+"""
+import numpy as np
+
+from glare import GlareParams, LUM_BUF_LEN, FLICKER_FS_MIN, FLICKER_FS_MAX
+
+ZONE_GRID  = (4, 4)     # rows, cols
+SUBGRID    = 12         # lcm of 3 (centre third) and 4 (zones)
+PEAK_WEIGHT = 0.3       # glare_luma = (1 - w) * weighted + w * peak
+CENTRE_SIGMA = 0.35     # zone weighting falloff, in frame widths/heights
+
+# cv2's BGR -> gray coefficients
+BGR_LUMA = (0.114, 0.587, 0.299)
+
+GLARE_INPUT_BLEND  = "blend"
+GLARE_INPUT_CENTRE = "centre"   # legacy: centre-third mean only
+
+
+def subgrid_edges(h, w):
+    """Row edges (SUBGRID + 1) and column starts (SUBGRID) of the sub-grid cells"""
+    rows = [(h * k) // SUBGRID for k in range(SUBGRID + 1)]
+    cols = [(w * k) // SUBGRID for k in range(SUBGRID)]
+    return rows, cols
+
+
+def centre_weights(grid=ZONE_GRID, sigma=CENTRE_SIGMA):
+    """Gaussian weights by zone-centre distance from the frame centre (sum 1)"""
+    gy, gx = grid
+    cy = (np.arange(gy) + 0.5) / gy - 0.5
+    cx = (np.arange(gx) + 0.5) / gx - 0.5
+    w = np.exp(-(cy[:, None] ** 2 + cx[None, :] ** 2) / (2 * sigma ** 2))
+    return w / w.sum()
+
+
+def roi_luma(img):
+    """Centre-third mean luma of a gray, BGR or BGRx image (the fast flicker path)"""
+    import cv2
+
+    h, w = img.shape[:2]
+    m = cv2.mean(img[h//3:2*h//3, w//3:2*w//3])
+    if img.ndim == 2:
+        return m[0]
+    return m[0] * BGR_LUMA[0] + m[1] * BGR_LUMA[1] + m[2] * BGR_LUMA[2]
+
+
+def zone_flicker_scores(ts, X, band_lo=3.0, band_hi=15.0):
+    """`glare.compute_flicker_score` for every column of X (T, Z) at once"""
+    n, nz = X.shape
+    scores = np.zeros(nz)
+    if n < 20:
+        return scores
+    dur = ts[-1] - ts[0]
+    if dur < 0.8:
+        return scores
+
+    est_fs = max(FLICKER_FS_MIN, min(FLICKER_FS_MAX, n / dur))
+    band_hi = min(band_hi, 0.5 * est_fs)
+    t_uniform = np.linspace(ts[0], ts[-1], int(est_fs * dur), endpoint=True)
+    # One set of interpolation weights shared by all zones
+    i = np.clip(np.searchsorted(ts, t_uniform, side="right") - 1, 0, n - 2)
+    span = ts[i + 1] - ts[i]
+    frac = np.divide(t_uniform - ts[i], span, out=np.zeros_like(span), where=span > 0)
+    Xu = X[i] + (X[i + 1] - X[i]) * frac[:, None]
+
+    x = Xu - Xu.mean(axis=0)
+    live = np.max(np.abs(x), axis=0) >= 1e-6
+    w = np.hanning(len(x))
+    P = np.abs(np.fft.rfft(x * w[:, None], axis=0)) ** 2
+    freqs = np.fft.rfftfreq(len(x), 1.0 / est_fs)
+
+    band = (freqs >= band_lo) & (freqs <= band_hi)
+    num = P[band].sum(axis=0)
+    den = P[1:].sum(axis=0) + 1e-9
+    scores[live] = np.clip(num[live] / den[live], 0.0, 1.0)
+    return scores
+
+
+class ZoneMap:
+    def __init__(self, grid=ZONE_GRID, params: GlareParams = None, peak_weight=PEAK_WEIGHT,
+                 weights=None, glare_input=GLARE_INPUT_BLEND, buf_len=LUM_BUF_LEN):
+        gy, gx = grid
+        if SUBGRID % gy or SUBGRID % gx:
+            raise ValueError(f"zone grid {grid} must divide {SUBGRID}")
+        self.grid = (gy, gx)
+        self.p = params or GlareParams()
+        self.peak_weight = float(peak_weight)
+        self.weights = centre_weights(grid) if weights is None else np.asarray(weights, float) / np.sum(weights)
+        self.glare_input = glare_input
+
+        self._shape = None
+        self._ts = np.zeros(buf_len)
+        self._xs = np.zeros((buf_len, gy * gx), dtype=np.float32)
+        self._n = 0
+        self._last_check = 0.0
+
+        self.zones = np.zeros(grid)
+        self.ema = None
+        self.flicker = np.zeros(grid)
+        self.centre = 0.0
+        self.weighted = 0.0
+        self.peak = 0.0
+        self.peak_zone = (0, 0)
+
+    def _layout(self, shape):
+        h, w = shape[:2]
+        c = shape[2] if len(shape) == 3 else 1
+        rows, cols = subgrid_edges(h, w)
+        self._rows = rows
+        self._cols = np.asarray(cols)
+        self._luma = np.asarray(BGR_LUMA + (0.0,) * (c - 3)) if c >= 3 else np.ones(1)
+        self._c = c
+        # Pixel count of every sub-cell, summed per zone and for the centre third
+        area = np.outer(np.diff(rows), np.diff(cols + [w]))
+        self._zone_area = self._block(area)
+        self._centre_area = area[4:8, 4:8].sum()
+        self._shape = shape
+
+    def _block(self, a):
+        gy, gx = self.grid
+        return a.reshape(gy, SUBGRID // gy, gx, SUBGRID // gx).sum(axis=(1, 3))
+
+    def channel_sums(self, frame):
+        """Exact per-channel pixel sums of every sub-grid cell, (SUBGRID, SUBGRID, c)"""
+        import cv2
+
+        if frame.shape != self._shape:
+            self._layout(frame.shape)
+        h, w = frame.shape[:2]
+        c, rows = self._c, self._rows
+        flat = frame.reshape(h, w * c)
+        line = np.empty((SUBGRID, w * c))
+        for k in range(SUBGRID):
+            line[k] = cv2.reduce(flat[rows[k]:rows[k + 1]], 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S)[0]
+        return np.add.reduceat(line.reshape(SUBGRID, w, c), self._cols, axis=1)
+
+    def _sub_sums(self, frame):
+        return self.channel_sums(frame) @ self._luma
+
+    def update(self, frame, now, flicker=True):
+        """Analyse one frame (BGR, BGRx or gray); returns `glare_luma`.
+        With flicker=False the caller runs update_flicker() on its own timer."""
+        return self.update_sums(self.channel_sums(frame), frame.shape, now, flicker)
+
+    def update_sums(self, cells, shape, now, flicker=True):
+        """Same as update() from channel sums computed elsewhere (e.g. on the
+        GPU, see the Jetson vision.py); `shape` is the frame's (h, w[, c])"""
+        if shape != self._shape:
+            self._layout(shape)
+        # Same memory layout as channel_sums() so the dot product sums in the same order
+        sums = np.ascontiguousarray(cells, dtype=np.float64) @ self._luma
+        self.centre = float(sums[4:8, 4:8].sum() / self._centre_area)
+        z = self._block(sums) / self._zone_area
+        self.zones = z
+        self.weighted = float((z * self.weights).sum())
+        k = int(np.argmax(z))
+        self.peak = float(z.flat[k])
+        self.peak_zone = divmod(k, self.grid[1])
+
+        a = self.p.ema_alpha
+        self.ema = z.copy() if self.ema is None else a * z + (1.0 - a) * self.ema
+
+        i = self._n % len(self._ts)
+        self._ts[i] = now
+        self._xs[i] = z.ravel()
+        self._n += 1
+        if flicker and now - self._last_check >= self.p.flicker_check_every:
+            self.update_flicker(now)
+        return self.glare_luma
+
+    def update_flicker(self, now):
+        self._last_check = now
+        self.flicker = self._zone_flicker(now)
+
+    def _zone_flicker(self, now):
+        n = min(self._n, len(self._ts))
+        idx = (np.arange(self._n - n, self._n)) % len(self._ts)
+        ts = self._ts[idx]
+        keep = ts >= now - self.p.win_sec
+        scores = zone_flicker_scores(ts[keep], self._xs[idx][keep], self.p.band_lo_hz, self.p.band_hi_hz)
+        return scores.reshape(self.grid)
+
+    @property
+    def glare_luma(self):
+        if self.glare_input == GLARE_INPUT_CENTRE:
+            return self.centre
+        return (1.0 - self.peak_weight) * self.weighted + self.peak_weight * self.peak
+
+    @property
+    def peak_flicker(self):
+        return float(self.flicker.max())
+
+    def summary(self):
+        """Normalised (0-1) values for store.env and the recommenders"""
+        return {
+            "BRIGHTNESS_PEAK": self.peak / 255.0,
+            "BRIGHTNESS_WEIGHTED": self.weighted / 255.0,
+            "FLICKER_PEAK": self.peak_flicker,
+        }
+
+
+def bench(shape=(480, 640, 3), runs=300):
+    import time
+    import cv2
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=shape, dtype=np.uint8)
+
+    def old():
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        return float(np.mean(gray[h//3:2*h//3, w//3:2*w//3]))
+
+    zm = ZoneMap()
+    zm.update(frame, 0.0)
+    for name, fn in (("cvtColor + ROI mean", old),
+                     ("cvtColor only", lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)),
+                     ("ZoneMap sums", lambda: zm._sub_sums(frame)),
+                     ("ZoneMap.update", lambda: zm.update(frame, 0.0))):
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        print(f"  {name:<22} {(time.perf_counter() - t0) / runs * 1e6:8.1f} us/frame")
+    print(f"  centre luma: old {old():.3f}  zones {zm.centre:.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Multi-zone luma tools')
+    parser.add_argument('--bench', action='store_true', help='Compare cost with cvtColor + ROI mean')
+    parser.add_argument('--size', default='640x480', help='Frame size WxH for --bench')
+    args = parser.parse_args()
+
+    if args.bench:
+        w, h = (int(v) for v in args.size.split('x'))
+        bench((h, w, 3))
+    else:
+        parser.print_help()
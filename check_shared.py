@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Check that the modules shared by RPi/ and Jetson/ haven't drifted apart.
+
+Each board directory is deployed on its own, so the shared modules (glare,
+zones, monitor, dsp, metrics, features, fleet_client, ...) are copies rather
+than imports. Every .py file with the same name in both directories must be
+byte-identical, as must the pairs in RENAMED. Fleet/ imports RPi/'s copy.
+
+Edit one copy, then copy it over the other and run:
+    python check_shared.py            # exits 1 on drift
+    python check_shared.py --diff     # and show what differs
+"""
+import difflib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOARDS = ("RPi", "Jetson")
+
+# Same module, different file name per board
+RENAMED = (
+    ("RPi/AudioFlaskIntegration.py", "Jetson/sound_3.py"),
+)
+
+
+def shared_pairs(root=HERE):
+    a, b = (os.path.join(root, d) for d in BOARDS)
+    names = sorted(set(n for n in os.listdir(a) if n.endswith(".py")) &
+                   set(n for n in os.listdir(b) if n.endswith(".py")))
+    pairs = [(f"{BOARDS[0]}/{n}", f"{BOARDS[1]}/{n}") for n in names]
+    return pairs + list(RENAMED)
+
+
+def check(root=HERE, show_diff=False):
+    ok = True
+    for left, right in shared_pairs(root):
+        with open(os.path.join(root, left), "rb") as f:
+            x = f.read()
+        with open(os.path.join(root, right), "rb") as f:
+            y = f.read()
+        if x == y:
+            print(f"  ✓ {left} = {right}")
+            continue
+        ok = False
+        print(f"  ✗ {left} != {right}")
+        if show_diff:
+            sys.stdout.writelines(difflib.unified_diff(
+                x.decode(errors="replace").splitlines(True), y.decode(errors="replace").splitlines(True),
+                left, right))
+    print(f"{'✓' if ok else '✗'} shared modules {'in sync' if ok else 'have drifted'}")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check the RPi/ and Jetson/ copies of shared modules')
+    parser.add_argument('--diff', action='store_true', help='Show a unified diff for each drifted pair')
+    args = parser.parse_args()
+    sys.exit(0 if check(show_diff=args.diff) else 1)